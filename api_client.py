@@ -1,31 +1,120 @@
 import requests
 from typing import Optional, Dict, Any
+import gzip
 import json
+import time
+import base64
+
+from tracing import current_traceparent, get_tracer
+from user_rate_limiter import RateLimited, UserRateLimiter
+
+# Mirrors the API's per-user limit, so a user over it is told to wait without a round trip.
+# Module level, so the buckets outlive the APIClient rebuilt on every rerun.
+_client_rate_limiter = UserRateLimiter.from_env(shared=False)
+# Time until which the API told each user to back off
+_retry_not_before: Dict[str, float] = {}
+
+
+def decode_api_response(result: Any) -> Dict[str, Any]:
+    """Unwrap the response body from an API Gateway result, whatever its encoding."""
+    if isinstance(result, str):
+        result = json.loads(result)
+    if 'body' not in result:
+        return result
+    body = result['body']
+    if result.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+        if result.get('headers', {}).get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body)
+    # Compact responses carry the body as an object, full responses as a JSON string
+    return json.loads(body) if isinstance(body, str) else body
+
 
 class APIClient:
-    def __init__(self, api_url: str):
-        """Initialize APIClient with API URL."""
+    # "on_demand" responses carry reference stubs; the UI fetches a reference's excerpt and
+    # presigned link only when the user opens it
+    def __init__(self, api_url: str, response_format: str = "compact", reference_detail: str = "on_demand",
+                 api_key: Optional[str] = None):
+        """Initialize APIClient with API URL, the response format to request and the app's API key."""
         self.api_url = api_url
+        # Authenticates the app to the API, which then rate-limits by the user_id it sends
+        self.api_key = api_key
+        self.response_format = response_format
+        self.reference_detail = reference_detail
 
-    def call_api(self, query: str, session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    def _post(self, request_body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        action = request_body.get("action", "chat")
+        with get_tracer().span(f"api.{action}", **{"http.url": self.api_url}) as span:
+            headers = {"Content-Type": "application/json"}
+            if self.api_key:
+                headers["x-api-key"] = self.api_key
+            # Lets the Lambda continue this trace; in the body too, as a non-proxy integration drops headers
+            if traceparent := current_traceparent():
+                headers["traceparent"] = traceparent
+                request_body = {**request_body, "traceparent": traceparent}
+            try:
+                response = requests.post(
+                    url=self.api_url,
+                    headers=headers,
+                    json=request_body,
+                    timeout=30
+                )
+                if span:
+                    span.set("http.status_code", response.status_code)
+                    span.set("http.response_bytes", len(response.content))
+
+                response.raise_for_status()
+                return response.json()
+
+            except requests.exceptions.RequestException as e:
+                print(f"API Error: {str(e)}")
+                if span:
+                    span.set("error", str(e))
+                return None
+
+    @staticmethod
+    def reserve_request(user_id: str) -> float:
+        """Take a chat request from the user's rate limit; seconds to wait if there is none left, else 0."""
+        wait = _retry_not_before.get(user_id, 0.0) - time.time()
+        if wait > 0:
+            return wait
+        if _client_rate_limiter is not None:
+            try:
+                _client_rate_limiter.check(user_id)
+            except RateLimited as e:
+                return e.retry_after
+        return 0.0
+
+    def call_api(self, query: str, session_id: Optional[str] = None,
+                 user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """Call the Lambda function through API Gateway."""
-        try:
-            request_body = {
-                "user_query": query
-            }
-            if session_id:
-                request_body["sessionId"] = session_id
-                
-            response = requests.post(
-                url=self.api_url,
-                headers={"Content-Type": "application/json"},
-                json=request_body,
-                timeout=30
-            )
-            
-            response.raise_for_status()
-            return response.json()
-            
-        except requests.exceptions.RequestException as e:
-            print(f"API Error: {str(e)}")
+        request_body = {
+            "user_query": query,
+            "response_format": self.response_format,
+            "reference_detail": self.reference_detail,
+            "accept_encoding": "gzip"
+        }
+        if session_id:
+            request_body["sessionId"] = session_id
+        if user_id:
+            # Lets the API rate-limit per user
+            request_body["user_id"] = user_id
+        result = self._post(request_body)
+        if user_id and result and result.get("statusCode") == 429:
+            retry_after = decode_api_response(result).get("retry_after_seconds")
+            if retry_after:
+                _retry_not_before[user_id] = time.time() + float(retry_after)
+        return result
+
+    def get_reference(self, ref_id: str, presign: bool = False) -> Optional[Dict[str, Any]]:
+        """Fetch a reference's full snippet and, with presign, a fresh source document URL."""
+        result = self._post({
+            "action": "get_reference",
+            "ref_id": ref_id,
+            "presign": presign,
+            "accept_encoding": "gzip"
+        })
+        if not result or result.get('statusCode') != 200:
             return None
+        return decode_api_response(result)
@@ -9,27 +9,49 @@ from config import PAGE_CONFIG
 from dotenv import load_dotenv
 import os
 from feedback_handler import FeedbackHandler
+from session_store import session_store_from_env
+from session_memory import SessionMemoryManager
+from tracing import configure_tracer
+from rerun_profiler import RerunProfiler
+
+@st.cache_resource
+def shared_session_store():
+    """One session store client per process, None unless SESSION_STORE is set"""
+    load_dotenv()
+    return session_store_from_env()
+
 
 class ChatApplication:
     def __init__(self):
         """Initialize the chat application and its components."""
         load_dotenv()
-        
-        self.feedback_handler = FeedbackHandler()
-        self.auth_handler = AuthHandler(
-            username=os.getenv("CHATBOT_USERNAME"),
-            password=os.getenv("CHATBOT_PASSWORD")
-        )
-        self.api_client = APIClient(os.getenv("API_URL"))
-        self.ui_components = UIComponents(feedback_handler=self.feedback_handler)
-        self.chat_manager = ChatHistoryManager()
-        self.sidebar_manager = SidebarManager(self.chat_manager)
-        self.chat_handler = ChatHandler(self.api_client, self.chat_manager)
+        configure_tracer(os.getenv("TRACE_SERVICE_NAME", "chat-app"))
+        # Times the phases of this rerun, starting with building the components
+        self.profiler = RerunProfiler()
+
+        with self.profiler.phase("init"):
+            self.feedback_handler = FeedbackHandler()
+            self.auth_handler = AuthHandler(
+                username=os.getenv("CHATBOT_USERNAME"),
+                password=os.getenv("CHATBOT_PASSWORD"),
+                session_store=shared_session_store()
+            )
+            self.api_client = APIClient(os.getenv("API_URL"), api_key=os.getenv("API_KEY"))
+            self.chat_manager = ChatHistoryManager()
+            self.session_memory = SessionMemoryManager(self.chat_manager)
+            self.ui_components = UIComponents(
+                feedback_handler=self.feedback_handler,
+                reference_fetcher=self.api_client.get_reference,
+                message_restorer=self.session_memory.restore_message
+            )
+            self.sidebar_manager = SidebarManager(self.chat_manager)
+            self.chat_handler = ChatHandler(self.api_client, self.chat_manager)
 
     def setup_page(self) -> None:
         """Set up the page configuration and layout."""
         st.set_page_config(**PAGE_CONFIG)
         self.ui_components.load_custom_css()
+        self.auth_handler.restore_session()
         self.auth_handler.initialize_session_state()
             # Initialize feedback states
         if 'feedback_states' not in st.session_state:
@@ -49,21 +71,37 @@ class ChatApplication:
 
     def main(self) -> None:
         """Main application loop."""
-        self.setup_page()
+        with self.profiler.phase("setup_page"):
+            self.setup_page()
 
-        if not st.session_state.is_authenticated:
-            if not self.auth_handler.authenticate():
-                return
+        try:
+            if not st.session_state.is_authenticated:
+                with self.profiler.phase("authenticate"):
+                    if not self.auth_handler.authenticate():
+                        return
 
-        self.display_header()
-        self.sidebar_manager.create_sidebar()
-        self.ui_components.display_chat_messages(st.session_state.messages)
+            with self.profiler.phase("header"):
+                self.display_header()
+            with self.profiler.phase("sidebar"):
+                self.sidebar_manager.create_sidebar()
+            self.profiler.display_admin_panel()
+            with self.profiler.phase("transcript"):
+                self.ui_components.display_chat_messages(st.session_state.messages)
 
-        if prompt := st.chat_input("Ask your question...", key="chat_input"):
-            st.markdown(f"""<div class="user-message">
-                        {prompt}
-                    </div>""",  unsafe_allow_html=True)
-            self.chat_handler.handle_chat_input(prompt)
+            if prompt := st.chat_input("Ask your question...", key="chat_input"):
+                st.markdown(f"""<div class="user-message">
+                            {prompt}
+                        </div>""",  unsafe_allow_html=True)
+                # Mostly waiting on the API, so kept apart from the rendering phases
+                with self.profiler.phase("chat_turn"):
+                    self.chat_handler.handle_chat_input(prompt)
+        finally:
+            # Also runs when st.rerun() ends the script early
+            with self.profiler.phase("session_memory"):
+                self.session_memory.enforce()
+            with self.profiler.phase("persist_session"):
+                self.auth_handler.persist_session()
+            self.profiler.finish()
 
 if __name__ == "__main__":
     app = ChatApplication()
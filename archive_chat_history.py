@@ -0,0 +1,160 @@
+"""Move ChatHistory messages older than the hot window to the chat archive.
+
+Finds users with unarchived messages older than CHAT_HISTORY_HOT_DAYS,
+writes those messages to the user's archive objects (chat_archive.py) and
+then marks them with archived_at and an expires_at, so DynamoDB TTL removes
+them from the hot table. A message is only marked after the archive write
+succeeded, and archiving is idempotent, so an interrupted run is simply
+run again. The app reads archived conversations back from the same
+CHAT_ARCHIVE_BUCKET or CHAT_ARCHIVE_PATH when a user opens them.
+
+Run it on a schedule, either as its own Lambda (handler:
+archive_chat_history.archive_handler, e.g. from a daily EventBridge rule) or
+from the command line:
+
+    python archive_chat_history.py --enable-ttl     # once, turns on TTL for expires_at
+    python archive_chat_history.py --hot-days 30
+    python archive_chat_history.py --users alice --dry-run
+"""
+import os
+import json
+import time
+import logging
+import argparse
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from chat_archive import ChatArchive, chat_archive_from_env
+from client_config import create_resource
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def users_with_cold_items(history_table, cutoff: Decimal) -> List[str]:
+    """Users with messages older than cutoff that are not archived yet"""
+    users = set()
+    scan_kwargs = {
+        'FilterExpression': Attr('timestamp').lt(cutoff) & Attr('archived_at').not_exists(),
+        'ProjectionExpression': 'user_id'
+    }
+    while True:
+        response = history_table.scan(**scan_kwargs)
+        users.update(item['user_id'] for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return sorted(users)
+
+
+def cold_items(history_table, user_id: str, cutoff: Decimal) -> List[Dict[str, Any]]:
+    """The user's messages older than cutoff, archived or not"""
+    items = []
+    query_kwargs = {'KeyConditionExpression': Key('user_id').eq(user_id) & Key('timestamp').lt(cutoff)}
+    while True:
+        response = history_table.query(**query_kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def archive_user(history_table, archive: ChatArchive, user_id: str, cutoff: Decimal,
+                 expire_after_seconds: float = 0, dry_run: bool = False) -> Dict[str, int]:
+    """Archive one user's cold messages and mark them to expire from the hot table"""
+    items = cold_items(history_table, user_id, cutoff)
+    pending = [item for item in items if 'archived_at' not in item]
+    if dry_run or not pending:
+        return {'messages': len(pending), 'archived': 0}
+
+    # Every cold message is passed, so the index stays complete even after an interrupted run
+    added = archive.archive(user_id, items)
+    now = time.time()
+    for item in pending:
+        history_table.update_item(
+            Key={'user_id': user_id, 'timestamp': item['timestamp']},
+            UpdateExpression='SET archived_at = :archived_at, expires_at = :expires_at',
+            ExpressionAttributeValues={
+                ':archived_at': Decimal(str(round(now, 3))),
+                ':expires_at': int(now + expire_after_seconds)
+            }
+        )
+    return {'messages': len(pending), 'archived': added}
+
+
+def archive_history(history_table, archive: ChatArchive, hot_days: float = 30,
+                    users: Optional[List[str]] = None, expire_after_seconds: float = 0,
+                    dry_run: bool = False) -> Dict[str, Any]:
+    """Archive the messages of all (or the given) users that are older than hot_days"""
+    cutoff = Decimal(str(time.time() - hot_days * 86400))
+    users = users or users_with_cold_items(history_table, cutoff)
+    logger.info(f"Archiving messages older than {hot_days} days for {len(users)} users")
+    report = {'users': len(users), 'messages': 0, 'archived': 0, 'failed_users': 0, 'dry_run': dry_run}
+    for user_id in users:
+        try:
+            counts = archive_user(history_table, archive, user_id, cutoff, expire_after_seconds, dry_run)
+        except Exception as e:
+            logger.error(f"Error archiving history of {user_id}: {str(e)}")
+            report['failed_users'] += 1
+            continue
+        report['messages'] += counts['messages']
+        report['archived'] += counts['archived']
+    return report
+
+
+def enable_ttl(history_table) -> None:
+    """Let DynamoDB delete ChatHistory items once their expires_at has passed"""
+    try:
+        history_table.meta.client.update_time_to_live(
+            TableName=history_table.name,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+        )
+        logger.info(f"Enabled TTL on {history_table.name}.expires_at")
+    except history_table.meta.client.exceptions.ClientError as e:
+        # Raised when TTL is already enabled
+        logger.info(f"TTL not changed: {str(e)}")
+
+
+def archive_handler(event, context):
+    """Scheduled Lambda entry point; event keys override the CHAT_HISTORY_* defaults"""
+    event = event or {}
+    archive = chat_archive_from_env()
+    if archive is None:
+        raise ValueError("CHAT_ARCHIVE_BUCKET or CHAT_ARCHIVE_PATH must be set")
+    history_table = create_resource('dynamodb', 'dynamodb').Table(os.environ.get('CHAT_HISTORY_TABLE', 'ChatHistory'))
+    if event.get('enable_ttl'):
+        enable_ttl(history_table)
+    return archive_history(
+        history_table,
+        archive,
+        hot_days=float(event.get('hot_days', os.environ.get('CHAT_HISTORY_HOT_DAYS', 30))),
+        users=event.get('users'),
+        expire_after_seconds=float(event.get('expire_after_hours',
+                                             os.environ.get('CHAT_ARCHIVE_EXPIRE_AFTER_HOURS', 24))) * 3600,
+        dry_run=bool(event.get('dry_run'))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive ChatHistory messages older than the hot window")
+    parser.add_argument('--hot-days', type=float, help="Messages older than this are archived (default: CHAT_HISTORY_HOT_DAYS or 30)")
+    parser.add_argument('--users', nargs='+', help="Only archive these users")
+    parser.add_argument('--expire-after-hours', type=float,
+                        help="Keep archived messages in the hot table this long (default: CHAT_ARCHIVE_EXPIRE_AFTER_HOURS or 24)")
+    parser.add_argument('--dry-run', action='store_true', help="Count the messages to archive without writing")
+    parser.add_argument('--enable-ttl', action='store_true', help="Enable TTL on expires_at first")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    event = {'users': args.users, 'dry_run': args.dry_run, 'enable_ttl': args.enable_ttl}
+    if args.hot_days is not None:
+        event['hot_days'] = args.hot_days
+    if args.expire_after_hours is not None:
+        event['expire_after_hours'] = args.expire_after_hours
+    print(json.dumps(archive_handler(event, None), indent=2))
+
+
+if __name__ == "__main__":
+    main()
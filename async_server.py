@@ -0,0 +1,197 @@
+"""Long-running ASGI entry point for the chat pipeline.
+
+Serves the same contract as the API Gateway integration (and
+local_api_server.py): the POST body becomes event['body'] and the whole
+lambda_handler result is returned as JSON. One process serves many requests
+concurrently, running lambda_handler on a thread pool, so requests share
+warm clients and caches instead of paying a Lambda invocation each.
+
+RerankBatcher can micro-batch their Cohere rerank calls, but it only merges
+calls with the same model and query, so it only helps traffic with many
+concurrent duplicate queries; on a realistic mix it merges almost nothing
+and the window only adds latency, so it is off unless
+RERANK_BATCH_WINDOW_MS is set.
+
+    uvicorn async_server:app --host 0.0.0.0 --port 8080
+    python async_server.py --port 8080 --stub --latency-profile realistic
+
+Configuration: SERVER_WORKERS (threads running lambda_handler, default 64),
+RERANK_BATCH_WINDOW_MS (default 0, batching off) and SERVER_API_KEYS
+(comma-separated). Like API Gateway, the server passes the caller's address
+and, for a request whose x-api-key header is one of SERVER_API_KEYS, the
+key's ID in requestContext, so rate limits and FAIR_QUEUE_MAX_CONCURRENT
+see the chat app's users rather than one client.
+"""
+import os
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from rerank_batcher import RerankBatcher
+from traffic_capture import CapturingClient
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineApp:
+    """ASGI application running lambda_handler for every POST request"""
+
+    def __init__(self, lambda_module=None, workers: Optional[int] = None, batch_window_ms: Optional[float] = None):
+        self.lambda_module = lambda_module
+        self.workers = workers or int(os.environ.get('SERVER_WORKERS', 64))
+        self.batch_window_ms = (
+            batch_window_ms if batch_window_ms is not None
+            else float(os.environ.get('RERANK_BATCH_WINDOW_MS', 0))
+        )
+        self.api_keys = [key for key in os.environ.get('SERVER_API_KEYS', '').split(',') if key]
+        self.executor = None
+        self.rerank_batcher = None
+        self.requests = 0
+
+    def _identity(self, scope, headers: Dict[str, str]) -> Dict[str, str]:
+        """requestContext.identity as API Gateway would pass it"""
+        identity = {'sourceIp': scope['client'][0] if scope.get('client') else ''}
+        api_key = headers.get('x-api-key', '')
+        if api_key and any(hmac.compare_digest(api_key, key) for key in self.api_keys):
+            identity['apiKeyId'] = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+        return identity
+
+    def startup(self) -> None:
+        if self.lambda_module is None:
+            import lambda_function
+            self.lambda_module = lambda_function
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='pipeline')
+        if self.batch_window_ms > 0:
+            holder, attribute = self._rerank_client_slot()
+            self.rerank_batcher = RerankBatcher(
+                getattr(holder, attribute),
+                asyncio.get_running_loop(),
+                window_ms=self.batch_window_ms
+            )
+            # CohereReranker looks the client up on every call, so this takes effect immediately
+            setattr(holder, attribute, self.rerank_batcher)
+        logger.info(f"Serving lambda_handler with {self.workers} workers, "
+                    f"rerank batch window {self.batch_window_ms} ms")
+
+    def shutdown(self) -> None:
+        if self.rerank_batcher is not None:
+            holder, attribute = self._rerank_client_slot()
+            setattr(holder, attribute, self.rerank_batcher.client)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def _rerank_client_slot(self):
+        """Where the batcher goes: under traffic capture, so capture records each request's own call"""
+        rerank_runtime = self.lambda_module.rerank_runtime
+        if isinstance(rerank_runtime, CapturingClient):
+            return rerank_runtime, 'client'
+        return self.lambda_module, 'rerank_runtime'
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'cpu_seconds': round(time.process_time(), 3),
+            'rerank_batching': self.rerank_batcher.snapshot() if self.rerank_batcher else None
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if scope['method'] == 'GET' and scope['path'] == '/health':
+            await self._send_json(send, 200, {'status': 'ok'})
+        elif scope['method'] == 'GET' and scope['path'] == '/stats':
+            await self._send_json(send, 200, self.stats())
+        elif scope['method'] == 'POST':
+            body = await self._read_body(receive)
+            headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+            event = {
+                'body': body.decode('utf-8'),
+                'headers': headers,
+                'path': scope['path'],
+                'httpMethod': 'POST',
+                'requestContext': {'identity': self._identity(scope, headers)}
+            }
+            self.requests += 1
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.lambda_module.lambda_handler, event, None
+            )
+            await self._send_json(send, 200, result)
+        else:
+            await self._send_json(send, 405, {'error': 'Method not allowed'})
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    self.startup()
+                except Exception as e:
+                    logger.error(f"Error starting up: {str(e)}")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    @staticmethod
+    async def _send_json(send, status: int, payload: Any) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+app = PipelineApp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the chat pipeline from a long-running process")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, help="Threads running lambda_handler (default: SERVER_WORKERS)")
+    parser.add_argument('--batch-window-ms', type=float, help="Rerank batch window (default: RERANK_BATCH_WINDOW_MS)")
+    parser.add_argument('--stub', action='store_true', help="Replace AWS clients with bedrock_stubs")
+    parser.add_argument('--latency-profile', default='zero', help="Stub latency profile (with --stub)")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="Stub latency multiplier (with --stub)")
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("async_server needs uvicorn: pip install uvicorn")
+
+    logging.basicConfig(level=logging.WARNING)
+    lambda_module = None
+    if args.stub:
+        from local_api_server import load_stubbed_lambda
+        lambda_module, _ = load_stubbed_lambda(args.latency_profile, args.time_scale)
+    server_app = PipelineApp(lambda_module, workers=args.workers, batch_window_ms=args.batch_window_ms)
+    uvicorn.run(server_app, host=args.host, port=args.port, log_level='warning', lifespan='on')
+
+
+if __name__ == "__main__":
+    main()
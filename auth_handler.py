@@ -1,12 +1,30 @@
 import streamlit as st
 import time
+import hashlib
 from typing import Optional
+from session_store import SessionStore, encode_state, is_session_token, new_session_token
+
+# Session state that follows the user across workers when a session store is configured.
+# Authentication is not among it: the token travels in the URL (shared links, browser
+# history, proxy logs), so it only brings back a conversation once its user has logged in again.
+PERSISTED_KEYS = (
+    'user_id', 'messages', 'session_id', 'current_conversation_id',
+    'feedback_states', 'show_feedback_categories', 'selected_category'
+)
+SESSION_QUERY_PARAM = 'sid'
+
+
+def stable_user_id(username: str) -> str:
+    """User ID that is the same on every worker and across restarts, unlike hash()"""
+    return f"user_{hashlib.sha256(username.encode('utf-8')).hexdigest()[:32]}"
+
 
 class AuthHandler:
-    def __init__(self, username: str, password: str):
-        """Initialize AuthHandler with credentials."""
+    def __init__(self, username: str, password: str, session_store: Optional[SessionStore] = None):
+        """Initialize AuthHandler with credentials and an optional shared session store."""
         self.username = username
         self.password = password
+        self.session_store = session_store
 
     def authenticate(self) -> bool:
         """Handle user authentication."""
@@ -18,9 +36,19 @@ class AuthHandler:
         
         if st.button("Login"):
             if username == self.username and password == self.password:
+                user_id = stable_user_id(username)
                 st.session_state.is_authenticated = True
-                st.session_state.user_id = f"user_{hash(username)}"
-                self.create_new_session()
+                st.session_state.user_id = user_id
+                restored = st.session_state.pop('_restored_state', None)
+                if restored and restored.get('user_id') == user_id:
+                    # Continue where this user left off on another worker
+                    for key, value in restored.items():
+                        st.session_state[key] = value
+                    st.session_state._session_snapshot = encode_state(restored)
+                else:
+                    self.create_new_session()
+                    if self.session_store is not None:
+                        st.query_params[SESSION_QUERY_PARAM] = new_session_token()
                 st.rerun()
             else:
                 st.error("Invalid username or password")
@@ -31,11 +59,45 @@ class AuthHandler:
         """Clear session state and logout user."""
         with st.spinner(""):
             time.sleep(1)
+            token = st.query_params.get(SESSION_QUERY_PARAM)
+            if self.session_store is not None and token:
+                if is_session_token(token):
+                    self.session_store.delete(token)
+                del st.query_params[SESSION_QUERY_PARAM]
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
             self.initialize_session_state()
             st.rerun()
 
+    def restore_session(self) -> None:
+        """Load session state saved by any worker, once per browser session, to apply after login."""
+        if self.session_store is None or st.session_state.get('_session_restored'):
+            return
+        st.session_state._session_restored = True
+        token = st.query_params.get(SESSION_QUERY_PARAM)
+        if not token:
+            return
+        state = self.session_store.load(token) if is_session_token(token) else None
+        if state is None:
+            # Malformed, expired or unknown, so the user logs in again with a fresh token
+            del st.query_params[SESSION_QUERY_PARAM]
+            return
+        # States saved before is_authenticated stopped being persisted may still carry it
+        st.session_state._restored_state = {key: state[key] for key in PERSISTED_KEYS if key in state}
+
+    def persist_session(self) -> None:
+        """Save the persisted keys if this run changed them."""
+        token = st.query_params.get(SESSION_QUERY_PARAM)
+        if (self.session_store is None or not is_session_token(token)
+                or not st.session_state.get('is_authenticated')):
+            return
+        state = {key: st.session_state[key] for key in PERSISTED_KEYS if key in st.session_state}
+        snapshot = encode_state(state)
+        if snapshot == st.session_state.get('_session_snapshot'):
+            return
+        self.session_store.save(token, state)
+        st.session_state._session_snapshot = snapshot
+
     def initialize_session_state(self) -> None:
         """Initialize all session state variables."""
         if 'is_authenticated' not in st.session_state:
@@ -0,0 +1,361 @@
+import io
+import re
+import json
+import math
+import time
+import zlib
+import random
+import hashlib
+import threading
+from collections import Counter
+from typing import Dict, Any, List, Optional
+
+from query_features import content_terms
+
+# Latencies observed for each upstream call, in milliseconds
+REALISTIC_LATENCY_PROFILE = {
+    'retrieve_and_generate': {'distribution': 'lognormal', 'median_ms': 2500, 'sigma': 0.35},
+    'retrieve': {'distribution': 'lognormal', 'median_ms': 350, 'sigma': 0.3},
+    'converse': {'distribution': 'lognormal', 'median_ms': 1800, 'sigma': 0.35},
+    # Cross-region call to the us-west-2 reranker
+    'invoke_model': {'distribution': 'lognormal', 'median_ms': 250, 'sigma': 0.4},
+    'generate_presigned_url': {'distribution': 'constant', 'ms': 0.2}
+}
+
+ZERO_LATENCY_PROFILE = {operation: {'distribution': 'constant', 'ms': 0} for operation in REALISTIC_LATENCY_PROFILE}
+
+LATENCY_PROFILES = {
+    'realistic': REALISTIC_LATENCY_PROFILE,
+    'zero': ZERO_LATENCY_PROFILE
+}
+
+FILLER_WORDS = (
+    'employee manager policy request approval process department company annual period '
+    'section document guideline eligible required submit form review days week month '
+    'payroll benefit team office system record notice contract schedule training update'
+).split()
+
+_PROMPT_QUESTION = re.compile(r'Question:\s*(.*)')
+
+
+class LatencyModel:
+    """Sample call latency from a configured distribution.
+
+    Supported distributions:
+      - constant:  {'ms': 5}
+      - uniform:   {'low_ms': 5, 'high_ms': 20}
+      - normal:    {'mean_ms': 10, 'stddev_ms': 2}
+      - lognormal: {'median_ms': 250, 'sigma': 0.4}
+      - empirical: {'samples_ms': [240, 310, ...]}, e.g. recorded latencies
+    """
+
+    def __init__(self, config: Dict[str, Any], seed: int = 0, time_scale: float = 1.0):
+        self.config = config
+        self.distribution = config.get('distribution', 'constant')
+        self.time_scale = time_scale
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_ms(self) -> float:
+        """Draw one latency sample in milliseconds"""
+        config = self.config
+        with self._lock:
+            if self.distribution == 'constant':
+                value = config.get('ms', 0)
+            elif self.distribution == 'uniform':
+                value = self._random.uniform(config['low_ms'], config['high_ms'])
+            elif self.distribution == 'normal':
+                value = self._random.gauss(config['mean_ms'], config['stddev_ms'])
+            elif self.distribution == 'lognormal':
+                value = self._random.lognormvariate(math.log(config['median_ms']), config['sigma'])
+            elif self.distribution == 'empirical':
+                value = self._random.choice(config['samples_ms'])
+            else:
+                raise ValueError(f"Unknown latency distribution: {self.distribution}")
+        return max(0.0, value)
+
+    def wait(self) -> float:
+        """Sleep for one sampled latency and return the unscaled sample"""
+        latency_ms = self.sample_ms()
+        if latency_ms and self.time_scale:
+            time.sleep(latency_ms * self.time_scale / 1000)
+        return latency_ms
+
+
+def resolve_latency_profile(profile) -> Dict[str, Dict[str, Any]]:
+    """Accept a profile name, a path to a JSON profile or a profile dict"""
+    if isinstance(profile, dict):
+        resolved = dict(ZERO_LATENCY_PROFILE)
+        resolved.update(profile)
+        return resolved
+    if profile in LATENCY_PROFILES:
+        return LATENCY_PROFILES[profile]
+    with open(profile) as f:
+        return resolve_latency_profile(json.load(f))
+
+
+def stable_seed(*parts) -> int:
+    """Seed derived from its inputs that does not change between processes"""
+    return zlib.crc32('|'.join(str(part) for part in parts).encode())
+
+
+class SyntheticCorpus:
+    """Deterministic knowledge base content generated from the query text"""
+
+    def __init__(self, seed: int = 0, documents: int = 40, relevant_ratio: float = 0.6):
+        self.seed = seed
+        self.documents = documents
+        self.relevant_ratio = relevant_ratio
+
+    def passages(self, query: str, count: int) -> List[Dict[str, Any]]:
+        """Return count passages for a query, roughly relevant_ratio of them on topic"""
+        rng = random.Random(stable_seed(self.seed, query))
+        terms = sorted(content_terms(query)) or ['policy']
+        passages = []
+        for index in range(count):
+            on_topic = rng.random() < self.relevant_ratio
+            sentences = []
+            for _ in range(rng.randint(4, 9)):
+                words = rng.sample(FILLER_WORDS, rng.randint(8, 14))
+                if on_topic:
+                    words[rng.randrange(len(words))] = rng.choice(terms)
+                sentences.append(' '.join(words).capitalize() + '.')
+            document = rng.randrange(self.documents)
+            passages.append({
+                'uri': f"s3://benchmark-kb/docs/document-{document}.pdf",
+                'text': ' '.join(sentences),
+                'score': round(rng.uniform(0.4, 0.9) if on_topic else rng.uniform(0.1, 0.5), 4)
+            })
+        passages.sort(key=lambda passage: passage['score'], reverse=True)
+        return passages
+
+
+class FixtureStore:
+    """Recorded upstream responses keyed by operation and request key"""
+
+    def __init__(self, fixtures: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.fixtures = fixtures or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> 'FixtureStore':
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            with open(path, 'w') as f:
+                json.dump(self.fixtures, f, indent=2, default=str)
+
+    def get(self, operation: str, key: str) -> Optional[Any]:
+        return self.fixtures.get(operation, {}).get(key)
+
+    def put(self, operation: str, key: str, value: Any) -> None:
+        with self._lock:
+            self.fixtures.setdefault(operation, {})[key] = value
+
+
+def fixture_key(operation: str, request: Dict[str, Any]) -> str:
+    """Key a recorded response by the part of the request that determines it"""
+    if operation == 'retrieve_and_generate':
+        return request['input']['text']
+    if operation == 'retrieve':
+        return request['retrievalQuery']['text']
+    if operation == 'invoke_model':
+        # The rerank body holds both the query and the documents being ranked
+        return hashlib.sha1(request['body'].encode()).hexdigest()
+    if operation == 'converse':
+        prompt = request['messages'][-1]['content'][0]['text']
+        return hashlib.sha1(prompt.encode()).hexdigest()
+    raise ValueError(f"Unsupported operation: {operation}")
+
+
+class _StubClient:
+    """Shared latency, fixture replay and call counting for stub clients"""
+
+    def __init__(self, latency_profile=None, fixtures: Optional[FixtureStore] = None,
+                 corpus: Optional[SyntheticCorpus] = None, seed: int = 0, time_scale: float = 1.0):
+        profile = resolve_latency_profile(latency_profile or 'zero')
+        self.latency = {
+            operation: LatencyModel(config, seed=stable_seed(seed, operation), time_scale=time_scale)
+            for operation, config in profile.items()
+        }
+        self.fixtures = fixtures or FixtureStore()
+        self.corpus = corpus or SyntheticCorpus(seed)
+        self.calls = Counter()
+        self.fixture_hits = Counter()
+        self.fixture_misses = Counter()
+        self._lock = threading.Lock()
+
+    def _begin(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] += 1
+        if operation in self.latency:
+            self.latency[operation].wait()
+
+    def _replay(self, operation: str, request: Dict[str, Any]) -> Optional[Any]:
+        recorded = self.fixtures.get(operation, fixture_key(operation, request))
+        with self._lock:
+            (self.fixture_misses if recorded is None else self.fixture_hits)[operation] += 1
+        return recorded
+
+
+class StubBedrockAgentRuntime(_StubClient):
+    """Stand-in for the bedrock-agent-runtime client"""
+
+    def retrieve_and_generate(self, **request) -> Dict[str, Any]:
+        self._begin('retrieve_and_generate')
+        recorded = self._replay('retrieve_and_generate', request)
+        if recorded is not None:
+            return recorded
+
+        query = request['input']['text']
+        configuration = request['retrieveAndGenerateConfiguration']['knowledgeBaseConfiguration']
+        count = configuration['retrievalConfiguration']['vectorSearchConfiguration']['numberOfResults']
+        passages = self.corpus.passages(query, count)
+
+        # Answer from the first sentence of the top passages so citations are "used"
+        answer = ' '.join(passage['text'].split('. ')[0] + '.' for passage in passages[:2])
+        return {
+            'output': {'text': answer},
+            'sessionId': request.get('sessionId') or f"stub-session-{stable_seed(query)}",
+            'citations': [{
+                'generatedResponsePart': {'textResponsePart': {'text': answer}},
+                'retrievedReferences': [
+                    {
+                        'content': {'text': passage['text']},
+                        'location': {'type': 'S3', 's3Location': {'uri': passage['uri']}}
+                    }
+                    for passage in passages
+                ]
+            }]
+        }
+
+    def retrieve(self, **request) -> Dict[str, Any]:
+        self._begin('retrieve')
+        recorded = self._replay('retrieve', request)
+        if recorded is not None:
+            return recorded
+
+        query = request['retrievalQuery']['text']
+        count = request['retrievalConfiguration']['vectorSearchConfiguration']['numberOfResults']
+        return {
+            'retrievalResults': [
+                {
+                    'content': {'text': passage['text']},
+                    'location': {'type': 'S3', 's3Location': {'uri': passage['uri']}},
+                    'score': passage['score']
+                }
+                for passage in self.corpus.passages(query, count)
+            ]
+        }
+
+
+class StubBedrockRuntime(_StubClient):
+    """Stand-in for the bedrock-runtime client (rerank and converse)"""
+
+    def invoke_model(self, **request) -> Dict[str, Any]:
+        self._begin('invoke_model')
+        recorded = self._replay('invoke_model', request)
+        if recorded is None:
+            body = json.loads(request['body'])
+            query_terms = content_terms(body['query'])
+            results = []
+            for index, document in enumerate(body['documents']):
+                overlap = len(query_terms & content_terms(document)) / max(1, len(query_terms))
+                jitter = (stable_seed(body['query'], index) % 100) / 1000
+                results.append({'index': index, 'relevance_score': round(min(1.0, 0.1 + 0.8 * overlap + jitter), 4)})
+            results.sort(key=lambda result: result['relevance_score'], reverse=True)
+            recorded = {'results': results[:body.get('top_n', len(results))]}
+        return {'body': io.BytesIO(json.dumps(recorded).encode())}
+
+    def converse(self, **request) -> Dict[str, Any]:
+        self._begin('converse')
+        recorded = self._replay('converse', request)
+        if recorded is not None:
+            return recorded
+
+        prompt = request['messages'][-1]['content'][0]['text']
+        results = re.findall(r'<search_result>\n(.*?)\n</search_result>', prompt, re.S)
+        answer = ' '.join(result.split('. ')[0] + '.' for result in results[:2])
+        if not answer:
+            question = _PROMPT_QUESTION.search(prompt)
+            answer = f"No answer found for: {question.group(1) if question else ''}"
+        return {
+            'output': {'message': {'role': 'assistant', 'content': [{'text': answer}]}},
+            'usage': {
+                'inputTokens': math.ceil(len(prompt) / 4),
+                'outputTokens': math.ceil(len(answer) / 4),
+                'totalTokens': math.ceil((len(prompt) + len(answer)) / 4)
+            },
+            'stopReason': 'end_turn'
+        }
+
+
+class StubS3(_StubClient):
+    """Stand-in for the S3 client's presigning"""
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs) -> str:
+        self._begin('generate_presigned_url')
+        Params = Params or {}
+        signature = hashlib.sha1(f"{Params.get('Bucket')}/{Params.get('Key')}".encode()).hexdigest()
+        return (
+            f"https://{Params.get('Bucket')}.s3.amazonaws.com/{Params.get('Key')}"
+            f"?X-Amz-Expires={ExpiresIn}&X-Amz-Signature={signature}"
+        )
+
+
+class RecordingClient:
+    """Wrap a real boto3 client and record its responses into a FixtureStore"""
+
+    def __init__(self, client, fixtures: FixtureStore, operations: List[str]):
+        self._client = client
+        self._fixtures = fixtures
+        self._operations = set(operations)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in self._operations:
+            return attribute
+
+        def record(**request):
+            response = attribute(**request)
+            if name == 'invoke_model':
+                payload = json.loads(response['body'].read())
+                self._fixtures.put(name, fixture_key(name, request), payload)
+                response = {**response, 'body': io.BytesIO(json.dumps(payload).encode())}
+            else:
+                stored = {key: value for key, value in response.items() if key != 'ResponseMetadata'}
+                self._fixtures.put(name, fixture_key(name, request), stored)
+            return response
+
+        return record
+
+
+def install_stubs(module, latency_profile='zero', fixtures: Optional[FixtureStore] = None,
+                  seed: int = 0, time_scale: float = 1.0) -> Dict[str, _StubClient]:
+    """Replace the boto3 clients of lambda_function (or a compatible module) with stubs"""
+    corpus = SyntheticCorpus(seed)
+    options = dict(latency_profile=latency_profile, fixtures=fixtures, corpus=corpus,
+                   seed=seed, time_scale=time_scale)
+    stubs = {
+        'client': StubBedrockAgentRuntime(**options),
+        's3_client': StubS3(**options),
+        'bedrock_runtime': StubBedrockRuntime(**options),
+        'rerank_runtime': StubBedrockRuntime(**options)
+    }
+    for name, stub in stubs.items():
+        current = getattr(module, name, None)
+        if hasattr(current, 'set_clients'):
+            # Regional pools keep their hedging; every region answers from the same stub
+            current.set_clients({region: stub for region in current.regions})
+        else:
+            setattr(module, name, stub)
+    return stubs
+
+
+def install_recorders(module, fixtures: FixtureStore) -> None:
+    """Wrap the real clients of lambda_function so their responses are recorded"""
+    module.client = RecordingClient(module.client, fixtures, ['retrieve_and_generate', 'retrieve'])
+    module.bedrock_runtime = RecordingClient(module.bedrock_runtime, fixtures, ['converse'])
+    module.rerank_runtime = RecordingClient(module.rerank_runtime, fixtures, ['invoke_model'])
@@ -0,0 +1,184 @@
+"""Compare the Lambda path with the long-running async server on the same stubs.
+
+Lambda path: lambda_handler is called in-process from --concurrency threads,
+each standing for one warm Lambda execution environment (one request at a
+time per environment, one vCPU each at 1769 MB). Invocation overhead is not
+modelled, so this is the Lambda path's best case.
+
+Server path: async_server.py runs in its own process with the same stubs and
+latency profile, once with rerank micro-batching and once without, and is
+driven over HTTP by --concurrency keep-alive clients. Its CPU time comes
+from the server's /stats endpoint; the process counts as one vCPU.
+
+Requests pick queries with Zipf popularity, and --session-ratio of them
+carry a session id (follow-up turns, which are not coalesced).
+
+    python benchmark_async_server.py --time-scale 0.2 --concurrency 32 --requests 400
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+import subprocess
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from benchmark_utils import latency_summary, load_query_corpus, write_report
+
+
+def make_events(queries: List[str], count: int, session_ratio: float, mode: str, seed: int = 0) -> List[str]:
+    """Request bodies with Zipf-distributed query popularity"""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(queries))]
+    bodies = []
+    for index in range(count):
+        body = {'user_query': rng.choices(queries, weights=weights)[0], 'pipeline_mode': mode}
+        if rng.random() < session_ratio:
+            body['sessionId'] = f"benchmark-session-{index}"
+        bodies.append(json.dumps(body))
+    return bodies
+
+
+def drive(send: Callable[[str], int], bodies: List[str], concurrency: int) -> Dict[str, Any]:
+    """Send every body from concurrency threads and summarize latency and throughput"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    queue = list(reversed(bodies))
+
+    def worker():
+        nonlocal errors
+        while True:
+            with lock:
+                if not queue:
+                    return
+                body = queue.pop()
+            start = time.perf_counter()
+            status = send(body)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    elapsed = time.perf_counter() - started
+    return {
+        'requests_per_second': round(len(latencies) / elapsed, 2),
+        'latency_ms': latency_summary(latencies),
+        'errors': errors
+    }
+
+
+def run_lambda_path(bodies: List[str], concurrency: int, latency_profile: str, time_scale: float) -> Dict[str, Any]:
+    from local_api_server import load_stubbed_lambda
+    lambda_function, _ = load_stubbed_lambda(latency_profile, time_scale)
+
+    def send(body):
+        response = lambda_function.lambda_handler({'body': body}, None)
+        return response['statusCode']
+
+    cpu_before = time.process_time()
+    result = drive(send, bodies, concurrency)
+    cpu_seconds = time.process_time() - cpu_before
+    return _with_cpu(result, len(bodies), cpu_seconds, vcpus=concurrency)
+
+
+def run_server_path(bodies: List[str], concurrency: int, latency_profile: str, time_scale: float,
+                    batch_window_ms: float, port: int) -> Dict[str, Any]:
+    server = subprocess.Popen(
+        [sys.executable, 'async_server.py', '--port', str(port), '--stub',
+         '--latency-profile', latency_profile, '--time-scale', str(time_scale),
+         '--batch-window-ms', str(batch_window_ms), '--workers', str(max(concurrency, 8))],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        _wait_for_health(port)
+        local = threading.local()
+
+        def send(body):
+            if not hasattr(local, 'connection'):
+                local.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            local.connection.request('POST', '/', body=body, headers={'Content-Type': 'application/json'})
+            response = local.connection.getresponse()
+            payload = json.loads(response.read())
+            return payload['statusCode'] if response.status == 200 else response.status
+
+        stats_before = _get_json(port, '/stats')
+        result = drive(send, bodies, concurrency)
+        stats_after = _get_json(port, '/stats')
+    finally:
+        server.terminate()
+        server.wait()
+    result = _with_cpu(result, len(bodies), stats_after['cpu_seconds'] - stats_before['cpu_seconds'], vcpus=1)
+    result['rerank_batching'] = stats_after['rerank_batching']
+    return result
+
+
+def _with_cpu(result: Dict[str, Any], requests: int, cpu_seconds: float, vcpus: int) -> Dict[str, Any]:
+    result['cpu_ms_per_request'] = round(cpu_seconds * 1000 / requests, 2)
+    result['vcpus'] = vcpus
+    result['requests_per_vcpu_second'] = round(result['requests_per_second'] / vcpus, 2)
+    return result
+
+
+def _get_json(port: int, path: str) -> Dict[str, Any]:
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request('GET', path)
+    return json.loads(connection.getresponse().read())
+
+
+def _wait_for_health(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _get_json(port, '/health')
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"async_server did not start on port {port}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the Lambda path with the async server")
+    parser.add_argument('--queries', nargs='*', help="JSONL query files (default: requests.jsonl or sample_queries.jsonl)")
+    parser.add_argument('--mode', default='two_phase', help="Pipeline mode to run")
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--session-ratio', type=float, default=0.5)
+    parser.add_argument('--latency-profile', default='realistic')
+    parser.add_argument('--time-scale', type=float, default=0.2, help="Stub latency multiplier")
+    parser.add_argument('--batch-window-ms', type=float, default=5)
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--output', help="Write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    bodies = make_events(load_query_corpus(args.queries), args.requests, args.session_ratio, args.mode)
+
+    report = {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'latency_profile': args.latency_profile,
+        'time_scale': args.time_scale,
+        'server_batched': run_server_path(bodies, args.concurrency, args.latency_profile, args.time_scale,
+                                          args.batch_window_ms, args.port),
+        'server_unbatched': run_server_path(bodies, args.concurrency, args.latency_profile, args.time_scale,
+                                            0, args.port),
+        'lambda': run_lambda_path(bodies, args.concurrency, args.latency_profile, args.time_scale)
+    }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
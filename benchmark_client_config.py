@@ -0,0 +1,211 @@
+"""Concurrency scaling of the client_config profiles against a local stub endpoint.
+
+Starts an HTTP server on localhost that answers every AWS call with an empty
+JSON document after a fixed delay, points real botocore clients at it (one
+per profile, plus botocore's defaults for comparison) and measures
+throughput, latency and the TCP connections opened at each concurrency
+level, after warming the pool at that level. Every new connection waits
+--handshake-ms first, standing in for the TLS handshake with a real
+endpoint. urllib3 does not block when a pool is exhausted: it opens an extra
+connection and discards it afterwards, so with the default pool of 10 calls
+beyond 10 concurrent ones keep paying for new connections.
+
+    python benchmark_client_config.py --latency-ms 200 --handshake-ms 100 --concurrency 1 8 16 32 64
+"""
+import os
+import time
+import argparse
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List
+
+import boto3
+from botocore.config import Config
+
+from benchmark_utils import latency_summary, write_report
+from client_config import PROFILES, client_config
+
+# Service and call each profile is exercised with
+WORKLOADS: Dict[str, Dict[str, Any]] = {
+    'bedrock': {
+        'service': 'bedrock-runtime',
+        'call': lambda client: client.converse(
+            modelId='stub-model', messages=[{'role': 'user', 'content': [{'text': 'ping'}]}]
+        )
+    },
+    'rerank': {
+        'service': 'bedrock-runtime',
+        'call': lambda client: client.invoke_model(modelId='stub-rerank', body=b'{}')['body'].read()
+    },
+    'dynamodb': {
+        'service': 'dynamodb',
+        'call': lambda client: client.get_item(TableName='ChatHistory', Key={'user_id': {'S': 'u'}})
+    },
+    'storage': {
+        'service': 's3',
+        'call': lambda client: client.head_object(Bucket='stub-bucket', Key='doc.pdf')
+    },
+    'control': {
+        'service': 'bedrock-agent',
+        'call': lambda client: client.list_data_sources(knowledgeBaseId='STUBKB0001')
+    }
+}
+
+
+def _serve(latency: float, handshake: float, connections, port_queue) -> None:
+    """Run the stub endpoint; in its own process so it does not compete with the clients for the GIL"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            # One handler instance per TCP connection
+            super().setup()
+            with connections.get_lock():
+                connections.value += 1
+            time.sleep(handshake)
+
+        def _answer(self, send_body: bool = True):
+            length = int(self.headers.get('Content-Length', 0))
+            if length:
+                self.rfile.read(length)
+            time.sleep(latency)
+            payload = b'{}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-amz-json-1.0')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(payload)
+
+        def do_POST(self):
+            self._answer()
+
+        def do_GET(self):
+            self._answer()
+
+        def do_HEAD(self):
+            self._answer(send_body=False)
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 256
+
+    server = Server(('127.0.0.1', 0), Handler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class StubEndpoint:
+    """Local HTTP endpoint answering every request with {} after a delay, counting connections"""
+
+    def __init__(self, latency_ms: float, handshake_ms: float):
+        self._connections = multiprocessing.Value('i', 0)
+        port_queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(latency_ms / 1000, handshake_ms / 1000, self._connections, port_queue),
+            daemon=True
+        )
+        self._process.start()
+        self.url = f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+
+    @property
+    def connections(self) -> int:
+        return self._connections.value
+
+    def shutdown(self):
+        self._process.terminate()
+
+
+def run_level(call: Callable[[], Any], concurrency: int, calls_per_worker: int) -> Dict[str, Any]:
+    """Run calls_per_worker calls on each of concurrency threads"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker():
+        nonlocal errors
+        for _ in range(calls_per_worker):
+            start = time.perf_counter()
+            try:
+                call()
+            except Exception:
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    elapsed = time.perf_counter() - started
+    return {
+        'throughput_per_s': round(len(latencies) / elapsed, 1),
+        'latency_ms': latency_summary(latencies),
+        'errors': errors
+    }
+
+
+def benchmark_profile(endpoint: StubEndpoint, profile: str, config: Config, concurrency_levels: List[int],
+                      calls_per_worker: int) -> Dict[str, Any]:
+    """Scaling of one profile's client across concurrency levels"""
+    workload = WORKLOADS[profile]
+    client = boto3.client(workload['service'], endpoint_url=endpoint.url, region_name='us-east-1',
+                          config=config.merge(Config(s3={'addressing_style': 'path'})))
+    workload['call'](client)
+    results = {'max_pool_connections': config.max_pool_connections, 'levels': {}}
+    for concurrency in concurrency_levels:
+        # Warm the pool at this concurrency so the measured run shows steady-state reuse
+        run_level(lambda: workload['call'](client), concurrency, 2)
+        connections_before = endpoint.connections
+        result = run_level(lambda: workload['call'](client), concurrency, calls_per_worker)
+        result['connections_opened'] = endpoint.connections - connections_before
+        results['levels'][concurrency] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark botocore client profiles")
+    parser.add_argument('--latency-ms', type=float, default=200, help="Stub endpoint response delay")
+    parser.add_argument('--handshake-ms', type=float, default=100, help="Delay before a new connection is served")
+    parser.add_argument('--concurrency', type=int, nargs='*', default=[1, 8, 16, 32, 64])
+    parser.add_argument('--calls-per-worker', type=int, default=20)
+    parser.add_argument('--profiles', nargs='*', default=list(PROFILES), help="Profiles to benchmark")
+    parser.add_argument('--output', help="Write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'stub')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'stub')
+    endpoint = StubEndpoint(args.latency_ms, args.handshake_ms)
+
+    report = {
+        'latency_ms': args.latency_ms,
+        'handshake_ms': args.handshake_ms,
+        'calls_per_worker': args.calls_per_worker,
+        'profiles': {}
+    }
+    try:
+        for profile in args.profiles:
+            report['profiles'][profile] = {
+                # Same client with botocore's defaults, for comparison
+                'default': benchmark_profile(endpoint, profile, Config(), args.concurrency, args.calls_per_worker),
+                'tuned': benchmark_profile(endpoint, profile, client_config(profile), args.concurrency,
+                                           args.calls_per_worker)
+            }
+    finally:
+        endpoint.shutdown()
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Benchmark chat history search over synthetic messages.
+
+Generates --messages synthetic chat messages for one user (Zipf-distributed
+vocabulary, ~10 messages per conversation), then reports:
+  - index build time and per-message indexing latency,
+  - search latency of the inverted index for exact, multi-term and prefix
+    queries,
+  - the same queries answered by a linear scan over every message, which is
+    the least a table scan with a contains() filter has to evaluate,
+  - table reads per search through HistorySearch on LocalDynamoDB.
+
+    python benchmark_history_search.py --messages 100000 --output history_search.json
+"""
+import time
+import random
+import argparse
+import logging
+from decimal import Decimal
+from typing import Any, Dict, List, Set
+
+from benchmark_utils import latency_summary, write_report
+from bedrock_stubs import FILLER_WORDS
+from history_search import HistoryIndex, HistorySearch, index_terms
+from local_dynamodb import LocalDynamoDB, create_chat_tables
+
+SYLLABLES = ['ka', 'lo', 'mi', 're', 'su', 'ta', 'ven', 'dor', 'pel', 'qua', 'zin', 'bar', 'nex', 'tor']
+
+
+def make_vocabulary(size: int, rng: random.Random) -> List[str]:
+    """Domain words plus distinct pseudo-words, most frequent first"""
+    words = list(FILLER_WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def make_messages(count: int, vocabulary: List[str], seed: int = 0) -> List[Dict[str, Any]]:
+    """Synthetic ChatHistory items for one user, alternating user and assistant turns"""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    messages = []
+    timestamp = 1_700_000_000.0
+    conversation_id = None
+    for index in range(count):
+        if index % 10 == 0:
+            conversation_id = str(int(timestamp))
+        role = 'user' if index % 2 == 0 else 'assistant'
+        length = rng.randint(6, 14) if role == 'user' else rng.randint(30, 80)
+        timestamp += rng.uniform(1, 60)
+        messages.append({
+            'user_id': 'benchmark-user',
+            'timestamp': Decimal(str(timestamp)),
+            'conversation_id': conversation_id,
+            'role': role,
+            'content': ' '.join(rng.choices(vocabulary, weights=weights, k=length)).capitalize() + '.',
+            'date': time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+        })
+    return messages
+
+
+def make_queries(vocabulary: List[str], count: int, seed: int = 0) -> Dict[str, List[str]]:
+    """Exact single-term, two-term and prefix queries drawn from the mid-frequency vocabulary"""
+    rng = random.Random(seed)
+    pool = vocabulary[len(FILLER_WORDS):len(FILLER_WORDS) + 2000]
+    return {
+        'single_term': [rng.choice(pool) for _ in range(count)],
+        'two_terms': [f"{rng.choice(pool)} {rng.choice(pool)}" for _ in range(count)],
+        'prefix': [rng.choice(pool)[:3] for _ in range(count)]
+    }
+
+
+def linear_scan(messages: List[Dict[str, Any]], query: str, prefix: bool) -> Set[str]:
+    """Conversations whose messages contain every query term, checking every message"""
+    terms = index_terms(query)
+    matches = set()
+    for message in messages:
+        words = set(index_terms(message['content']))
+        if all(term in words or (prefix and any(word.startswith(term) for word in words)) for term in terms):
+            matches.add(message['conversation_id'])
+    return matches
+
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat history search")
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200, help="Queries per kind for the index")
+    parser.add_argument('--scan-queries', type=int, default=5, help="Queries per kind for the linear scan")
+    parser.add_argument('--output', help="Write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    vocabulary = make_vocabulary(args.vocabulary, random.Random(1))
+    messages = make_messages(args.messages, vocabulary)
+    queries = make_queries(vocabulary, args.queries)
+    report = {'messages': len(messages), 'conversations': len({m['conversation_id'] for m in messages})}
+
+    index = HistoryIndex()
+    add_ms = []
+    build_start = time.perf_counter()
+    for message in messages:
+        add_ms.append(timed(
+            index.add_message, message['conversation_id'], float(message['timestamp']),
+            message['role'], message['content'], message['date']
+        ))
+    report['index'] = {
+        'build_seconds': round(time.perf_counter() - build_start, 2),
+        'terms': len(index.postings),
+        'add_message_ms': latency_summary(add_ms)
+    }
+
+    report['search_ms'] = {}
+    report['linear_scan_ms'] = {}
+    for kind, kind_queries in queries.items():
+        prefix = kind == 'prefix'
+        report['search_ms'][kind] = latency_summary([timed(index.search, query) for query in kind_queries])
+        report['linear_scan_ms'][kind] = latency_summary([
+            timed(linear_scan, messages, query, prefix) for query in kind_queries[:args.scan_queries]
+        ])
+
+    # End to end: the first search builds the index from one Query, later ones read nothing
+    dynamodb = create_chat_tables(LocalDynamoDB())
+    table = dynamodb.Table('ChatHistory')
+    with table.batch_writer() as batch:
+        for message in messages:
+            batch.put_item(Item=message)
+    search = HistorySearch(table, refresh_seconds=3600)
+    reads_before = table.consumed['reads']
+    first_ms = timed(search.search, 'benchmark-user', queries['single_term'][0])
+    reads_after_first = table.consumed['reads']
+    later_ms = [timed(search.search, 'benchmark-user', query) for query in queries['two_terms']]
+    report['history_search'] = {
+        'first_search_ms': round(first_ms, 1),
+        'first_search_table_reads': reads_after_first - reads_before,
+        'later_searches_ms': latency_summary(later_ms),
+        'later_searches_table_reads': table.consumed['reads'] - reads_after_first
+    }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
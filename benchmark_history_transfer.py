@@ -0,0 +1,98 @@
+"""Benchmark streaming export and bulk import of chat history.
+
+Fills LocalDynamoDB with --messages synthetic ChatHistory items spread over
+--users users, then reports:
+  - export throughput and peak Python memory, for everyone (Scan) and for
+    one user (Query), plain and gzipped,
+  - import throughput of the same file at each --workers count, with
+    --latency-ms added to every BatchWriteItem to stand in for the network
+    round trip,
+  - import under throttling, with the target table limited to
+    --write-rate-limit writes per second, and the retries it took.
+
+    python benchmark_history_transfer.py --messages 100000 --workers 1 4 8 16 --output history_transfer.json
+"""
+import os
+import time
+import random
+import argparse
+import logging
+import tempfile
+import tracemalloc
+from typing import Any, Dict
+
+from benchmark_history_search import make_messages, make_vocabulary
+from benchmark_utils import write_report
+from history_transfer import BulkImporter, export_history, open_text, read_items
+from local_dynamodb import LocalDynamoDB, create_chat_tables
+
+
+def fill_table(table, messages: int, users: int, seed: int = 0) -> None:
+    """Synthetic messages, assigned to users round robin by conversation"""
+    vocabulary = make_vocabulary(5000, random.Random(seed))
+    with table.batch_writer() as batch:
+        for message in make_messages(messages, vocabulary, seed):
+            message['user_id'] = f"user-{int(message['conversation_id']) % users}"
+            batch.put_item(Item=message)
+
+
+def timed_export(table, path: str, user_id: str = None) -> Dict[str, Any]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = export_history(table, path, user_id)
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'items': count,
+        'seconds': round(seconds, 3),
+        'items_per_second': round(count / seconds, 1),
+        'file_mb': round(os.path.getsize(path) / 2 ** 20, 2),
+        'peak_memory_mb': round(peak / 2 ** 20, 2)
+    }
+
+
+def timed_import(path: str, workers: int, latency_ms: float, write_rate_limit: float = None) -> Dict[str, Any]:
+    dynamodb = create_chat_tables(LocalDynamoDB(request_latency_ms=latency_ms))
+    table = dynamodb.Table('ChatHistory')
+    table.write_rate_limit = write_rate_limit
+    with open_text(path, 'r') as stream:
+        report = BulkImporter(dynamodb, 'ChatHistory', workers=workers).import_items(read_items(stream))
+    report['table_items'] = table.item_count()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat history export and import")
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--page-size', type=int, default=1000, help="Items per Query/Scan page")
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 4, 8, 16], help="Import concurrency levels")
+    parser.add_argument('--latency-ms', type=float, default=10, help="Added latency per BatchWriteItem call")
+    parser.add_argument('--write-rate-limit', type=float, default=2000,
+                        help="Writes per second the throttled import's table accepts")
+    parser.add_argument('--output', help="Write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    source = create_chat_tables(LocalDynamoDB(page_size=args.page_size)).Table('ChatHistory')
+    fill_table(source, args.messages, args.users)
+    report = {'messages': args.messages, 'users': args.users, 'export': {}, 'import': {}}
+
+    with tempfile.TemporaryDirectory() as directory:
+        plain = os.path.join(directory, 'history.ndjson')
+        compressed = os.path.join(directory, 'history.ndjson.gz')
+        report['export']['all_users'] = timed_export(source, plain)
+        report['export']['all_users_gzip'] = timed_export(source, compressed)
+        report['export']['one_user'] = timed_export(source, os.path.join(directory, 'user.ndjson'), 'user-0')
+
+        for workers in args.workers:
+            report['import'][f"workers_{workers}"] = timed_import(compressed, workers, args.latency_ms)
+        report['import']['throttled'] = timed_import(
+            compressed, max(args.workers), args.latency_ms, args.write_rate_limit
+        )
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Offline benchmark for lambda_handler.
+
+Replaces the Bedrock, rerank and S3 clients with deterministic stubs
+(bedrock_stubs.py) and reports per-stage latency percentiles, throughput at
+several concurrency levels and allocations per request.
+
+    python benchmark_lambda.py --time-scale 0.1 --output benchmark_results.json
+    python benchmark_lambda.py --baseline benchmark_results.json
+
+With --baseline the run exits non-zero when a stage p95, the end-to-end p95,
+throughput or allocations regress by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any
+
+from benchmark_utils import latency_summary, load_query_corpus, write_report
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODES = ['retrieve_and_generate', 'two_phase']
+
+
+def load_lambda_module():
+    """Import lambda_function with placeholder configuration for offline runs"""
+    os.environ.setdefault('KNOWLEDGE_BASE_ID', 'benchmark-kb')
+    os.environ.setdefault('FM_ARN', 'arn:aws:bedrock:us-east-1::foundation-model/benchmark-model')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    import lambda_function
+    return lambda_function
+
+
+def invoke(handler, query: str, mode: str) -> Dict[str, Any]:
+    """Invoke the handler once and return its status, wall time and stage timings"""
+    event = {'body': json.dumps({'user_query': query, 'pipeline_mode': mode})}
+    start = time.perf_counter()
+    response = handler(event, None)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    body = json.loads(response['body'])
+    return {
+        'status': response['statusCode'],
+        'elapsed_ms': elapsed_ms,
+        'stages': body.get('debug_info', {}).get('stage_timings_ms', {})
+    }
+
+
+def run_sequential(handler, queries: List[str], mode: str, iterations: int) -> Dict[str, Any]:
+    """Run every query one at a time and summarize each stage"""
+    stage_samples = {}
+    end_to_end = []
+    errors = 0
+    for _ in range(iterations):
+        for query in queries:
+            result = invoke(handler, query, mode)
+            if result['status'] != 200:
+                errors += 1
+                continue
+            end_to_end.append(result['elapsed_ms'])
+            for stage, elapsed in result['stages'].items():
+                stage_samples.setdefault(stage, []).append(elapsed)
+    return {
+        'errors': errors,
+        'end_to_end_ms': latency_summary(end_to_end),
+        'stages_ms': {stage: latency_summary(samples) for stage, samples in stage_samples.items()}
+    }
+
+
+def run_concurrent(handler, queries: List[str], mode: str, workers: int, requests: int) -> Dict[str, Any]:
+    """Drive the handler from a thread pool and measure throughput"""
+    workload = [queries[index % len(queries)] for index in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda query: invoke(handler, query, mode), workload))
+    wall_seconds = time.perf_counter() - start
+
+    latencies = [result['elapsed_ms'] for result in results if result['status'] == 200]
+    return {
+        'workers': workers,
+        'requests': requests,
+        'errors': len(results) - len(latencies),
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(len(latencies) / wall_seconds, 3) if wall_seconds else 0.0,
+        'end_to_end_ms': latency_summary(latencies)
+    }
+
+
+def run_allocations(handler, queries: List[str], mode: str) -> Dict[str, Any]:
+    """Measure peak traced allocations per request and memory retained by the run"""
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        peaks = []
+        for query in queries:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            invoke(handler, query, mode)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'requests': len(queries),
+        'peak_bytes_per_request_mean': int(sum(peaks) / len(peaks)) if peaks else 0,
+        'peak_bytes_per_request_max': max(peaks, default=0),
+        'retained_bytes': retained - baseline
+    }
+
+
+def find_regressions(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float,
+                     min_delta_ms: float = 1.0) -> List[str]:
+    """Compare a report with a baseline report and list metrics that got worse"""
+    regressions = []
+
+    def check(label, current, previous, higher_is_worse=True, is_latency=True):
+        if not previous:
+            return
+        if is_latency and abs(current - previous) < min_delta_ms:
+            # Sub-millisecond stages are dominated by timer noise
+            return
+        change = (current - previous) / previous
+        if (change > tolerance) if higher_is_worse else (-change > tolerance):
+            regressions.append(f"{label}: {previous} -> {current} ({change:+.1%})")
+
+    for mode, result in report['modes'].items():
+        previous = baseline.get('modes', {}).get(mode)
+        if not previous:
+            continue
+        check(f"{mode} end_to_end p95", result['sequential']['end_to_end_ms']['p95'],
+              previous['sequential']['end_to_end_ms']['p95'])
+        for stage, summary in result['sequential']['stages_ms'].items():
+            previous_stage = previous['sequential']['stages_ms'].get(stage)
+            if previous_stage:
+                check(f"{mode} {stage} p95", summary['p95'], previous_stage['p95'])
+        previous_levels = {level['workers']: level for level in previous['concurrency']}
+        for level in result['concurrency']:
+            if level['workers'] in previous_levels:
+                check(f"{mode} throughput @{level['workers']}", level['throughput_rps'],
+                      previous_levels[level['workers']]['throughput_rps'],
+                      higher_is_worse=False, is_latency=False)
+        check(f"{mode} peak bytes per request", result['allocations']['peak_bytes_per_request_mean'],
+              previous['allocations']['peak_bytes_per_request_mean'], is_latency=False)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for lambda_handler")
+    parser.add_argument('--queries', nargs='+', help="JSONL files of queries (default: requests.jsonl or sample_queries.jsonl)")
+    parser.add_argument('--modes', nargs='+', default=DEFAULT_MODES, help="Pipeline modes to benchmark")
+    parser.add_argument('--iterations', type=int, default=3, help="Sequential passes over the query corpus")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16], help="Thread pool sizes to sweep")
+    parser.add_argument('--requests-per-level', type=int, default=0,
+                        help="Requests per concurrency level (default: 4x workers, at least the corpus size)")
+    parser.add_argument('--latency-profile', default='realistic', help="realistic, zero or a JSON profile file")
+    parser.add_argument('--time-scale', type=float, default=0.1, help="Multiplier applied to stub latencies")
+    parser.add_argument('--fixtures', help="Replay recorded upstream responses from this file")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--baseline', help="Fail if this earlier report is measurably better")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Allowed relative regression")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help="Ignore latency changes smaller than this many milliseconds")
+    parser.add_argument('--log-level', default='ERROR')
+    args = parser.parse_args()
+
+    from bedrock_stubs import FixtureStore, install_stubs
+
+    lambda_function = load_lambda_module()
+    logging.getLogger().setLevel(args.log_level)
+    fixtures = FixtureStore.load(args.fixtures) if args.fixtures else None
+    stubs = install_stubs(lambda_function, latency_profile=args.latency_profile, fixtures=fixtures,
+                          seed=args.seed, time_scale=args.time_scale)
+    handler = lambda_function.lambda_handler
+    queries = load_query_corpus(args.queries)
+
+    report = {
+        'config': {
+            'queries': len(queries),
+            'iterations': args.iterations,
+            'latency_profile': args.latency_profile,
+            'time_scale': args.time_scale,
+            'seed': args.seed,
+            'python': sys.version.split()[0]
+        },
+        'modes': {}
+    }
+
+    for mode in args.modes:
+        # Warm up imports and caches outside the measurements
+        invoke(handler, queries[0], mode)
+        concurrency = []
+        for workers in args.concurrency:
+            requests = args.requests_per_level or max(len(queries), workers * 4)
+            concurrency.append(run_concurrent(handler, queries, mode, workers, requests))
+        report['modes'][mode] = {
+            'sequential': run_sequential(handler, queries, mode, args.iterations),
+            'concurrency': concurrency,
+            'allocations': run_allocations(handler, queries, mode)
+        }
+
+    report['upstream_calls'] = {
+        name: dict(stub.calls) for name, stub in stubs.items()
+    }
+    write_report(report, args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("Regressions against baseline:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Compare the response formats of lambda_handler.
+
+Runs every query through the stubbed handler once per format and reports the
+bytes on the wire (the JSON the API Gateway integration returns to the
+client), the time the client spends decoding it with
+api_client.decode_api_response and the presigned URLs generated per
+response. Compact references are fetched with get_reference when opened, so
+each format also replays what the chat UI requests when a user opens a
+reference (--open-rate of the responses): its full excerpt when the response
+left it out or truncated it, and a presigned link to the source document.
+The client format is whatever APIClient requests by default, so the report
+measures the flow the app actually runs.
+
+    python benchmark_response_formats.py --output response_formats.json
+"""
+import json
+import time
+import argparse
+import logging
+from typing import Any, Dict, List
+
+from api_client import APIClient, decode_api_response
+from benchmark_lambda import load_lambda_module
+from benchmark_utils import latency_summary, load_query_corpus, write_report
+from bedrock_stubs import install_stubs
+
+_client = APIClient('')
+
+FORMATS = {
+    'full': {'response_format': 'full'},
+    'compact_preview': {'response_format': 'compact', 'reference_detail': 'preview'},
+    'compact_preview_gzip': {'response_format': 'compact', 'reference_detail': 'preview', 'accept_encoding': 'gzip'},
+    'compact_on_demand': {'response_format': 'compact', 'reference_detail': 'on_demand', 'accept_encoding': 'gzip'},
+    'client': {
+        'response_format': _client.response_format,
+        'reference_detail': _client.reference_detail,
+        'accept_encoding': 'gzip'
+    }
+}
+
+
+def reference_requests(ref: Dict[str, Any]) -> List[bool]:
+    """get_reference requests the UI makes to show a reference and its source, as their presign flags"""
+    if not ref.get('ref_id'):
+        return []
+    flags = []
+    if 'snippet' not in ref or ref.get('snippet_truncated'):
+        flags.append(False)
+    if not ref.get('presigned_url'):
+        flags.append(True)
+    return flags
+
+
+def measure_format(handler, s3_stub, queries: List[str], mode: str, request_options: Dict[str, Any],
+                   decode_repeats: int, open_rate: float) -> Dict[str, Any]:
+    """Wire size and client decode time of each query's response in one format, plus reference follow-ups"""
+    sizes = []
+    decode_ms = []
+    follow_up_sizes = []
+    presigns_before = s3_stub.calls['generate_presigned_url']
+    for index, query in enumerate(queries):
+        event = {'body': json.dumps({'user_query': query, 'pipeline_mode': mode, **request_options})}
+        response = handler(event, None)
+        if response['statusCode'] != 200:
+            raise RuntimeError(f"Request failed with status {response['statusCode']}: {response['body']}")
+        wire = json.dumps(response)
+        sizes.append(len(wire.encode('utf-8')))
+        start = time.perf_counter()
+        for _ in range(decode_repeats):
+            body = decode_api_response(json.loads(wire))
+        decode_ms.append((time.perf_counter() - start) * 1000 / decode_repeats)
+
+        # Spread the opened references evenly over the responses
+        references = body.get('detailed_references', [])
+        if references and int((index + 1) * open_rate) > int(index * open_rate):
+            for presign in reference_requests(references[0]):
+                event = {'body': json.dumps({
+                    'action': 'get_reference', 'ref_id': references[0]['ref_id'],
+                    'presign': presign, 'accept_encoding': 'gzip'
+                })}
+                follow_up = handler(event, None)
+                if follow_up['statusCode'] != 200:
+                    raise RuntimeError(f"get_reference failed with status {follow_up['statusCode']}")
+                follow_up_sizes.append(len(json.dumps(follow_up).encode('utf-8')))
+    return {
+        'bytes': {
+            'total': sum(sizes),
+            'mean': round(sum(sizes) / len(sizes), 1),
+            'max': max(sizes)
+        },
+        'decode_ms': latency_summary(decode_ms),
+        'reference_requests_per_response': round(len(follow_up_sizes) / len(queries), 2),
+        'bytes_with_reference_requests': sum(sizes) + sum(follow_up_sizes),
+        'presigns_per_response': round(
+            (s3_stub.calls['generate_presigned_url'] - presigns_before) / len(queries), 2
+        )
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare API response formats")
+    parser.add_argument('--queries', nargs='*', help="JSONL query files (default: requests.jsonl or sample_queries.jsonl)")
+    parser.add_argument('--mode', default='two_phase', help="Pipeline mode to run")
+    parser.add_argument('--decode-repeats', type=int, default=20, help="Decodes per response when timing the client")
+    parser.add_argument('--open-rate', type=float, default=0.3,
+                        help="Fraction of responses whose first reference the user opens")
+    parser.add_argument('--output', help="Write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    lambda_function = load_lambda_module()
+    stubs = install_stubs(lambda_function)
+    queries = load_query_corpus(args.queries)
+
+    report = {'mode': args.mode, 'queries': len(queries), 'open_rate': args.open_rate, 'formats': {}}
+    for name, request_options in FORMATS.items():
+        report['formats'][name] = measure_format(
+            lambda_function.lambda_handler, stubs['s3_client'], queries, args.mode, request_options,
+            args.decode_repeats, args.open_rate
+        )
+
+    full = report['formats']['full']
+    for name, result in report['formats'].items():
+        result['bytes_vs_full'] = round(result['bytes']['total'] / full['bytes']['total'], 3)
+        result['bytes_with_reference_requests_vs_full'] = round(
+            result['bytes_with_reference_requests'] / full['bytes_with_reference_requests'], 3
+        )
+        result['decode_p50_vs_full'] = round(result['decode_ms']['p50'] / full['decode_ms']['p50'], 3)
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import json
+from typing import List, Dict, Any
+
+DEFAULT_QUERY_FILES = ['requests.jsonl', 'sample_queries.jsonl']
+
+
+def load_queries(path: str) -> List[str]:
+    """Load queries from a JSONL file with a user_query (or query) field per line"""
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            query = record.get('user_query') or record.get('query')
+            if query:
+                queries.append(query)
+    return queries
+
+
+def load_query_corpus(paths: List[str] = None) -> List[str]:
+    """Load queries from the given files, or from the first default file that has any"""
+    if paths:
+        return [query for path in paths for query in load_queries(path)]
+    for path in DEFAULT_QUERY_FILES:
+        if os.path.exists(path):
+            queries = load_queries(path)
+            if queries:
+                return queries
+    raise ValueError(f"No queries found in {', '.join(DEFAULT_QUERY_FILES)}")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def latency_summary(values: List[float]) -> Dict[str, Any]:
+    """Summarize latencies in milliseconds as count, mean, p50, p95, p99 and max"""
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 3) if values else 0.0,
+        'p50': round(percentile(values, 50), 3),
+        'p95': round(percentile(values, 95), 3),
+        'p99': round(percentile(values, 99), 3),
+        'max': round(max(values, default=0.0), 3)
+    }
+
+
+def write_report(report: Dict[str, Any], path: str = None) -> None:
+    """Print a JSON report and optionally write it to a file"""
+    output = json.dumps(report, indent=2)
+    print(output)
+    if path:
+        with open(path, 'w') as f:
+            f.write(output)
@@ -0,0 +1,305 @@
+import os
+import re
+import gzip
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from client_config import create_client
+
+logger = logging.getLogger(__name__)
+
+# Attributes that only matter in the hot table
+HOT_ONLY_ATTRIBUTES = ('archived_at', 'expires_at')
+
+
+class ArchiveStore:
+    """Object storage for archived chat history: whole objects by key"""
+
+    def read(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def write(self, key: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def list_prefixes(self) -> List[str]:
+        """Top-level key prefixes (one per user), without the trailing slash"""
+        raise NotImplementedError
+
+
+class FileArchiveStore(ArchiveStore):
+    """ArchiveStore in a local directory, the stand-in for S3 in development and tests"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list_prefixes(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+
+class S3ArchiveStore(ArchiveStore):
+    def __init__(self, bucket: str, prefix: str = '', client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or create_client('s3', 'storage')
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def write(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def list_prefixes(self) -> List[str]:
+        prefixes = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', []):
+                prefixes.append(common_prefix['Prefix'][len(self.prefix):].rstrip('/'))
+        return prefixes
+
+
+def _user_prefix(user_id: str) -> str:
+    return re.sub(r'[^\w.-]', '_', user_id)
+
+
+def _month(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m')
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class ChatArchive:
+    """Cold tier of ChatHistory: per-user, per-month gzipped JSONL objects.
+
+    Each user has one object per month of messages
+    (<user>/<YYYY-MM>.jsonl.gz, one table item per line) and an index of
+    their archived conversations (<user>/index.json) that the sidebar lists
+    without opening any month. Archiving is idempotent: messages are keyed
+    by timestamp, so re-archiving after an interrupted run adds nothing.
+    Indexes and recently opened months are cached per process for
+    index_ttl_seconds, so another process's changes show up within that
+    time; archiving and deleting read both fresh from the store.
+    """
+
+    def __init__(self, store: ArchiveStore, index_ttl_seconds: float = 300, max_cached_months: int = 32):
+        self.store = store
+        self.index_ttl_seconds = index_ttl_seconds
+        self.max_cached_months = max_cached_months
+        self._indexes = {}
+        self._months = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _read_index(self, user_id: str, fresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            cached = self._indexes.get(user_id)
+            if not fresh and cached and time.monotonic() - cached[0] < self.index_ttl_seconds:
+                return cached[1]
+        data = self.store.read(f"{_user_prefix(user_id)}/index.json")
+        index = json.loads(data) if data else {}
+        with self._lock:
+            self._indexes[user_id] = (time.monotonic(), index)
+        return index
+
+    def _write_index(self, user_id: str, index: Dict[str, Dict[str, Any]]) -> None:
+        key = f"{_user_prefix(user_id)}/index.json"
+        if index:
+            self.store.write(key, json.dumps(index).encode('utf-8'))
+        else:
+            self.store.delete(key)
+        with self._lock:
+            self._indexes[user_id] = (time.monotonic(), index)
+
+    def _read_month(self, user_id: str, month: str, fresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        """Archived items of one month by timestamp"""
+        key = f"{_user_prefix(user_id)}/{month}.jsonl.gz"
+        with self._lock:
+            cached = self._months.get(key)
+            if not fresh and cached and time.monotonic() - cached[0] < self.index_ttl_seconds:
+                self._months.move_to_end(key)
+                return cached[1]
+        data = self.store.read(key)
+        items = {}
+        if data:
+            for line in gzip.decompress(data).decode('utf-8').splitlines():
+                item = json.loads(line)
+                items[repr(item['timestamp'])] = item
+        self._cache_month(key, items)
+        return items
+
+    def _write_month(self, user_id: str, month: str, items: Dict[str, Dict[str, Any]]) -> None:
+        key = f"{_user_prefix(user_id)}/{month}.jsonl.gz"
+        if items:
+            ordered = sorted(items.values(), key=lambda item: item['timestamp'])
+            lines = ''.join(json.dumps(item, default=_json_default) + '\n' for item in ordered)
+            self.store.write(key, gzip.compress(lines.encode('utf-8')))
+        else:
+            self.store.delete(key)
+        self._cache_month(key, items)
+
+    def _cache_month(self, key: str, items: Dict[str, Dict[str, Any]]) -> None:
+        with self._lock:
+            self._months[key] = (time.monotonic(), items)
+            self._months.move_to_end(key)
+            while len(self._months) > self.max_cached_months:
+                self._months.popitem(last=False)
+
+    def archive(self, user_id: str, items: List[Dict[str, Any]]) -> int:
+        """Add ChatHistory items of one user to the archive, returning how many were new"""
+        by_month = {}
+        for item in items:
+            item = {key: value for key, value in item.items() if key not in HOT_ONLY_ATTRIBUTES}
+            item['timestamp'] = float(item['timestamp'])
+            by_month.setdefault(_month(item['timestamp']), []).append(item)
+
+        added = 0
+        # Copies, so the cached index is untouched if a write fails; read fresh, so
+        # changes made by other processes since they were cached are not overwritten
+        index = {key: dict(entry, months=list(entry['months']))
+                 for key, entry in self._read_index(user_id, fresh=True).items()}
+        for month, month_items in by_month.items():
+            archived = dict(self._read_month(user_id, month, fresh=True))
+            for item in month_items:
+                if repr(item['timestamp']) not in archived:
+                    archived[repr(item['timestamp'])] = item
+                    added += 1
+                # Also for messages already archived, whose index update an interrupted run may have lost
+                self._add_to_index(index, item, month)
+            # Months are written before the index, so the index never points at missing messages
+            self._write_month(user_id, month, archived)
+        self._write_index(user_id, index)
+        return added
+
+    @staticmethod
+    def _add_to_index(index: Dict[str, Dict[str, Any]], item: Dict[str, Any], month: str) -> None:
+        conversation_id = item.get('conversation_id') or str(int(item['timestamp']))
+        entry = index.get(conversation_id)
+        if entry is None:
+            entry = index[conversation_id] = {
+                'conversation_id': conversation_id,
+                'timestamp': item['timestamp'],
+                'last_timestamp': item['timestamp'],
+                'months': []
+            }
+        if item['timestamp'] <= entry['timestamp']:
+            entry['timestamp'] = item['timestamp']
+            entry['date'] = item.get('date') or datetime.fromtimestamp(item['timestamp']).strftime('%Y-%m-%d')
+            entry['first_message'] = item.get('content', '')[:50]
+        entry['last_timestamp'] = max(entry['last_timestamp'], item['timestamp'])
+        if month not in entry['months']:
+            entry['months'].append(month)
+            entry['months'].sort()
+
+    def conversations(self, user_id: str) -> List[Dict[str, Any]]:
+        """Index entries of the user's archived conversations, newest first"""
+        entries = list(self._read_index(user_id).values())
+        entries.sort(key=lambda entry: entry['last_timestamp'], reverse=True)
+        return entries
+
+    def has_conversation(self, user_id: str, conversation_id: str) -> bool:
+        return conversation_id in self._read_index(user_id)
+
+    def conversation_messages(self, user_id: str, conversation_id: str) -> List[Dict[str, Any]]:
+        """Archived items of one conversation in the order they were saved"""
+        entry = self._read_index(user_id).get(conversation_id)
+        if entry is None:
+            return []
+        messages = [
+            dict(item)
+            for month in entry['months']
+            for item in self._read_month(user_id, month).values()
+            if item.get('conversation_id') == conversation_id
+        ]
+        messages.sort(key=lambda item: item['timestamp'])
+        return messages
+
+    def iter_items(self, user_id: str):
+        """All of the user's archived items, oldest first, holding one month in memory at a time"""
+        return self._iter_prefix_items(_user_prefix(user_id))
+
+    def iter_all_items(self):
+        """The archived items of every user, one user and month at a time"""
+        for prefix in self.store.list_prefixes():
+            yield from self._iter_prefix_items(prefix)
+
+    def _iter_prefix_items(self, prefix: str):
+        # Read past both caches, so an export does not evict what the app is using
+        data = self.store.read(f"{prefix}/index.json")
+        index = json.loads(data) if data else {}
+        months = sorted({month for entry in index.values() for month in entry['months']})
+        for month in months:
+            key = f"{prefix}/{month}.jsonl.gz"
+            data = self.store.read(key)
+            if not data:
+                continue
+            for line in gzip.decompress(data).decode('utf-8').splitlines():
+                yield json.loads(line)
+
+    def delete_conversation(self, user_id: str, conversation_id: str) -> None:
+        index = dict(self._read_index(user_id, fresh=True))
+        entry = index.pop(conversation_id, None)
+        if entry is None:
+            return
+        for month in entry['months']:
+            archived = {
+                key: item for key, item in self._read_month(user_id, month, fresh=True).items()
+                if item.get('conversation_id') != conversation_id
+            }
+            self._write_month(user_id, month, archived)
+        self._write_index(user_id, index)
+
+
+def chat_archive_from_env() -> Optional[ChatArchive]:
+    """Archive in CHAT_ARCHIVE_BUCKET (under CHAT_ARCHIVE_PREFIX) or the CHAT_ARCHIVE_PATH directory, None if neither is set"""
+    bucket = os.getenv('CHAT_ARCHIVE_BUCKET')
+    path = os.getenv('CHAT_ARCHIVE_PATH')
+    if bucket:
+        store = S3ArchiveStore(bucket, os.getenv('CHAT_ARCHIVE_PREFIX', 'chat-archive/'))
+    elif path:
+        store = FileArchiveStore(path)
+    else:
+        return None
+    return ChatArchive(store, index_ttl_seconds=float(os.getenv('CHAT_ARCHIVE_INDEX_TTL_SECONDS', 300)))
@@ -1,6 +1,9 @@
+import math
 import streamlit as st
 from typing import Dict, Any
-import json
+
+from api_client import decode_api_response
+from tracing import current_trace_id, get_tracer
 
 class ChatHandler:
     def __init__(self, api_client, chat_manager):
@@ -10,6 +13,26 @@ class ChatHandler:
 
     def handle_chat_input(self, user_input: str) -> None:
         """Process new chat input and get AI response."""
+        wait = self.api_client.reserve_request(st.session_state.user_id)
+        if wait > 0:
+            st.warning(f"You're sending messages too quickly. Please wait {math.ceil(wait)} seconds and try again.")
+            return
+
+        tracer = get_tracer()
+        # One trace per chat turn, continued by the Lambda through the request's traceparent
+        with tracer.span(
+            "chat_turn",
+            root=True,
+            conversation_id=st.session_state.current_conversation_id,
+            has_session=bool(st.session_state.session_id)
+        ):
+            answered = self._run_chat_turn(user_input)
+        tracer.flush()
+        if answered:
+            st.rerun()
+
+    def _run_chat_turn(self, user_input: str) -> bool:
+        """Save the question, call the API and save the answer; True once an answer was added."""
         user_message = {
             "role": "user",
             "content": user_input,
@@ -17,28 +40,26 @@ class ChatHandler:
             "conversation_id": st.session_state.current_conversation_id
         }
         
-        if self.chat_manager.save_chat(st.session_state.user_id, user_message):
-            st.session_state.messages.append(user_message)
+        if not self.chat_manager.save_chat(st.session_state.user_id, user_message):
+            return False
+        st.session_state.messages.append(user_message)
+        
+        with st.spinner("Processing your request..."):
+            result = self.api_client.call_api(user_input, st.session_state.session_id, st.session_state.user_id)
             
-            with st.spinner("Processing your request..."):
-                result = self.api_client.call_api(user_input, st.session_state.session_id)
-                
-            if result:
-                self._process_api_response(result)
-            else:
-                self._handle_error_response()
+        if result:
+            return self._process_api_response(result)
+        return self._handle_error_response()
 
-    def _process_api_response(self, result: Dict[str, Any]) -> None:
+    def _process_api_response(self, result: Dict[str, Any]) -> bool:
         """Process successful API response."""
-        if isinstance(result, str):
-            result = json.loads(result)
-        if 'body' in result:
-            result = json.loads(result['body'])
-            
+        result = decode_api_response(result)
+
         response_content = result.get('generated_response', 'No response available')
         detailed_references = result.get('detailed_references', [])
         
-        if 'sessionId' in result:
+        # Responses without a session (warm or coalesced answers, errors) keep the current one
+        if result.get('sessionId'):
             st.session_state.session_id = result['sessionId']
         
         assistant_message = {
@@ -46,23 +67,27 @@ class ChatHandler:
             "content": response_content,
             "references": detailed_references,
             "session_id": st.session_state.session_id,
-            "conversation_id": st.session_state.current_conversation_id
+            "conversation_id": st.session_state.current_conversation_id,
+            "trace_id": current_trace_id()
         }
         
         if self.chat_manager.save_chat(st.session_state.user_id, assistant_message):
             st.session_state.messages.append(assistant_message)
-            st.rerun()
+            return True
+        return False
 
-    def _handle_error_response(self) -> None:
+    def _handle_error_response(self) -> bool:
         """Handle API error response."""
         error_message = {
             "role": "assistant",
             "content": "Failed to get a valid response from the API.",
             "references": [],
             "session_id": st.session_state.session_id,
-            "conversation_id": st.session_state.current_conversation_id
+            "conversation_id": st.session_state.current_conversation_id,
+            "trace_id": current_trace_id()
         }
         
         if self.chat_manager.save_chat(st.session_state.user_id, error_message):
             st.session_state.messages.append(error_message)
-            st.rerun()
+            return True
+        return False
@@ -1,4 +1,3 @@
-import boto3
 from datetime import datetime, timedelta
 import time
 from typing import List, Dict
@@ -10,9 +9,32 @@ import os
 import logging
 import streamlit as st
 
+from chat_archive import ChatArchive, chat_archive_from_env
+from client_config import create_resource
+from history_search import HistorySearch
+from history_transfer import export_history, import_history, iter_history_items
+from tracing import get_tracer
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@st.cache_resource
+def shared_chat_archive() -> ChatArchive:
+    """Cold tier of ChatHistory, None unless CHAT_ARCHIVE_BUCKET or CHAT_ARCHIVE_PATH is set"""
+    return chat_archive_from_env()
+
+
+@st.cache_resource
+def shared_history_search(table_name: str, _table, _archive=None) -> HistorySearch:
+    """One search index per process, shared by all sessions and reruns"""
+    return HistorySearch(
+        _table,
+        refresh_seconds=float(os.getenv('HISTORY_SEARCH_REFRESH_SECONDS', 30)),
+        max_users=int(os.getenv('HISTORY_SEARCH_MAX_USERS', 100)),
+        archive=_archive
+    )
+
 class ChatHistoryManager:
     def __init__(self):
         # Load environment variables
@@ -27,7 +49,8 @@ class ChatHistoryManager:
             raise ValueError("AWS credentials not found in environment variables")
         
         # Initialize DynamoDB resource
-        self.dynamodb = boto3.resource(
+        self.dynamodb = create_resource(
+            'dynamodb',
             'dynamodb',
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
@@ -35,11 +58,35 @@ class ChatHistoryManager:
         )
         
         self.table = self.dynamodb.Table('ChatHistory')
+        # Older messages are moved to the archive by archive_chat_history.py; reads stay within the hot window
+        self.hot_days = int(os.getenv('CHAT_HISTORY_HOT_DAYS', 30))
+        self.archive = shared_chat_archive()
+        self.search = shared_history_search('ChatHistory', self.table, self.archive)
+
+    def _query_items(self, key_condition, **kwargs) -> List[Dict]:
+        """All items matching a key condition, following pagination"""
+        items = []
+        query_kwargs = {'KeyConditionExpression': key_condition, **kwargs}
+        while True:
+            response = self.table.query(**query_kwargs)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _hot_window_start(self, days: int = None) -> Decimal:
+        """Timestamp of the start of the day `days` (default: the hot window) days ago"""
+        start = datetime.now() - timedelta(days=days or self.hot_days)
+        return Decimal(str(start.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()))
 
     def save_chat(self, user_id: str, message: dict) -> bool:
         """
         Save a chat message to DynamoDB
         """
+        with get_tracer().span('chat_history.save_chat', role=message['role']):
+            return self._save_chat(user_id, message)
+
+    def _save_chat(self, user_id: str, message: dict) -> bool:
         try:
             # Convert timestamp to Decimal
             timestamp = Decimal(str(time.time()))
@@ -55,6 +102,9 @@ class ChatHistoryManager:
                 'references': json.dumps(message.get('references', [])),
                 'conversation_id': message.get('conversation_id', str(int(float(timestamp))))
             }
+            # Ties a reported answer to its trace
+            if message.get('trace_id'):
+                item['trace_id'] = message['trace_id']
             
             # Print debug information
             # logger.info(f"Saving item to DynamoDB: {json.dumps(item, default=str)}")
@@ -65,6 +115,9 @@ class ChatHistoryManager:
             # Check response
             if response['ResponseMetadata']['HTTPStatusCode'] == 200:
                 logger.info(f"Successfully saved message for user {user_id}")
+                # The item's key, so the session's copy can be matched to it later
+                message['timestamp'] = float(timestamp)
+                self.search.record(user_id, item)
                 return True
             else:
                 logger.error(f"Error saving message. Response: {json.dumps(response, default=str)}")
@@ -80,25 +133,10 @@ class ChatHistoryManager:
         Get conversations grouped by date and conversation_id
         """
         try:
-            if days:
-                cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-                response = self.table.query(
-                    KeyConditionExpression=Key('user_id').eq(user_id),
-                    FilterExpression='#date >= :cutoff',
-                    ExpressionAttributeValues={
-                        ':cutoff': cutoff_date
-                    },
-                    ExpressionAttributeNames={
-                        '#date': 'date'
-                    }
-                )
-            else:
-                response = self.table.query(
-                    KeyConditionExpression=Key('user_id').eq(user_id)
-                )
-
-            items = response.get('Items', [])
-            
+            # A range condition on the sort key, so only the window is read, however long the history
+            items = self._query_items(
+                Key('user_id').eq(user_id) & Key('timestamp').gte(self._hot_window_start(days))
+            )
             # Group by date and conversation_id
             conversations = {}
             for item in items:
@@ -137,11 +175,10 @@ class ChatHistoryManager:
         Get a summary of all conversations for the sidebar
         """
         try:
-            response = self.table.query(
-                KeyConditionExpression=Key('user_id').eq(user_id)
+            items = self._query_items(
+                Key('user_id').eq(user_id) & Key('timestamp').gte(self._hot_window_start())
             )
-            
-            items = response.get('Items', [])
+            items.sort(key=lambda x: x['timestamp'])
             conversations = {}
             
             for item in items:
@@ -154,6 +191,14 @@ class ChatHistoryManager:
                         'timestamp': float(item['timestamp'])
                     }
             
+            for entry in self.get_archived_conversations(user_id):
+                conversations.setdefault(entry['conversation_id'], {
+                    'conversation_id': entry['conversation_id'],
+                    'date': entry['date'],
+                    'first_message': entry['first_message'] + '...',
+                    'timestamp': entry['timestamp']
+                })
+
             # Convert to list and sort by timestamp (newest first)
             conversation_list = list(conversations.values())
             conversation_list.sort(key=lambda x: x['timestamp'], reverse=True)
@@ -163,14 +208,83 @@ class ChatHistoryManager:
             logger.error(f"Error getting conversation summaries: {str(e)}")
             return []
 
+    def get_conversation_messages(self, user_id: str, conversation_id: str) -> List[Dict]:
+        """
+        Get the messages of one conversation in the order they were saved, archived ones included
+        """
+        try:
+            return self.hydrate_conversation(user_id, conversation_id)
+        except Exception as e:
+            logger.error(f"Error getting conversation messages: {str(e)}")
+            return []
+
+    @staticmethod
+    def _conversation_key_condition(user_id: str, conversation_id: str):
+        key_condition = Key('user_id').eq(user_id)
+        if conversation_id.isdigit():
+            # Conversation ids are the start time in seconds, so nothing earlier needs reading
+            key_condition = key_condition & Key('timestamp').gte(Decimal(conversation_id))
+        return key_condition
+
+    def _hot_conversation_items(self, user_id: str, conversation_id: str) -> List[Dict]:
+        """Hot-table items of one conversation, with references parsed"""
+        messages = self._query_items(
+            self._conversation_key_condition(user_id, conversation_id),
+            FilterExpression='conversation_id = :cid',
+            ExpressionAttributeValues={
+                ':cid': conversation_id
+            }
+        )
+        for item in messages:
+            item['timestamp'] = float(item['timestamp'])
+            if 'references' in item:
+                item['references'] = json.loads(item['references'])
+        return messages
+
+    def get_archived_conversations(self, user_id: str) -> List[Dict]:
+        """
+        Summaries of conversations moved to the archive, newest first
+        """
+        if self.archive is None:
+            return []
+        try:
+            return self.archive.conversations(user_id)
+        except Exception as e:
+            logger.error(f"Error getting archived conversations: {str(e)}")
+            return []
+
+    def hydrate_conversation(self, user_id: str, conversation_id: str,
+                             hot_messages: List[Dict] = None) -> List[Dict]:
+        """
+        Complete a conversation's hot messages (read here when not given) with its archived ones.
+
+        The archive is only read when it holds part of the conversation, so
+        conversations that never left the hot table cost nothing extra.
+        """
+        archived = self.archive is not None and self.archive.has_conversation(user_id, conversation_id)
+        if hot_messages is None or (not archived and conversation_id.isdigit()
+                                    and Decimal(conversation_id) < self._hot_window_start()):
+            # Started before the hot window and not archived yet, so the window holds only its tail
+            hot_messages = self._hot_conversation_items(user_id, conversation_id)
+        if not archived:
+            return sorted(hot_messages, key=lambda x: x['timestamp'])
+        with get_tracer().span('chat_history.hydrate_conversation'):
+            messages = {repr(float(item['timestamp'])): item for item in hot_messages}
+            for item in self.archive.conversation_messages(user_id, conversation_id):
+                if 'references' in item:
+                    item['references'] = json.loads(item['references'])
+                # Messages not yet expired from the hot table are in both tiers
+                messages.setdefault(repr(item['timestamp']), item)
+            return sorted(messages.values(), key=lambda x: x['timestamp'])
+
     def delete_conversation(self, user_id: str, conversation_id: str) -> bool:
         """
         Delete an entire conversation
         """
         try:
             # Query all messages in the conversation
-            response = self.table.query(
-                KeyConditionExpression=Key('user_id').eq(user_id),
+            items = self._query_items(
+                self._conversation_key_condition(user_id, conversation_id),
                 FilterExpression='conversation_id = :cid',
                 ExpressionAttributeValues={
                     ':cid': conversation_id
@@ -178,18 +292,53 @@ class ChatHistoryManager:
             )
 
             # Delete each message
-            for item in response.get('Items', []):
+            for item in items:
                 self.table.delete_item(
                     Key={
                         'user_id': user_id,
                         'timestamp': item['timestamp']
                     }
                 )
+            if self.archive is not None:
+                self.archive.delete_conversation(user_id, conversation_id)
+            self.search.forget_conversation(user_id, conversation_id)
             return True
         except Exception as e:
             logger.error(f"Error deleting conversation: {str(e)}")
             return False
 
+    def iter_history(self, user_id: str = None):
+        """
+        Stream the raw items of one user or of all users, archived ones included, a page at a time
+        """
+        return iter_history_items(self.table, user_id, self.archive)
+
+    def export_history(self, path: str, user_id: str = None) -> int:
+        """
+        Export the history of one user (or all users) to an NDJSON file, gzipped if it ends in .gz
+        """
+        with get_tracer().span('chat_history.export_history'):
+            return export_history(self.table, path, user_id, self.archive)
+
+    def import_history(self, path: str, workers: int = 8) -> Dict:
+        """
+        Bulk load an NDJSON export into the table
+        """
+        with get_tracer().span('chat_history.import_history'):
+            report = import_history(self.dynamodb, self.table.name, path, workers)
+        logger.info(f"Imported {report['written']} items into {self.table.name}, {report['failed']} failed")
+        return report
+
+    def search_conversations(self, user_id: str, query: str, limit: int = 10) -> List[Dict]:
+        """
+        Find conversations by their content, best match first
+        """
+        try:
+            return self.search.search(user_id, query, limit)
+        except Exception as e:
+            logger.error(f"Error searching conversations: {str(e)}")
+            return []
+
     def clear_history(self):
         st.session_state.messages = []
         st.session_state.session_id = str(uuid.uuid4())
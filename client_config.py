@@ -0,0 +1,96 @@
+import os
+import json
+import logging
+from typing import Any, Dict
+
+import boto3
+from botocore.config import Config
+
+from tracing import instrument_client
+
+logger = logging.getLogger()
+
+# botocore Config options per workload. Pools are sized for the fan-out each
+# workload can reach in one process: the Bedrock limiters go up to 64
+# concurrent calls, the Streamlit app serves many sessions from one process.
+# Retries are counted as total_max_attempts, the first attempt included.
+# Bedrock profiles make a single attempt: botocore's standard mode would also
+# retry throttles, multiplying every concurrency_limiter retry by its own.
+# The limiter retries throttles and transient 5xx and connection errors for
+# generation; rerank runs under a latency budget with a local fallback, so a
+# failed call fails over to the next region or falls back instead of retrying.
+PROFILES: Dict[str, Dict[str, Any]] = {
+    # retrieve_and_generate, retrieve and converse; generation can take tens of seconds
+    'bedrock': {
+        'max_pool_connections': 64,
+        'connect_timeout': 3,
+        'read_timeout': 60,
+        'retries': {'mode': 'standard', 'total_max_attempts': 1},
+        'tcp_keepalive': True
+    },
+    # Rerank calls are small and run under a latency budget with a local fallback
+    'rerank': {
+        'max_pool_connections': 32,
+        'connect_timeout': 2,
+        'read_timeout': 10,
+        'retries': {'mode': 'standard', 'total_max_attempts': 1},
+        'tcp_keepalive': True
+    },
+    # Chat history, feedback and the Lambda's shared tables: single-digit ms calls
+    'dynamodb': {
+        'max_pool_connections': 50,
+        'connect_timeout': 2,
+        'read_timeout': 5,
+        'retries': {'mode': 'adaptive', 'total_max_attempts': 5},
+        'tcp_keepalive': True
+    },
+    # S3 presigning and object reads
+    'storage': {
+        'max_pool_connections': 25,
+        'connect_timeout': 2,
+        'read_timeout': 10,
+        'retries': {'mode': 'standard', 'total_max_attempts': 4},
+        'tcp_keepalive': True
+    },
+    # Infrequent control-plane calls such as listing ingestion jobs
+    'control': {
+        'max_pool_connections': 4,
+        'connect_timeout': 5,
+        'read_timeout': 30,
+        'retries': {'mode': 'standard', 'total_max_attempts': 6}
+    }
+}
+
+
+def _overrides() -> Dict[str, Dict[str, Any]]:
+    """Per-profile option overrides from AWS_CLIENT_CONFIG, e.g. {"bedrock": {"max_pool_connections": 128}}"""
+    value = os.environ.get('AWS_CLIENT_CONFIG')
+    if not value:
+        return {}
+    try:
+        return json.loads(value)
+    except ValueError as e:
+        logger.error(f"Ignoring invalid AWS_CLIENT_CONFIG: {str(e)}")
+        return {}
+
+
+def client_config(profile: str, **options) -> Config:
+    """botocore Config for a workload profile, with AWS_CLIENT_CONFIG and keyword overrides applied"""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown client profile: {profile}")
+    settings = {**PROFILES[profile], **_overrides().get(profile, {}), **options}
+    return Config(**settings)
+
+
+def create_client(service_name: str, profile: str, **kwargs):
+    """boto3 client configured with a workload profile"""
+    client = boto3.client(service_name, config=client_config(profile), **kwargs)
+    instrument_client(client)
+    return client
+
+
+def create_resource(service_name: str, profile: str, **kwargs):
+    """boto3 resource configured with a workload profile"""
+    resource = boto3.resource(service_name, config=client_config(profile), **kwargs)
+    instrument_client(resource.meta.client)
+    return resource
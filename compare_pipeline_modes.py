@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import List, Dict, Any
+
+from benchmark_utils import load_query_corpus, percentile, write_report
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODES = ['retrieve_and_generate', 'two_phase']
+
+
+def run_mode(handler, queries: List[str], mode: str) -> Dict[str, Any]:
+    """Drive the handler over every query in one pipeline mode"""
+    latencies = []
+    input_tokens = []
+    passages_sent = []
+    reference_counts = []
+    estimated = False
+    errors = 0
+
+    for query in queries:
+        event = {'body': json.dumps({'user_query': query, 'pipeline_mode': mode})}
+        start = time.perf_counter()
+        response = handler(event, None)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        body = json.loads(response['body'])
+        if response['statusCode'] != 200:
+            errors += 1
+            logger.warning(f"[{mode}] {query!r} failed: {body.get('error')}")
+            continue
+
+        debug_info = body.get('debug_info', {})
+        usage = debug_info.get('generation_usage') or {}
+        budget = debug_info.get('token_budget') or {}
+        if 'inputTokens' in usage:
+            input_tokens.append(usage['inputTokens'])
+        elif 'estimated_input_tokens' in budget:
+            # retrieve_and_generate does not report usage, so fall back to the budget's estimate
+            input_tokens.append(budget['estimated_input_tokens'])
+            estimated = True
+        if 'passages_sent' in usage:
+            passages_sent.append(usage['passages_sent'])
+        reference_counts.append(body.get('sourceCount', 0))
+
+    return {
+        'mode': mode,
+        'queries': len(queries),
+        'errors': errors,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 1),
+            'p95': round(percentile(latencies, 95), 1),
+            'max': round(max(latencies, default=0), 1)
+        },
+        'avg_input_tokens': round(sum(input_tokens) / len(input_tokens), 1) if input_tokens else None,
+        'input_tokens_estimated': estimated,
+        'avg_passages_sent': round(sum(passages_sent) / len(passages_sent), 2) if passages_sent else None,
+        'avg_references': round(sum(reference_counts) / len(reference_counts), 2) if reference_counts else 0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Lambda pipeline modes on a recorded query set")
+    parser.add_argument('--queries', nargs='+', help="JSONL files of queries (default: requests.jsonl or sample_queries.jsonl)")
+    parser.add_argument('--fixtures', help="Replay recorded upstream responses instead of calling AWS")
+    parser.add_argument('--record', help="Record live upstream responses to this fixture file")
+    parser.add_argument('--modes', nargs='+', default=DEFAULT_MODES, help="Pipeline modes to compare")
+    parser.add_argument('--output', help="Write the comparison as JSON to this file")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        os.environ.setdefault('KNOWLEDGE_BASE_ID', 'benchmark-kb')
+        os.environ.setdefault('FM_ARN', 'benchmark-model')
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    elif not os.environ.get('KNOWLEDGE_BASE_ID') or not os.environ.get('FM_ARN'):
+        sys.exit("KNOWLEDGE_BASE_ID and FM_ARN must be set to run the comparison")
+
+    # Imported late so the environment check runs first
+    import lambda_function
+
+    from bedrock_stubs import FixtureStore, install_recorders, install_stubs
+    recording = FixtureStore()
+    if args.fixtures:
+        install_stubs(lambda_function, fixtures=FixtureStore.load(args.fixtures))
+    elif args.record:
+        install_recorders(lambda_function, recording)
+
+    queries = load_query_corpus(args.queries)
+    results = [run_mode(lambda_function.lambda_handler, queries, mode) for mode in args.modes]
+    write_report(results, args.output)
+
+    if args.record and not args.fixtures:
+        recording.save(args.record)
+
+
+if __name__ == "__main__":
+    main()
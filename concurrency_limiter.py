@@ -0,0 +1,196 @@
+import os
+import math
+import time
+import random
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from botocore.exceptions import ConnectionError as BotocoreConnectionError, HTTPClientError
+
+logger = logging.getLogger()
+
+# Error codes Bedrock and the other AWS APIs use when a quota is exceeded
+THROTTLING_ERRORS = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceUnavailableException',
+    'ProvisionedThroughputExceededException'
+}
+
+# Server-side failures worth another attempt; any other 5xx response counts too
+TRANSIENT_ERRORS = {
+    'InternalServerException',
+    'InternalFailure',
+    'ModelNotReadyException',
+    'RequestTimeout'
+}
+
+
+class Overloaded(Exception):
+    """The call was shed instead of being sent; retry after retry_after seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_throttling(error: Exception) -> bool:
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') in THROTTLING_ERRORS
+
+
+def is_transient(error: Exception) -> bool:
+    """Connection errors, timeouts and 5xx responses, which usually succeed when retried"""
+    if isinstance(error, (BotocoreConnectionError, HTTPClientError)):
+        return True
+    response = getattr(error, 'response', {})
+    if response.get('Error', {}).get('Code') in TRANSIENT_ERRORS:
+        return True
+    return response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Retry-After hint from a throttling response, if the service sent one"""
+    headers = getattr(error, 'response', {}).get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    value = headers.get('retry-after') or headers.get('x-amzn-retry-after')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for one upstream API, shared by the container.
+
+    Each call holds one permit while it runs. Successes raise the limit by
+    one permit per `limit` successes (additive increase); a throttling error
+    multiplies it by decrease_factor (multiplicative decrease), at most once
+    per backoff window so a burst of throttles counts as one signal. Callers
+    wait for a permit or the end of a backoff window for up to
+    queue_timeout_ms and are then rejected with Overloaded, which the
+    handler turns into a 429.
+
+    This is the only retry layer for Bedrock calls (their botocore clients
+    make a single attempt), so it also retries transient errors up to
+    max_retries times within the queue timeout. Those back off without
+    lowering the limit and, once retries run out, raise the original error.
+    """
+
+    def __init__(self, name: str, initial_limit: int = 8, min_limit: int = 1, max_limit: int = 64,
+                 decrease_factor: float = 0.75, queue_timeout_ms: float = 2000, max_retries: int = 2,
+                 base_backoff_ms: float = 100, max_backoff_ms: float = 5000):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.queue_timeout_ms = queue_timeout_ms
+        self.max_retries = max_retries
+        self.base_backoff_ms = base_backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.limit = float(initial_limit)
+        self.in_flight = 0
+        self.counters = {'calls': 0, 'succeeded': 0, 'failed': 0, 'throttled': 0, 'retried': 0, 'rejected': 0}
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls, name: str) -> 'AdaptiveLimiter':
+        """Limiter configured from the BEDROCK_CONCURRENCY_* environment variables"""
+        return cls(
+            name,
+            initial_limit=int(os.environ.get('BEDROCK_CONCURRENCY_INITIAL', 8)),
+            min_limit=int(os.environ.get('BEDROCK_CONCURRENCY_MIN', 1)),
+            max_limit=int(os.environ.get('BEDROCK_CONCURRENCY_MAX', 64)),
+            queue_timeout_ms=float(os.environ.get('BEDROCK_QUEUE_TIMEOUT_MS', 2000)),
+            max_retries=int(os.environ.get('BEDROCK_THROTTLE_RETRIES', 2))
+        )
+
+    def _acquire(self, deadline: float) -> None:
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if now >= self._blocked_until and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                ready_at = max(self._blocked_until, now)
+                if ready_at >= deadline or now >= deadline:
+                    self.counters['rejected'] += 1
+                    retry_after = max(self._blocked_until - now, self.base_backoff_ms / 1000)
+                    raise Overloaded(f"{self.name} is overloaded, retry after {retry_after:.1f}s", retry_after)
+                # Wake up when a permit is released or the backoff window ends
+                self._condition.wait(timeout=min(deadline, max(ready_at, now + 0.001)) - now)
+
+    def _release(self, outcome: str, backoff: float = 0.0) -> None:
+        """Return a permit and adjust the limit for a succeeded, failed or throttled call"""
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome == 'throttled':
+                self.counters['throttled'] += 1
+                self._blocked_until = max(self._blocked_until, now + backoff)
+                if now - self._last_decrease >= backoff:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    logger.warning(f"{self.name} throttled, concurrency limit now {int(self.limit)}")
+            elif outcome == 'failed':
+                self.counters['failed'] += 1
+            elif outcome == 'succeeded':
+                self.counters['succeeded'] += 1
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _backoff_seconds(self, error: Exception, attempt: int) -> float:
+        hinted = retry_after_seconds(error)
+        if hinted is not None:
+            return hinted
+        # Full jitter so retries from a burst spread out
+        ceiling = min(self.max_backoff_ms, self.base_backoff_ms * 2 ** attempt)
+        return random.uniform(self.base_backoff_ms / 2, ceiling) / 1000
+
+    def call(self, function: Callable, *args, **kwargs) -> Any:
+        """Run an upstream call under the limit, retrying throttles and transient errors within the queue timeout"""
+        with self._condition:
+            self.counters['calls'] += 1
+        deadline = time.monotonic() + self.queue_timeout_ms / 1000
+        attempt = 0
+        while True:
+            self._acquire(deadline)
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttling(e)
+                if not throttled and not is_transient(e):
+                    self._release('failed')
+                    raise
+                backoff = self._backoff_seconds(e, attempt)
+                self._release('throttled' if throttled else 'failed', backoff)
+                if attempt >= self.max_retries or time.monotonic() + backoff >= deadline:
+                    if not throttled:
+                        raise
+                    with self._condition:
+                        self.counters['rejected'] += 1
+                    raise Overloaded(f"{self.name} throttled: {str(e)}", max(backoff, self.base_backoff_ms / 1000)) from e
+                attempt += 1
+                with self._condition:
+                    self.counters['retried'] += 1
+                if not throttled:
+                    # Throttles wait out the shared backoff window in _acquire; transient errors wait here
+                    time.sleep(backoff)
+                continue
+            self._release('succeeded')
+            return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'backoff_remaining_ms': round(max(0.0, self._blocked_until - time.monotonic()) * 1000, 1),
+                **self.counters
+            }
+
+
+def retry_after_header(retry_after: float) -> str:
+    """Retry-After header value in whole seconds"""
+    return str(max(1, math.ceil(retry_after)))
@@ -0,0 +1,157 @@
+"""Judges that score pipeline answers for evaluate_pipeline.py.
+
+A judge takes the evaluated question, the generated answer and the
+references returned with it, and returns scores between 0 and 1 (None when
+a score does not apply, e.g. correctness without an expected answer) plus
+the tokens it used:
+
+    {'scores': {'correctness': 0.75, ...}, 'usage': {'inputTokens': 0, 'outputTokens': 0}}
+
+BedrockJudge asks a Bedrock model to grade the answer, following the
+LLM-as-judge rubric of Bedrock model evaluation jobs. LexicalJudge scores
+by term overlap; it is deterministic and needs no AWS access, so it stands
+in for the model judge in tests and stubbed runs.
+"""
+import re
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from query_features import content_terms
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('correctness', 'completeness', 'faithfulness', 'reference_relevance')
+
+# Models Bedrock supports as evaluators
+DEFAULT_JUDGE_MODEL = 'anthropic.claude-3-haiku-20240307-v1:0'
+
+JUDGE_PROMPT = """You are grading the answer of a knowledge base assistant.
+Rate each criterion from 1 (worst) to 5 (best):
+- correctness: the answer agrees with the expected answer (null if there is no expected answer)
+- completeness: the answer addresses every part of the question
+- faithfulness: every claim in the answer is supported by the references
+- reference_relevance: the references are relevant to the question
+Reply with only a JSON object with these four keys and a short "rationale".
+
+<question>
+{question}
+</question>
+<expected_answer>
+{expected_answer}
+</expected_answer>
+<answer>
+{answer}
+</answer>
+<references>
+{references}
+</references>"""
+
+
+def _coverage(terms: set, of_terms: set) -> Optional[float]:
+    """Share of of_terms found in terms"""
+    if not of_terms:
+        return None
+    return len(terms & of_terms) / len(of_terms)
+
+
+class LexicalJudge:
+    """Deterministic judge scoring term overlap between question, answer and references"""
+
+    name = 'lexical'
+
+    def judge(self, question: Dict[str, Any], answer: str, references: List[Dict[str, Any]]) -> Dict[str, Any]:
+        answer_terms = content_terms(answer)
+        query_terms = content_terms(question['user_query'])
+        reference_terms = [content_terms(ref.get('snippet', '')) for ref in references]
+        expected = question.get('expected_answer')
+
+        correctness = None
+        if expected:
+            expected_terms = content_terms(expected)
+            recall = _coverage(answer_terms, expected_terms) or 0.0
+            precision = _coverage(expected_terms, answer_terms) or 0.0
+            correctness = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+        relevance = [_coverage(terms, query_terms) for terms in reference_terms]
+        relevance = [score for score in relevance if score is not None]
+        return {
+            'scores': {
+                'correctness': correctness,
+                'completeness': _coverage(answer_terms, query_terms),
+                'faithfulness': _coverage(set().union(*reference_terms), answer_terms) if references else 0.0,
+                'reference_relevance': sum(relevance) / len(relevance) if relevance else 0.0
+            },
+            'usage': {'inputTokens': 0, 'outputTokens': 0}
+        }
+
+
+class BedrockJudge:
+    """Grade answers with a Bedrock model through the Converse API"""
+
+    def __init__(self, model_id: str = DEFAULT_JUDGE_MODEL, client=None, max_reference_chars: int = 1500):
+        if client is None:
+            from client_config import create_client
+            client = create_client('bedrock-runtime', 'bedrock')
+        self.name = f"bedrock:{model_id}"
+        self.model_id = model_id
+        self.client = client
+        self.max_reference_chars = max_reference_chars
+
+    def judge(self, question: Dict[str, Any], answer: str, references: List[Dict[str, Any]]) -> Dict[str, Any]:
+        prompt = JUDGE_PROMPT.format(
+            question=question['user_query'],
+            expected_answer=question.get('expected_answer') or 'none',
+            answer=answer,
+            references='\n\n'.join(
+                f"[{index}] {ref.get('snippet', '')[:self.max_reference_chars]}"
+                for index, ref in enumerate(references, start=1)
+            ) or 'none'
+        )
+        response = self.client.converse(
+            modelId=self.model_id,
+            messages=[{'role': 'user', 'content': [{'text': prompt}]}],
+            inferenceConfig={'maxTokens': 300, 'temperature': 0}
+        )
+        text = response['output']['message']['content'][0]['text']
+        usage = response.get('usage', {})
+        return {
+            'scores': self.parse_scores(text, has_expected_answer=bool(question.get('expected_answer'))),
+            'usage': {'inputTokens': usage.get('inputTokens', 0), 'outputTokens': usage.get('outputTokens', 0)},
+            'rationale': self._rationale(text)
+        }
+
+    @staticmethod
+    def parse_scores(text: str, has_expected_answer: bool) -> Dict[str, Optional[float]]:
+        """Scores from the judge's reply, 1-5 ratings mapped to 0-1"""
+        match = re.search(r'\{.*\}', text, re.S)
+        if not match:
+            raise ValueError(f"Judge reply has no JSON object: {text[:200]!r}")
+        ratings = json.loads(match.group(0))
+        scores = {}
+        for metric in METRICS:
+            rating = ratings.get(metric)
+            if rating is None or (metric == 'correctness' and not has_expected_answer):
+                scores[metric] = None
+            else:
+                scores[metric] = (min(5.0, max(1.0, float(rating))) - 1) / 4
+        return scores
+
+    @staticmethod
+    def _rationale(text: str) -> Optional[str]:
+        match = re.search(r'\{.*\}', text, re.S)
+        try:
+            return json.loads(match.group(0)).get('rationale') if match else None
+        except ValueError:
+            return None
+
+
+def judge_from_spec(spec: str):
+    """Judge named on the command line: lexical, bedrock or bedrock:<model id>"""
+    if spec == 'lexical':
+        return LexicalJudge()
+    if spec == 'bedrock':
+        return BedrockJudge()
+    if spec.startswith('bedrock:'):
+        return BedrockJudge(spec[len('bedrock:'):])
+    raise ValueError(f"Unknown judge {spec}, expected lexical, bedrock or bedrock:<model id>")
@@ -0,0 +1,318 @@
+"""Offline evaluation of pipeline configurations with an LLM judge.
+
+Drives lambda_handler over a question set for each configuration, with up to
+--concurrency questions in flight, scores every answer and its references
+with a judge (eval_judges.py) and reports quality next to latency and token
+cost per configuration.
+
+Questions are JSONL with a user_query (or query) field, and optionally an
+id, an expected_answer and expected_sources (substrings of the source URIs
+that should be cited):
+
+    {"id": "leave-1", "user_query": "How many vacation days do I get?", "expected_answer": "25 days", "expected_sources": ["leave-policy.pdf"]}
+
+Configurations are a JSON list; env is applied before lambda_function is
+imported (each configuration runs in its own process), request is merged
+into every request body and prices are USD per 1000 tokens:
+
+    [
+      {"name": "baseline"},
+      {"name": "deep", "env": {"RETRIEVAL_POLICY": "fixed", "RETRIEVAL_DEFAULT_RESULTS": "10"}},
+      {"name": "strict-rerank", "env": {"RELEVANCE_THRESHOLD": "0.5"}},
+      {"name": "two-phase", "request": {"pipeline_mode": "two_phase"},
+       "prices": {"input_per_1k": 0.003, "output_per_1k": 0.015}}
+    ]
+
+Every judged answer is appended to --checkpoint as soon as it is scored, so
+an interrupted run picks up where it stopped. Questions that got a 429 or a
+5xx are not checkpointed, so the next run asks them again. Results are keyed by a
+fingerprint of the configuration and judge, so editing a configuration
+re-runs it instead of reusing stale answers:
+
+    python evaluate_pipeline.py questions.jsonl --configs configs.json --judge bedrock --concurrency 8
+    python evaluate_pipeline.py sample_queries.jsonl --stub --judge lexical
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from api_client import decode_api_response
+from benchmark_utils import latency_summary, write_report
+from eval_judges import METRICS, judge_from_spec
+from token_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIGS = [{'name': 'baseline'}]
+
+
+class RetryableResponse(Exception):
+    """The handler shed or failed the request; the question is left for the next run"""
+
+
+def load_questions(paths: List[str]) -> List[Dict[str, Any]]:
+    """Questions from JSONL files, each with an id"""
+    questions = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                query = record.get('user_query') or record.get('query')
+                if not query:
+                    continue
+                questions.append({
+                    'id': str(record.get('id') or hashlib.sha1(query.encode('utf-8')).hexdigest()[:12]),
+                    'user_query': query,
+                    'expected_answer': record.get('expected_answer'),
+                    'expected_sources': record.get('expected_sources') or []
+                })
+    return questions
+
+
+def config_fingerprint(config: Dict[str, Any], judge: str) -> str:
+    """Key of a configuration's results; changes whenever the configuration or judge does"""
+    canonical = json.dumps({'config': config, 'judge': judge}, sort_keys=True)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+class Checkpoint:
+    """Append-only JSONL of judged answers, safe to read back after an interruption"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        results = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    results.append(json.loads(line))
+                except ValueError:
+                    # The line being written when the run was killed
+                    continue
+        return results
+
+    def completed(self, fingerprint: str) -> set:
+        return {result['question_id'] for result in self.load() if result['fingerprint'] == fingerprint}
+
+    def append(self, result: Dict[str, Any]) -> None:
+        line = json.dumps(result, default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+
+
+def token_usage(answer: str, debug_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Generation tokens as reported by the model, or estimated where the pipeline does not report them"""
+    usage = debug_info.get('generation_usage') or {}
+    if 'inputTokens' in usage:
+        return {'input': usage['inputTokens'], 'output': usage.get('outputTokens', 0), 'estimated': False}
+    budget = debug_info.get('token_budget') or {}
+    return {'input': budget.get('estimated_input_tokens', 0), 'output': estimate_tokens(answer), 'estimated': True}
+
+
+def source_recall(expected_sources: List[str], references: List[Dict[str, Any]]) -> Optional[float]:
+    """Share of the expected sources cited among the references"""
+    if not expected_sources:
+        return None
+    uris = [ref.get('uri', '') for ref in references]
+    return sum(1 for source in expected_sources if any(source in uri for uri in uris)) / len(expected_sources)
+
+
+def evaluate_question(handler, judge, question: Dict[str, Any], config: Dict[str, Any],
+                      fingerprint: str) -> Dict[str, Any]:
+    """Answer one question through the handler and judge the answer"""
+    body = {'use_warm_answers': False, **config.get('request', {}), 'user_query': question['user_query']}
+    start = time.perf_counter()
+    response = handler({'body': json.dumps(body), 'internal_job': 'evaluation'}, None)
+    latency_ms = (time.perf_counter() - start) * 1000
+    status_code = response['statusCode']
+    # Throttles and server errors say nothing about the configuration's quality
+    if status_code == 429 or status_code >= 500:
+        raise RetryableResponse(f"status {status_code}")
+    payload = decode_api_response(response)
+    result = {
+        'fingerprint': fingerprint,
+        'config': config['name'],
+        'question_id': question['id'],
+        'status_code': status_code,
+        'latency_ms': round(latency_ms, 3)
+    }
+    if status_code != 200:
+        result['error'] = payload.get('error')
+        return result
+
+    answer = payload.get('generated_response', '')
+    references = payload.get('detailed_references', [])
+    verdict = judge.judge(question, answer, references)
+    result.update({
+        'answer': answer,
+        'references': [ref.get('uri') for ref in references],
+        'scores': {**verdict['scores'], 'source_recall': source_recall(question['expected_sources'], references)},
+        'tokens': token_usage(answer, payload.get('debug_info', {})),
+        'judge_usage': verdict['usage']
+    })
+    if verdict.get('rationale'):
+        result['rationale'] = verdict['rationale']
+    return result
+
+
+def run_configuration(options: Dict[str, Any]) -> Dict[str, int]:
+    """Process entry point: evaluate the pending questions of one configuration"""
+    config = options['config']
+    logging.basicConfig(level=logging.ERROR)
+    os.environ.update({key: str(value) for key, value in config.get('env', {}).items()})
+    if options['stub']:
+        os.environ.setdefault('KNOWLEDGE_BASE_ID', 'eval-kb')
+        os.environ.setdefault('FM_ARN', 'arn:aws:bedrock:us-east-1::foundation-model/eval-model')
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    import lambda_function
+    logging.getLogger().setLevel(logging.ERROR)
+    if options['stub']:
+        from bedrock_stubs import FixtureStore, install_stubs
+        fixtures = FixtureStore.load(options['fixtures']) if options['fixtures'] else None
+        install_stubs(lambda_function, latency_profile=options['latency_profile'], fixtures=fixtures)
+
+    judge = judge_from_spec(options['judge'])
+    checkpoint = Checkpoint(options['checkpoint'])
+    done = checkpoint.completed(options['fingerprint'])
+    pending = [question for question in options['questions'] if question['id'] not in done]
+    counts = {'skipped': len(options['questions']) - len(pending), 'evaluated': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def run(question):
+        try:
+            result = evaluate_question(lambda_function.lambda_handler, judge, question, config,
+                                       options['fingerprint'])
+        except Exception as e:
+            # Not checkpointed, so the next run retries the question
+            logger.warning(f"[{config['name']}] {question['id']} failed: {str(e)}")
+            with lock:
+                counts['failed'] += 1
+            return
+        checkpoint.append(result)
+        with lock:
+            counts['evaluated'] += 1
+
+    with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+        list(executor.map(run, pending))
+    return counts
+
+
+def _mean(values: List[Optional[float]]) -> Optional[float]:
+    values = [value for value in values if value is not None]
+    return round(sum(values) / len(values), 4) if values else None
+
+
+def summarize(config: Dict[str, Any], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    answered = [result for result in results if 'scores' in result]
+    prices = config.get('prices', {})
+    input_tokens = [result['tokens']['input'] for result in answered]
+    output_tokens = [result['tokens']['output'] for result in answered]
+    cost = (sum(input_tokens) * prices.get('input_per_1k', 0.0) + sum(output_tokens) * prices.get('output_per_1k', 0.0)) / 1000
+    return {
+        'config': config['name'],
+        'questions': len(results),
+        'errors': len(results) - len(answered),
+        'quality': {
+            metric: _mean([result['scores'].get(metric) for result in answered])
+            for metric in METRICS + ('source_recall',)
+        },
+        'latency_ms': latency_summary([result['latency_ms'] for result in results]),
+        'tokens_per_question': {
+            'input': _mean(input_tokens),
+            'output': _mean(output_tokens),
+            'estimated': any(result['tokens']['estimated'] for result in answered)
+        },
+        'cost_usd': {
+            'total': round(cost, 6),
+            'per_question': round(cost / len(answered), 6) if answered else None
+        } if prices else None,
+        'judge_tokens': sum(
+            result['judge_usage']['inputTokens'] + result['judge_usage']['outputTokens'] for result in answered
+        )
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate pipeline configurations with an LLM judge")
+    parser.add_argument('questions', nargs='+', help="JSONL question files")
+    parser.add_argument('--configs', help="JSON list of configurations (default: the current environment)")
+    parser.add_argument('--judge', default='bedrock', help="lexical, bedrock or bedrock:<model id>")
+    parser.add_argument('--concurrency', type=int, default=8, help="Questions in flight per configuration")
+    parser.add_argument('--checkpoint', default='eval_checkpoint.jsonl', help="File of judged answers to resume from")
+    parser.add_argument('--fresh', action='store_true', help="Discard the checkpoint and start over")
+    parser.add_argument('--stub', action='store_true', help="Answer with stubbed AWS clients instead of calling AWS")
+    parser.add_argument('--fixtures', help="With --stub, replay recorded upstream responses")
+    parser.add_argument('--latency-profile', default='zero', help="With --stub, the stub latency profile")
+    parser.add_argument('--output', help="Write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    questions = load_questions(args.questions)
+    if not questions:
+        raise SystemExit("No questions found")
+    configs = DEFAULT_CONFIGS
+    if args.configs:
+        with open(args.configs) as f:
+            configs = json.load(f)
+    if args.fresh and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    fingerprints = {config['name']: config_fingerprint(config, args.judge) for config in configs}
+    context = multiprocessing.get_context('spawn')
+    started = time.perf_counter()
+    for config in configs:
+        options = {
+            'config': config,
+            'fingerprint': fingerprints[config['name']],
+            'questions': questions,
+            'judge': args.judge,
+            'concurrency': args.concurrency,
+            'checkpoint': args.checkpoint,
+            'stub': args.stub,
+            'fixtures': args.fixtures,
+            'latency_profile': args.latency_profile
+        }
+        # A fresh process per configuration, since lambda_function reads its settings at import
+        with context.Pool(1) as pool:
+            counts = pool.apply(run_configuration, (options,))
+        logger.info(f"[{config['name']}] {counts['evaluated']} evaluated, {counts['skipped']} from checkpoint, "
+                    f"{counts['failed']} failed")
+
+    question_ids = {question['id'] for question in questions}
+    latest = {}
+    for result in Checkpoint(args.checkpoint).load():
+        if result['question_id'] in question_ids:
+            latest[(result['fingerprint'], result['question_id'])] = result
+    report = {
+        'judge': args.judge,
+        'questions': len(questions),
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'configs': [
+            summarize(config, [
+                result for (fingerprint, _), result in latest.items() if fingerprint == fingerprints[config['name']]
+            ])
+            for config in configs
+        ]
+    }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,13 @@
-import boto3
 from datetime import datetime
 import uuid
 import streamlit as st
 from typing import List, Dict, Any
 
+from client_config import create_resource
+
 class FeedbackHandler:
     def __init__(self):
-        self.dynamodb = boto3.resource('dynamodb')
+        self.dynamodb = create_resource('dynamodb', 'dynamodb')
         self.feedback_table = self.dynamodb.Table('ChatFeedback')
         self._create_feedback_table()
         self._initialize_session_state()
@@ -0,0 +1,296 @@
+import math
+import time
+import heapq
+import bisect
+import logging
+import threading
+from collections import Counter, OrderedDict
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from boto3.dynamodb.conditions import Key
+
+from query_features import STOPWORDS, tokenize
+
+logger = logging.getLogger(__name__)
+
+
+def index_terms(text: str) -> List[str]:
+    """Terms a message is indexed and searched by: tokens other than stopwords"""
+    return [token for token in tokenize(text) if token not in STOPWORDS]
+
+
+def _snippet(content: str, terms: List[str], width: int = 120) -> str:
+    """Part of a message around the first occurrence of any of the terms"""
+    lowered = content.lower()
+    positions = [lowered.find(term) for term in terms]
+    start = min((position for position in positions if position >= 0), default=0)
+    start = max(0, start - width // 4)
+    snippet = content[start:start + width].strip()
+    return ('...' if start > 0 else '') + snippet + ('...' if start + width < len(content) else '')
+
+
+class HistoryIndex:
+    """Inverted index over one user's chat history, with conversations as documents.
+
+    Postings map each term to the conversations containing it and its
+    frequency there. Messages are added one at a time, so the index is kept
+    current as messages are saved. search() ranks conversations with BM25;
+    the last query term also matches as a prefix, so partial words match
+    while the user is typing.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, max_prefix_expansions: int = 50):
+        self.k1 = k1
+        self.b = b
+        self.max_prefix_expansions = max_prefix_expansions
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.conversations: Dict[str, Dict[str, Any]] = {}
+        self.total_length = 0
+        # Newest timestamp read from the table; messages indexed as they are saved do not move it
+        self.watermark = 0.0
+        self._terms: List[str] = []
+        self._message_keys = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._message_keys)
+
+    def advance_watermark(self, timestamp: float) -> None:
+        with self._lock:
+            self.watermark = max(self.watermark, timestamp)
+
+    def add_message(self, conversation_id: str, timestamp: float, role: str, content: str,
+                    date: Optional[str] = None) -> bool:
+        """Index one message; returns False if it was already indexed"""
+        with self._lock:
+            return self._add_message(conversation_id, timestamp, role, content, date)
+
+    def _add_message(self, conversation_id: str, timestamp: float, role: str, content: str,
+                     date: Optional[str]) -> bool:
+        message_key = (conversation_id, timestamp)
+        if message_key in self._message_keys:
+            return False
+        self._message_keys.add(message_key)
+
+        conversation = self.conversations.get(conversation_id)
+        if conversation is None:
+            conversation = self.conversations[conversation_id] = {
+                'conversation_id': conversation_id,
+                'title': '',
+                'date': date,
+                'updated_at': timestamp,
+                'length': 0,
+                'messages': []
+            }
+        if role == 'user' and (not conversation['title'] or timestamp < conversation['messages'][0][0]):
+            conversation['title'] = content[:50]
+        conversation['updated_at'] = max(conversation['updated_at'], timestamp)
+        bisect.insort(conversation['messages'], (timestamp, role, content))
+
+        terms = index_terms(content)
+        conversation['length'] += len(terms)
+        self.total_length += len(terms)
+        for term, count in Counter(terms).items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                bisect.insort(self._terms, term)
+            postings[conversation_id] = postings.get(conversation_id, 0) + count
+        return True
+
+    def remove_conversation(self, conversation_id: str) -> None:
+        with self._lock:
+            self._remove_conversation(conversation_id)
+
+    def _remove_conversation(self, conversation_id: str) -> None:
+        conversation = self.conversations.pop(conversation_id, None)
+        if conversation is None:
+            return
+        self.total_length -= conversation['length']
+        # Deletions are rare; re-tokenizing beats keeping a term list per conversation
+        terms = {term for message in conversation['messages'] for term in index_terms(message[2])}
+        for term in terms:
+            postings = self.postings[term]
+            del postings[conversation_id]
+            if not postings:
+                del self.postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+        self._message_keys -= {(conversation_id, message[0]) for message in conversation['messages']}
+
+    def _expand_prefix(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self._terms, prefix)
+        expansions = []
+        for term in self._terms[start:start + self.max_prefix_expansions]:
+            if not term.startswith(prefix):
+                break
+            expansions.append(term)
+        return expansions
+
+    def search(self, query: str, limit: int = 10, prefix: bool = True) -> List[Dict[str, Any]]:
+        """Conversations matching the query, best first.
+
+        Conversations containing every query term rank above those that
+        contain only some of them.
+        """
+        with self._lock:
+            return self._search(query, limit, prefix)
+
+    def _search(self, query: str, limit: int, prefix: bool) -> List[Dict[str, Any]]:
+        query_terms = index_terms(query)
+        if not query_terms or not self.conversations:
+            return []
+
+        document_count = len(self.conversations)
+        average_length = self.total_length / document_count or 1.0
+        scores = {}
+        matched = Counter()
+        for position, query_term in enumerate(query_terms):
+            candidates = {query_term: 1.0} if query_term in self.postings else {}
+            if prefix and position == len(query_terms) - 1:
+                for term in self._expand_prefix(query_term):
+                    # Completions of a partial word count a little less than the word itself
+                    candidates.setdefault(term, 0.8)
+            term_matches = set()
+            for term, weight in candidates.items():
+                postings = self.postings[term]
+                idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for conversation_id, frequency in postings.items():
+                    length = self.conversations[conversation_id]['length']
+                    norm = frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[conversation_id] = (
+                        scores.get(conversation_id, 0.0) + weight * idf * frequency * (self.k1 + 1) / norm
+                    )
+                    term_matches.add(conversation_id)
+            for conversation_id in term_matches:
+                matched[conversation_id] += 1
+
+        top = heapq.nlargest(limit, scores, key=lambda conversation_id: (matched[conversation_id],
+                                                                         scores[conversation_id]))
+        return [self._result(conversation_id, scores[conversation_id], query_terms) for conversation_id in top]
+
+    def _result(self, conversation_id: str, score: float, query_terms: List[str]) -> Dict[str, Any]:
+        conversation = self.conversations[conversation_id]
+        best = max(
+            conversation['messages'],
+            key=lambda message: sum(term in message[2].lower() for term in query_terms)
+        )
+        return {
+            'conversation_id': conversation_id,
+            'title': conversation['title'] or best[2][:50],
+            'date': conversation['date'],
+            'updated_at': conversation['updated_at'],
+            'score': round(score, 3),
+            'snippet': _snippet(best[2], query_terms)
+        }
+
+
+class HistorySearch:
+    """Per-user HistoryIndex instances over the ChatHistory table.
+
+    A user's index is built on first use from one Query of their partition
+    and then kept current by record() as messages are saved. Messages saved
+    by other processes are picked up by a Query for timestamps after the
+    newest one an earlier Query returned, at most every refresh_seconds;
+    messages recorded locally do not count, since other processes may have
+    saved older ones in the meantime. Searching never reads
+    the table beyond that. With an archive, the user's archived messages are
+    indexed too when their index is built, so conversations moved out of the
+    table stay searchable. The least recently used indexes are dropped
+    beyond max_users.
+    """
+
+    def __init__(self, table, refresh_seconds: float = 30, max_users: int = 100, archive=None):
+        self.table = table
+        self.archive = archive
+        self.refresh_seconds = refresh_seconds
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._refreshed_at = {}
+        self._lock = threading.Lock()
+
+    def _index(self, user_id: str) -> HistoryIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = self._indexes[user_id] = HistoryIndex()
+                self._refreshed_at[user_id] = None
+                while len(self._indexes) > self.max_users:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._refreshed_at.pop(evicted, None)
+            self._indexes.move_to_end(user_id)
+            refreshed_at = self._refreshed_at[user_id]
+            stale = refreshed_at is None or time.monotonic() - refreshed_at >= self.refresh_seconds
+            if stale:
+                self._refreshed_at[user_id] = time.monotonic()
+        if refreshed_at is None:
+            self._load_archive(user_id, index)
+        if stale:
+            self._catch_up(user_id, index)
+        return index
+
+    def _load_archive(self, user_id: str, index: HistoryIndex) -> None:
+        """Index the user's archived messages; they are older than the table's, so the watermark stays"""
+        if self.archive is None:
+            return
+        added = 0
+        try:
+            for item in self.archive.iter_items(user_id):
+                added += self._add_item(index, item)
+        except Exception as e:
+            # Search still covers the table
+            logger.error(f"Error indexing archived messages for user {user_id}: {str(e)}")
+        if added:
+            logger.info(f"Indexed {added} archived messages for user {user_id}")
+
+    def _catch_up(self, user_id: str, index: HistoryIndex) -> None:
+        """Index the user's messages newer than the newest one read before"""
+        condition = Key('user_id').eq(user_id)
+        if index.watermark:
+            condition = condition & Key('timestamp').gt(Decimal(str(index.watermark)))
+        query_kwargs = {
+            'KeyConditionExpression': condition,
+            'ProjectionExpression': '#ts, #role, #content, conversation_id, #date',
+            'ExpressionAttributeNames': {
+                '#ts': 'timestamp', '#role': 'role', '#content': 'content', '#date': 'date'
+            }
+        }
+        added = 0
+        newest = index.watermark
+        while True:
+            response = self.table.query(**query_kwargs)
+            for item in response.get('Items', []):
+                added += self._add_item(index, item)
+                newest = max(newest, float(item['timestamp']))
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        index.advance_watermark(newest)
+        if added:
+            logger.info(f"Indexed {added} messages for user {user_id}")
+
+    @staticmethod
+    def _add_item(index: HistoryIndex, item: Dict[str, Any]) -> bool:
+        return index.add_message(
+            item.get('conversation_id') or str(int(float(item['timestamp']))),
+            float(item['timestamp']),
+            item.get('role', ''),
+            item.get('content', ''),
+            item.get('date')
+        )
+
+    def record(self, user_id: str, item: Dict[str, Any]) -> None:
+        """Index a message just saved, if the user's index is loaded"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None:
+            self._add_item(index, item)
+
+    def forget_conversation(self, user_id: str, conversation_id: str) -> None:
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None:
+            index.remove_conversation(conversation_id)
+
+    def search(self, user_id: str, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return self._index(user_id).search(query, limit)
@@ -0,0 +1,255 @@
+"""Streaming export and bulk import of ChatHistory.
+
+Export walks the table a page at a time (a Query per user, or a Scan for
+everyone) and writes one item per line as NDJSON, gzipped when the path
+ends in .gz, so memory stays constant however large the history is. When
+an archive is configured (chat_archive.py), exports include the archived
+messages too.
+Import reads the same format back and writes it with parallel
+BatchWriteItem calls, retrying throttled and unprocessed items with
+exponential backoff.
+
+    python history_transfer.py export history.ndjson.gz
+    python history_transfer.py export alice.ndjson --user alice
+    python history_transfer.py import history.ndjson.gz --table ChatHistoryMigrated --workers 8
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from boto3.dynamodb.conditions import Key
+
+from chat_archive import ChatArchive, chat_archive_from_env
+from client_config import create_resource
+from concurrency_limiter import is_throttling
+
+logger = logging.getLogger(__name__)
+
+# BatchWriteItem accepts at most 25 requests
+BATCH_SIZE = 25
+
+
+def iter_history_items(table, user_id: Optional[str] = None, archive: Optional[ChatArchive] = None,
+                       page_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Items of one user (or of all users) a page at a time; with an archive, archived items come first"""
+    kwargs = {'Limit': page_size} if page_size else {}
+    if user_id is not None:
+        operation = table.query
+        kwargs['KeyConditionExpression'] = Key('user_id').eq(user_id)
+    else:
+        operation = table.scan
+
+    if archive is not None:
+        yield from archive.iter_items(user_id) if user_id is not None else archive.iter_all_items()
+    while True:
+        response = operation(**kwargs)
+        for item in response.get('Items', []):
+            if archive is not None and 'archived_at' in item:
+                # Already exported from the archive
+                continue
+            yield item
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def open_text(path: str, mode: str) -> TextIO:
+    """Text stream on a file, gzipped if the path ends in .gz, or stdin/stdout for -"""
+    if path == '-':
+        return sys.stdout if mode == 'w' else sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def write_items(items: Iterable[Dict[str, Any]], stream: TextIO) -> int:
+    """Write items as NDJSON, returning how many were written"""
+    count = 0
+    for item in items:
+        stream.write(json.dumps(item, default=_json_default, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def read_items(stream: TextIO) -> Iterator[Dict[str, Any]]:
+    """Items from NDJSON, with numbers as Decimal as boto3 expects"""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line, parse_float=Decimal)
+
+
+def export_history(table, path: str, user_id: Optional[str] = None,
+                   archive: Optional[ChatArchive] = None) -> int:
+    """Stream the history of one user (or all users) to path, returning the number of items"""
+    stream = open_text(path, 'w')
+    try:
+        return write_items(iter_history_items(table, user_id, archive), stream)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+
+class BulkImporter:
+    """Write items to a table with parallel BatchWriteItem calls.
+
+    Up to `workers` batches are in flight at once and at most twice that
+    many are buffered, so memory does not grow with the input. Throttling
+    errors and unprocessed items are retried with full-jitter exponential
+    backoff; a throttle also pauses the other workers for the backoff, so
+    the importer settles at the rate the table accepts instead of
+    hammering it. Items that still fail after max_retries are counted as
+    failed.
+    """
+
+    def __init__(self, dynamodb, table_name: str, workers: int = 8, max_retries: int = 8,
+                 base_backoff_ms: float = 50, max_backoff_ms: float = 5000,
+                 key_attributes: tuple = ('user_id', 'timestamp')):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.workers = workers
+        self.max_retries = max_retries
+        self.base_backoff_ms = base_backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.key_attributes = key_attributes
+        self.counters = {'items': 0, 'written': 0, 'failed': 0, 'batches': 0, 'throttled': 0, 'retries': 0}
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, **increments) -> None:
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def _backoff(self, attempt: int) -> None:
+        """Wait out a throttle, and hold back the other workers for as long"""
+        ceiling = min(self.max_backoff_ms, self.base_backoff_ms * 2 ** attempt)
+        delay = random.uniform(self.base_backoff_ms / 2, ceiling) / 1000
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        time.sleep(delay)
+
+    def _wait_if_blocked(self) -> None:
+        with self._lock:
+            delay = self._blocked_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _write_batch(self, items: List[Dict[str, Any]]) -> None:
+        requests = [{'PutRequest': {'Item': item}} for item in items]
+        attempt = 0
+        while requests:
+            self._wait_if_blocked()
+            try:
+                response = self.dynamodb.batch_write_item(RequestItems={self.table_name: requests})
+            except Exception as e:
+                throttled = (isinstance(e, self.dynamodb.meta.client.exceptions.ProvisionedThroughputExceededException)
+                             or is_throttling(e))
+                if not throttled or attempt >= self.max_retries:
+                    logger.error(f"Error importing {len(requests)} items: {str(e)}")
+                    self._count(failed=len(requests))
+                    return
+                self._count(throttled=1, retries=1)
+                self._backoff(attempt)
+                attempt += 1
+                continue
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            self._count(written=len(requests) - len(unprocessed))
+            requests = unprocessed
+            if requests:
+                if attempt >= self.max_retries:
+                    logger.error(f"Giving up on {len(requests)} unprocessed items")
+                    self._count(failed=len(requests))
+                    return
+                # Unprocessed items mean the table is at capacity
+                self._count(throttled=1, retries=1)
+                self._backoff(attempt)
+                attempt += 1
+
+    def _batches(self, items: Iterable[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+        batch = {}
+        for item in items:
+            self._count(items=1)
+            # A batch may not hold two writes to one key; the later line wins, as with sequential puts
+            key = tuple(repr(item.get(attribute)) for attribute in self.key_attributes)
+            if key in batch:
+                yield list(batch.values())
+                batch = {}
+            batch[key] = item
+            if len(batch) == BATCH_SIZE:
+                yield list(batch.values())
+                batch = {}
+        if batch:
+            yield list(batch.values())
+
+    def import_items(self, items: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """Write all items, returning counts and throughput"""
+        started = time.perf_counter()
+        slots = threading.BoundedSemaphore(self.workers * 2)
+
+        def run(batch):
+            try:
+                self._write_batch(batch)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch in self._batches(items):
+                slots.acquire()
+                self._count(batches=1)
+                executor.submit(run, batch)
+        seconds = time.perf_counter() - started
+        with self._lock:
+            report = dict(self.counters)
+        report['seconds'] = round(seconds, 3)
+        report['items_per_second'] = round(report['written'] / seconds, 1) if seconds else None
+        return report
+
+
+def import_history(dynamodb, table_name: str, path: str, workers: int = 8) -> Dict[str, Any]:
+    """Bulk load an NDJSON export into a table"""
+    stream = open_text(path, 'r')
+    try:
+        return BulkImporter(dynamodb, table_name, workers=workers).import_items(read_items(stream))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import ChatHistory as NDJSON")
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('path', help="NDJSON file, gzipped if it ends in .gz, or - for stdout/stdin")
+    parser.add_argument('--table', default=os.environ.get('CHAT_HISTORY_TABLE', 'ChatHistory'))
+    parser.add_argument('--user', help="Export only this user")
+    parser.add_argument('--workers', type=int, default=8, help="Batch writes in flight during import")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    dynamodb = create_resource('dynamodb', 'dynamodb')
+    if args.command == 'export':
+        started = time.perf_counter()
+        count = export_history(dynamodb.Table(args.table), args.path, args.user, chat_archive_from_env())
+        report = {'items': count, 'seconds': round(time.perf_counter() - started, 3)}
+    else:
+        report = import_history(dynamodb, args.table, args.path, args.workers)
+    print(json.dumps(report, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,167 @@
 import os
+import sys
 import json
-import boto3
+import uuid
 import logging
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
+from client_config import client_config, create_client
+from concurrency_limiter import AdaptiveLimiter, Overloaded, retry_after_header
+from reference_store import ReferenceStore
+from region_pool import RegionalClientPool, parse_regions
+from rerankers import CircuitBreaker, build_reranker
+from query_features import normalize_query
+from response_format import REFERENCE_DETAIL_MODES, compact_response_body, encode_compact_body
+from retrieval_policy import RetrievalPolicy
+from session_context import SessionContextCache, merge_passages
+from single_flight import SingleFlight
+from stage_timing import StageTimer
+from traffic_capture import TrafficCapture
+from user_rate_limiter import FairScheduler, RateLimited, UserRateLimiter
+from tracing import configure_tracer
+from warm_answers import WarmAnswerStore
+from token_budget import (
+    budget_passages,
+    compact_whitespace,
+    dedupe_snippets,
+    estimate_tokens,
+    trim_to_tokens
+)
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize AWS clients
+# Spans for every stage and AWS call when TRACE_EXPORT is set
+tracer = configure_tracer(os.environ.get('TRACE_SERVICE_NAME', 'chat-api'))
+
+# Initialize AWS clients. Knowledge base calls (retrieve_and_generate, retrieve) stay on this
+# single client: the knowledge base only exists in its own region, so they are not pooled or hedged.
 service_name = 'bedrock-agent-runtime'
-client = boto3.client(service_name)
-s3_client = boto3.client('s3')
+client = create_client(service_name, 'bedrock')
+s3_client = create_client('s3', 'storage')
+
+# Bedrock runtime pools (two-phase converse and rerank only), hedged and failed over
+# across regions in the listed order.
+# GENERATION_REGIONS only helps when FM_ARN is usable in every listed region
+# (a model id or cross-region inference profile rather than a regional model ARN).
+region_pool_options = dict(
+    hedge_percentile=float(os.environ.get('HEDGE_PERCENTILE', 95)),
+    min_hedge_delay_ms=float(os.environ.get('HEDGE_MIN_DELAY_MS', 50)),
+    max_hedge_ratio=float(os.environ.get('HEDGE_MAX_RATIO', 0.1)),
+    error_rate_threshold=float(os.environ.get('REGION_ERROR_RATE_THRESHOLD', 0.5))
+)
+
+# Two-phase generation, in the default region unless GENERATION_REGIONS is set
+bedrock_runtime = RegionalClientPool.from_regions(
+    'bedrock-runtime',
+    parse_regions(os.environ.get('GENERATION_REGIONS'), [None]),
+    config=client_config('bedrock'),
+    **region_pool_options
+)
 
-# Create Bedrock client for us-west-2 region to access rerank models
-bedrock_runtime_west = boto3.client(
-    service_name='bedrock-runtime',
-    region_name='us-west-2'
+# Rerank models live in us-west-2 unless RERANK_REGIONS lists others. Rerank has a
+# latency budget, so its hedge goes out by half of it at the latest: with the default
+# 1 s initial delay the budget would expire before the hedge was even sent.
+RERANK_LATENCY_BUDGET_MS = float(os.environ.get('RERANK_LATENCY_BUDGET_MS', 800))
+rerank_runtime = RegionalClientPool.from_regions(
+    'bedrock-runtime',
+    parse_regions(os.environ.get('RERANK_REGIONS'), ['us-west-2']),
+    config=client_config('rerank'),
+    initial_hedge_delay_ms=RERANK_LATENCY_BUDGET_MS / 2,
+    max_hedge_delay_ms=RERANK_LATENCY_BUDGET_MS / 2,
+    **region_pool_options
 )
 
+# Per-container AIMD concurrency limits, one per Bedrock API quota. Throttled calls
+# back off (honouring Retry-After) and callers that cannot get a permit within
+# BEDROCK_QUEUE_TIMEOUT_MS get a 429 instead of a 500.
+bedrock_limiters = {
+    operation: AdaptiveLimiter.from_env(operation)
+    for operation in ('retrieve_and_generate', 'retrieve', 'converse')
+}
+
 knowledgeBaseID = os.environ['KNOWLEDGE_BASE_ID']
 fundation_model_ARN = os.environ['FM_ARN']
-RELEVANCE_THRESHOLD = 0.3  # Configurable threshold for relevance
+RELEVANCE_THRESHOLD = float(os.environ.get('RELEVANCE_THRESHOLD', 0.3))  # Minimum rerank score for a reference to be kept
+
+# RERANKER=auto calls Cohere within the latency budget and falls back to local BM25
+# when it is slow, failing or the circuit breaker is open; cohere or bm25 pin one backend
+reranker = build_reranker(
+    os.environ.get('RERANKER', 'auto'),
+    lambda: rerank_runtime,
+    os.environ.get('RERANK_MODEL_ID', 'cohere.rerank-v3-5:0'),
+    RERANK_LATENCY_BUDGET_MS,
+    CircuitBreaker(
+        window=int(os.environ.get('RERANK_BREAKER_WINDOW', 20)),
+        error_rate_threshold=float(os.environ.get('RERANK_BREAKER_ERROR_RATE', 0.5)),
+        cooldown_seconds=float(os.environ.get('RERANK_BREAKER_COOLDOWN_SECONDS', 30))
+    )
+)
+
+# Picks numberOfResults / overrideSearchType per query (RETRIEVAL_POLICY=fixed restores 5 / HYBRID)
+retrieval_policy = RetrievalPolicy.from_env(RELEVANCE_THRESHOLD)
+
+# Last turn's passages per session, reused or merged for follow-up questions (two_phase)
+session_context_cache = SessionContextCache.from_env()
+
+# Prewarmed answers for frequent first-turn questions (prewarm_answers.py), off unless WARM_ANSWERS_TABLE is set
+warm_answer_store = WarmAnswerStore.from_env(knowledgeBaseID)
+
+# Single-flight coalescing of identical concurrent queries, across containers when COALESCING_TABLE is set
+request_coalescer = SingleFlight.from_env()
+
+# Per-user token buckets for chat requests, off unless USER_RATE_LIMIT_PER_MINUTE is set;
+# shared across containers when USER_RATE_LIMIT_TABLE is set
+user_rate_limiter = UserRateLimiter.from_env()
+
+# Round-robin admission across users when FAIR_QUEUE_MAX_CONCURRENT is set. It only applies
+# to the long-running async_server.py: a Lambda container serves one request at a time, so
+# in Lambda nothing ever queues and the per-user rate limit above is the only fairness control
+fair_scheduler = FairScheduler.from_env()
+
+# Compact responses (response_format=compact) ship reference stubs, or snippet previews
+# with reference_detail=preview; full details are kept here for get_reference requests,
+# shared across containers when REFERENCE_TABLE is set
+reference_store = ReferenceStore.from_env()
+SNIPPET_PREVIEW_CHARS = int(os.environ.get('SNIPPET_PREVIEW_CHARS', 240))
+GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', 1024))
+RESPONSE_FORMATS = ('full', 'compact')
+REFERENCE_ACTIONS = ('get_reference', 'expand_reference')
+
+# Opt-in capture of sampled requests and their upstream calls for replay_traffic.py
+traffic_capture = TrafficCapture.from_env()
+if traffic_capture:
+    traffic_capture.install(sys.modules[__name__])
+
+# Pipeline used when the request does not ask for one: retrieve_and_generate or two_phase
+DEFAULT_PIPELINE_MODE = os.environ.get('PIPELINE_MODE', 'retrieve_and_generate')
+TWO_PHASE_TOP_K = int(os.environ.get('TWO_PHASE_TOP_K', 3))
+TWO_PHASE_SESSION_PREFIX = 'tp-'  # Session ids two_phase hands out, which are not Bedrock sessions
+GENERATION_MAX_TOKENS = int(os.environ.get('GENERATION_MAX_TOKENS', 1024))
+
+# Token budgets for the generation prompt and the snippets shown as references
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', 2000))
+PASSAGE_TOKEN_BUDGET = int(os.environ.get('PASSAGE_TOKEN_BUDGET', 400))
+REFERENCE_SNIPPET_TOKEN_BUDGET = int(os.environ.get('REFERENCE_SNIPPET_TOKEN_BUDGET', 300))
+
+NO_ANSWER_RESPONSE = "I apologize, but I don't have enough relevant information to answer this question accurately."
+
+# Prompt sent to the foundation model, kept free of indentation so it costs no extra tokens
+PROMPT_TEMPLATE = compact_whitespace("""
+    You are a question answering agent. Answer the user's question using the provided search results.
+
+    IMPORTANT RULES:
+    1. If you cannot find relevant information, say "I apologize, but I don't have enough relevant information to answer this question accurately."
+    2. Only use information from the search results.
+    3. Cite your sources.
+
+    Search results:
+    $search_results$
+
+    Question: {input}
+    $output_format_instructions$
+""")
 
 def generate_presigned_url(bucket, key, expiration=1800):
     """Generate a presigned URL for an S3 object"""
@@ -42,17 +181,20 @@ def generate_presigned_url(bucket, key, expiration=1800):
         logger.error(f"Error generating presigned URL: {str(e)}")
         return None
 
+def presign_s3_uri(s3_url):
+    """Presigned URL for an S3 URI, or None if it cannot be generated"""
+    parsed_url = urlparse(s3_url)
+    bucket = parsed_url.netloc.split('.')[0]
+    key = parsed_url.path.lstrip('/')
+    return generate_presigned_url(bucket, key)
+
 def process_s3_urls(references):
     """Convert S3 URIs to presigned URLs in references"""
     logger.info(f"Processing S3 URLs for {len(references)} references")
     processed_refs = []
     for ref in references:
         if 'uri' in ref:
-            s3_url = ref['uri']
-            parsed_url = urlparse(s3_url)
-            bucket = parsed_url.netloc.split('.')[0]
-            key = parsed_url.path.lstrip('/')
-            presigned_url = generate_presigned_url(bucket, key)
+            presigned_url = presign_s3_uri(ref['uri'])
             if presigned_url:
                 ref['presigned_url'] = presigned_url
                 processed_refs.append(ref)
@@ -60,40 +202,22 @@ def process_s3_urls(references):
     return processed_refs
 
 def rerank_references(references, user_query, generated_response):
-    """Enhanced reranking with response correlation using Cohere Rerank v3.5"""
+    """Rerank references with the configured reranker and track response usage"""
+    if not references:
+        return [], {'source': None}
     try:
         logger.info(f"Starting reranking process for {len(references)} references")
         documents = [ref['snippet'] for ref in references]
-        
-        # Prepare request body with exact format required
-        request_body = {
-            "query": user_query,
-            "documents": documents,
-            "top_n": len(documents),
-            "api_version": 2
-        }
+        scores, rerank_info = reranker.rerank_with_info(user_query, documents)
+        logger.info(f"Received {len(scores)} scores from {rerank_info['source']} reranker")
+
+        # Rank positions follow the reranker's ordering
+        order = sorted(range(len(scores)), key=lambda index: scores[index], reverse=True)
 
-        logger.info(f"Rerank request body: {json.dumps(request_body)}")
-        
-        # Call Cohere Rerank v3.5 model with exact format
-        response = bedrock_runtime_west.invoke_model(
-            modelId="cohere.rerank-v3-5:0",
-            contentType="application/json",
-            accept="*/*",
-            body=json.dumps(request_body)
-        )
-        
-        response_body = json.loads(response['body'].read())
-        logger.info(f"Rerank response: {json.dumps(response_body)}")
-        
-        # Process results
-        results = response_body.get('results', [])
-        logger.info(f"Received {len(results)} ranked results")
-        
         ranked_references = []
-        for idx, result in enumerate(results):
-            original_ref = references[result.get('index', 0)]
-            relevance_score = result.get('relevance_score', 0)
+        for idx, ref_index in enumerate(order):
+            original_ref = references[ref_index]
+            relevance_score = scores[ref_index]
             
             # Check if reference content is used in response
             is_used = original_ref['snippet'] in generated_response
@@ -115,13 +239,11 @@ def rerank_references(references, user_query, generated_response):
         )
         
         logger.info(f"Reranking complete. {len(ranked_references)} references above threshold")
-        return ranked_references
+        return ranked_references, rerank_info
 
     except Exception as e:
         logger.error(f"Error in reranking: {str(e)}")
-        logger.error(f"Full error details: {str(e.__dict__)}")
-        logger.error(f"Request body that caused error: {json.dumps(request_body)}")
-        return references
+        return references, {'source': None, 'error': str(e)}
 
 def extract_references(citations, generated_response):
     """Extract references and track which ones were used in the response"""
@@ -161,9 +283,12 @@ def extract_references(citations, generated_response):
                     document_snippets[uri] = []
                 document_snippets[uri].append(snippet)
     
-    # Create references with all snippets
+    # Create references from up to three distinct snippets, trimmed to the snippet budget
     for uri, snippets in document_snippets.items():
-        combined_snippet = ' '.join(snippets[:3])
+        combined_snippet = trim_to_tokens(
+            ' '.join(dedupe_snippets(snippets)[:3]),
+            REFERENCE_SNIPPET_TOKEN_BUDGET
+        )
         references.append({
             'uri': uri,
             'snippet': combined_snippet,
@@ -201,7 +326,7 @@ def validate_response_relevance(user_query, generated_response, references):
     logger.info("Response validation successful")
     return True, ""
 
-def create_response(status_code, body):
+def create_response(status_code, body, headers=None, encode_body=True):
     """Create API Gateway response with CORS headers"""
     return {
         'statusCode': status_code,
@@ -209,48 +334,590 @@ def create_response(status_code, body):
             'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': 'OPTIONS,POST',
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            **(headers or {})
         },
-        'body': json.dumps(body)
+        'body': json.dumps(body) if encode_body else body
     }
 
+def create_compact_response(status_code, body, accept_gzip):
+    """Response whose body is encoded once, gzip-compressed when large and accepted"""
+    encoded = encode_compact_body(body, accept_gzip, GZIP_MIN_BYTES)
+    response = create_response(status_code, encoded['body'], headers=encoded['headers'], encode_body=False)
+    if encoded['isBase64Encoded']:
+        response['isBase64Encoded'] = True
+    return response
+
+def create_success_response(response_body, options):
+    """Full response body, or the compact one when the client negotiated it"""
+    if options['response_format'] != 'compact':
+        return create_response(200, response_body)
+    compact_body, reference_details = compact_response_body(
+        response_body, SNIPPET_PREVIEW_CHARS, options['reference_detail']
+    )
+    reference_store.put_many(reference_details)
+    return create_compact_response(200, compact_body, options['accept_gzip'])
+
+def handle_reference_detail(ref_id, options):
+    """Return one reference's full snippet and, if asked for, a freshly presigned URL"""
+    if not ref_id:
+        return create_response(400, {'error': 'ref_id is required'})
+    detail = reference_store.get(ref_id)
+    if detail is None:
+        return create_response(404, {'error': 'Reference not found or expired'})
+    detail = dict(detail)
+    if options['presign']:
+        presigned_url = presign_s3_uri(detail['uri'])
+        if presigned_url:
+            detail['presigned_url'] = presigned_url
+            detail['urlExpirationTime'] = (datetime.utcnow() + timedelta(hours=1)).isoformat()
+    return create_compact_response(200, detail, options['accept_gzip'])
+
+def request_headers(event):
+    """Request headers with lower-cased names, empty when the integration passes none"""
+    if not isinstance(event, dict):
+        return {}
+    return {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+
+def request_body(event):
+    """The parsed request body, or the event itself when it carries the fields directly"""
+    if not isinstance(event, dict):
+        raise ValueError("Invalid event format")
+    if 'body' not in event:
+        return event
+    if isinstance(event['body'], str):
+        return json.loads(event['body'])
+    return event['body']
+
+def request_traceparent(event):
+    """The caller's traceparent, from the body (all a non-proxy integration passes on) or else the headers"""
+    try:
+        traceparent = request_body(event).get('traceparent')
+    except (ValueError, AttributeError):
+        traceparent = None
+    return traceparent or request_headers(event).get('traceparent')
+
+# Rate limits are keyed on what the integration vouches for, which the client cannot change.
+# Proxy integrations pass requestContext themselves; a non-proxy integration has to wrap the
+# client's JSON in body and pass the identity through its mapping template:
+#   {"body": $input.json('$'),
+#    "requestContext": {"identity": {"sourceIp": "$context.identity.sourceIp",
+#                                    "apiKeyId": "$context.identity.apiKeyId"},
+#                       "authorizer": {"principalId": "$context.authorizer.principalId"}}}
+# Events without a body carry the client's fields at the top level, so nothing in them is trusted.
+def rate_limit_key(event, options):
+    """Who a request is counted against: an internal job, the authorizer's principal, an API key's user or the caller's IP
+
+    The body's user_id only counts under an API key: the caller holding it (the
+    chat app) has authenticated and speaks for its users, while an anonymous
+    client could send a new user_id with every request. Requests with no
+    identity at all share one bucket.
+    """
+    trusted = event if isinstance(event, dict) and 'body' in event else {}
+    if trusted.get('internal_job'):
+        return f"internal#{trusted['internal_job']}"
+    request_context = trusted.get('requestContext') or {}
+    principal = (request_context.get('authorizer') or {}).get('principalId')
+    if principal:
+        return f"principal#{principal}"
+    identity = request_context.get('identity') or {}
+    if identity.get('apiKeyId') and options.get('user_id'):
+        return f"key#{identity['apiKeyId']}#user#{options['user_id']}"
+    if identity.get('sourceIp'):
+        return f"ip#{identity['sourceIp']}"
+    return 'anonymous'
+
 def get_request_data(event):
-    """Extract user query and session ID from the event"""
+    """Extract user query, session ID and per-request options from the event"""
     try:
         logger.info(f"Processing event: {json.dumps(event)}")
 
-        if isinstance(event, dict):
-            if 'body' in event:
-                if isinstance(event['body'], str):
-                    body = json.loads(event['body'])
-                else:
-                    body = event['body']
-            else:
-                body = event
-        else:
-            raise ValueError("Invalid event format")
-
+        body = request_body(event)
         user_query = body.get('user_query')
         session_id = body.get('sessionId')
+        headers = request_headers(event)
+        accept_encoding = body.get('accept_encoding') or headers.get('accept-encoding', '')
+        options = {
+            'action': body.get('action'),
+            'ref_id': body.get('ref_id'),
+            'response_format': body.get('response_format') or 'full',
+            'reference_detail': body.get('reference_detail') or 'on_demand',
+            # get_reference: presign the source document only when the user opens it
+            'presign': bool(body.get('presign', False)),
+            'accept_gzip': 'gzip' in accept_encoding,
+            'pipeline_mode': body.get('pipeline_mode') or DEFAULT_PIPELINE_MODE,
+            # The prewarm job turns this off to compute fresh answers
+            'use_warm_answers': body.get('use_warm_answers', True),
+            'user_id': body.get('user_id'),
+            'traceparent': body.get('traceparent') or headers.get('traceparent')
+        }
 
-        logger.info(f"Extracted query: {user_query}, sessionId: {session_id}")
-        return user_query, session_id
+        logger.info(f"Extracted query: {user_query}, sessionId: {session_id}, options: {options}")
+        return user_query, session_id, options
 
     except Exception as e:
         logger.error(f"Error in get_request_data: {str(e)}")
         raise
 
+def build_vector_search_configuration(retrieval_plan):
+    """Build the vectorSearchConfiguration for a retrieval plan"""
+    return {
+        'numberOfResults': retrieval_plan['number_of_results'],
+        'overrideSearchType': retrieval_plan['search_type']
+    }
+
+def summarize_rerank(ranked_references, fetched):
+    """Summarize a rerank for the retrieval policy, or None if reranking failed"""
+    scores = [ref['relevance_score'] for ref in ranked_references if 'relevance_score' in ref]
+    if ranked_references and not scores:
+        # rerank_references returned the input unchanged after an error
+        return None
+    return {
+        'fetched': fetched,
+        'kept': len([score for score in scores if score >= RELEVANCE_THRESHOLD]),
+        'top_score': max(scores, default=0)
+    }
+
+def run_retrieve_and_generate(user_query, session_id, retrieval_plan, timer):
+    """Retrieve and generate in one Bedrock call, then rerank the citations for display"""
+    retrieve_request = {
+        'input': {
+            'text': user_query
+        },
+        'retrieveAndGenerateConfiguration': {
+            'type': 'KNOWLEDGE_BASE',
+            'knowledgeBaseConfiguration': {
+                'knowledgeBaseId': knowledgeBaseID,
+                'modelArn': fundation_model_ARN,
+                'retrievalConfiguration': {
+                    'vectorSearchConfiguration': build_vector_search_configuration(retrieval_plan)
+                },
+                'generationConfiguration': {
+                    'promptTemplate': {
+                        'textPromptTemplate': PROMPT_TEMPLATE
+                    }
+                }
+            }
+        }
+    }
+
+    # Session ids made up by two_phase mean nothing to Bedrock, which rejects unknown ids
+    if session_id and not session_id.startswith(TWO_PHASE_SESSION_PREFIX):
+        retrieve_request['sessionId'] = session_id
+
+    # Call Bedrock
+    logger.info(f"Sending request to Bedrock: {json.dumps(retrieve_request)}")
+    with timer.stage('retrieve_and_generate'):
+        client_knowledgebase = bedrock_limiters['retrieve_and_generate'].call(
+            client.retrieve_and_generate, **retrieve_request
+        )
+    logger.info("Received response from Bedrock")
+
+    # Get response text first
+    generated_response = client_knowledgebase['output']['text']
+    logger.info(f"Generated response: {generated_response[:200]}...")
+
+    # Extract and process references
+    with timer.stage('extract_references'):
+        references = extract_references(
+            client_knowledgebase['citations'],
+            generated_response
+        )
+
+    # Rerank references
+    with timer.stage('rerank'):
+        ranked_references, rerank_info = rerank_references(
+            references,
+            user_query,
+            generated_response
+        )
+
+    # Bedrock builds this prompt itself, so the cited passages are a lower bound
+    cited_passages = {}
+    for citation in client_knowledgebase['citations']:
+        for reference in citation.get('retrievedReferences', []):
+            uri = reference.get('location', {}).get('s3Location', {}).get('uri', '')
+            text = reference.get('content', {}).get('text', '').strip()
+            cited_passages.setdefault(uri, []).append(text)
+    search_results = '\n\n'.join(
+        snippet
+        for snippets in cited_passages.values()
+        for snippet in dedupe_snippets(snippets)
+    )
+    token_budget = {
+        'estimated_input_tokens': estimate_tokens(
+            build_generation_prompt(user_query, []) + search_results
+        ),
+        'estimate_basis': 'citations'
+    }
+
+    return {
+        'generated_response': generated_response,
+        'references': references,
+        'ranked_references': ranked_references,
+        'session_id': client_knowledgebase.get('sessionId'),
+        'rerank_summary': summarize_rerank(ranked_references, len(references)),
+        'rerank_info': rerank_info,
+        'generation_usage': None,
+        'token_budget': token_budget,
+        'context_cache': None
+    }
+
+def retrieve_passages(user_query, retrieval_plan):
+    """Retrieve passages from the knowledge base without generating"""
+    logger.info(f"Retrieving passages for query: {user_query}")
+    response = bedrock_limiters['retrieve'].call(
+        client.retrieve,
+        knowledgeBaseId=knowledgeBaseID,
+        retrievalQuery={
+            'text': user_query
+        },
+        retrievalConfiguration={
+            'vectorSearchConfiguration': build_vector_search_configuration(retrieval_plan)
+        }
+    )
+
+    passages = []
+    for result in response.get('retrievalResults', []):
+        s3_location = result.get('location', {}).get('s3Location', {})
+        snippet = result.get('content', {}).get('text', '').strip()
+        if snippet and 'uri' in s3_location:
+            passages.append({
+                'uri': s3_location['uri'],
+                'snippet': snippet,
+                'retrieval_score': result.get('score', 0),
+                'result': result
+            })
+
+    logger.info(f"Retrieved {len(passages)} passages")
+    return passages
+
+def build_generation_prompt(user_query, passages):
+    """Fill the prompt template with the selected passages"""
+    search_results = '\n\n'.join(
+        f"<search_result>\n{passage['snippet']}\n</search_result>"
+        for passage in passages
+    )
+    return (
+        PROMPT_TEMPLATE
+        .replace('$search_results$', search_results)
+        .replace('{input}', user_query)
+        .replace('$output_format_instructions$', '')
+    )
+
+def generate_answer(prompt):
+    """Generate an answer for a filled prompt with the foundation model"""
+    logger.info(f"Generating answer from a prompt of ~{estimate_tokens(prompt)} tokens")
+    response = bedrock_limiters['converse'].call(
+        bedrock_runtime.converse,
+        modelId=fundation_model_ARN,
+        messages=[
+            {
+                'role': 'user',
+                'content': [{'text': prompt}]
+            }
+        ],
+        inferenceConfig={
+            'maxTokens': GENERATION_MAX_TOKENS,
+            'temperature': 0
+        }
+    )
+    generated_response = response['output']['message']['content'][0]['text']
+    return generated_response, response.get('usage', {})
+
+def retrieve_with_session_context(user_query, session_id, retrieval_plan):
+    """Retrieve passages, reusing or merging the session's previous turn when it is a follow-up"""
+    context = session_context_cache.lookup(session_id, user_query)
+    if context['action'] == 'reuse':
+        logger.info(f"Reusing {len(context['passages'])} cached passages for follow-up query")
+        passages = context['passages']
+    else:
+        passages = retrieve_passages(user_query, retrieval_plan)
+        if context['action'] == 'merge':
+            passages = merge_passages(passages, context['passages'])[:retrieval_plan['number_of_results']]
+        session_context_cache.store(session_id, user_query, passages)
+
+    context_info = {key: value for key, value in context.items() if key != 'passages'}
+    context_info['cached_passages'] = len(context['passages'])
+    return passages, context_info
+
+def run_two_phase(user_query, session_id, retrieval_plan, timer):
+    """Retrieve, rerank, then generate with only the top-k relevant passages"""
+    # Two-phase generation does not use a Bedrock managed session; the prefix keeps
+    # this id from being sent to Bedrock if the next turn uses retrieve_and_generate
+    session_id = session_id or f"{TWO_PHASE_SESSION_PREFIX}{uuid.uuid4()}"
+
+    with timer.stage('retrieve'):
+        passages, context_info = retrieve_with_session_context(user_query, session_id, retrieval_plan)
+
+    # Rerank before generation so weak passages never reach the prompt
+    with timer.stage('rerank'):
+        ranked_passages, rerank_info = rerank_references(passages, user_query, '')
+    rerank_summary = summarize_rerank(ranked_passages, len(passages))
+
+    if rerank_summary is None:
+        # Reranker unavailable, fall back to the knowledge base ordering
+        selected_passages = passages[:TWO_PHASE_TOP_K]
+    else:
+        selected_passages = [
+            passage for passage in ranked_passages
+            if passage.get('relevance_score', 0) >= RELEVANCE_THRESHOLD
+        ][:TWO_PHASE_TOP_K]
+
+    # Drop overlapping chunks and trim passages to the prompt budget
+    with timer.stage('token_budget'):
+        selected_passages, token_budget = budget_passages(
+            selected_passages,
+            build_generation_prompt(user_query, []),
+            PROMPT_TOKEN_BUDGET,
+            PASSAGE_TOKEN_BUDGET
+        )
+
+    if selected_passages:
+        prompt = build_generation_prompt(user_query, selected_passages)
+        token_budget['estimated_input_tokens'] = estimate_tokens(prompt)
+        with timer.stage('generate'):
+            generated_response, generation_usage = generate_answer(prompt)
+    else:
+        # Nothing relevant to ground an answer on, skip the model call
+        logger.warning("No passages above relevance threshold, skipping generation")
+        token_budget['estimated_input_tokens'] = 0
+        generated_response, generation_usage = NO_ANSWER_RESPONSE, {}
+    token_budget['estimate_basis'] = 'prompt'
+    logger.info(f"Generated response: {generated_response[:200]}...")
+
+    # Group the passages that were sent to the model into references
+    with timer.stage('extract_references'):
+        references = extract_references(
+            [{'retrievedReferences': [passage['result'] for passage in selected_passages]}],
+            generated_response
+        )
+    scores_by_uri = {}
+    for passage in selected_passages:
+        score = passage.get('relevance_score', passage['retrieval_score'])
+        scores_by_uri[passage['uri']] = max(score, scores_by_uri.get(passage['uri'], 0))
+
+    ranked_references = [
+        {**ref, 'relevance_score': scores_by_uri.get(ref['uri'], 0)}
+        for ref in references
+    ]
+    ranked_references.sort(
+        key=lambda x: (x['used_in_response'], x['relevance_score']),
+        reverse=True
+    )
+    for rank, ref in enumerate(ranked_references, start=1):
+        ref['rank'] = rank
+
+    generation_usage = dict(generation_usage)
+    generation_usage['passages_retrieved'] = len(passages)
+    generation_usage['passages_sent'] = len(selected_passages)
+
+    return {
+        'generated_response': generated_response,
+        'references': references,
+        'ranked_references': ranked_references,
+        'session_id': session_id,
+        'rerank_summary': rerank_summary,
+        'rerank_info': rerank_info,
+        'generation_usage': generation_usage,
+        'token_budget': token_budget,
+        'context_cache': context_info
+    }
+
+PIPELINES = {
+    'retrieve_and_generate': run_retrieve_and_generate,
+    'two_phase': run_two_phase
+}
+
+def lookup_warm_answer(user_query, pipeline_mode):
+    """Fetch a prewarmed answer, treating any store error as a miss"""
+    try:
+        return warm_answer_store.get(user_query, pipeline_mode)
+    except Exception as e:
+        logger.error(f"Error reading warm answer: {str(e)}")
+        return None
+
+def build_warm_response(user_query, pipeline_mode, warm_answer, timer, presign=True):
+    """Response body for a prewarmed answer, with freshly presigned reference URLs"""
+    if presign:
+        with timer.stage('presign'):
+            references_with_urls = process_s3_urls(warm_answer['references'])
+    else:
+        references_with_urls = warm_answer['references']
+
+    debug_info = {
+        'query': user_query,
+        'pipeline_mode': pipeline_mode,
+        'warm_answer': {
+            'age_seconds': warm_answer['age_seconds'],
+            'query_count': warm_answer['query_count']
+        },
+        'total_references': len(warm_answer['references']),
+        'relevant_references': len(warm_answer['references']),
+        'used_references': len([
+            ref for ref in references_with_urls
+            if ref.get('used_in_response', False)
+        ]),
+        'stage_timings_ms': timer.as_dict()
+    }
+    return {
+        'generated_response': warm_answer['generated_response'],
+        'detailed_references': references_with_urls,
+        'urlExpirationTime': (datetime.utcnow() + timedelta(hours=1)).isoformat(),
+        # Warm answers belong to no conversation, so there is no sessionId; the client keeps its own
+        'sourceCount': len(references_with_urls),
+        'validation_status': warm_answer['validation_status'],
+        'validation_message': warm_answer['validation_message'],
+        'debug_info': debug_info
+    }
+
+def execute_pipeline(user_query, session_id, pipeline_mode, timer, presign=True):
+    """Plan, run the pipeline, presign and validate; returns the response body"""
+    # Plan retrieval depth and search type for this query
+    with timer.stage('plan'):
+        retrieval_plan = retrieval_policy.choose(user_query)
+    logger.info(f"Retrieval plan: {json.dumps(retrieval_plan)}")
+
+    # Retrieve, generate and rank references
+    pipeline_result = PIPELINES[pipeline_mode](user_query, session_id, retrieval_plan, timer)
+    generated_response = pipeline_result['generated_response']
+    references = pipeline_result['references']
+    ranked_references = pipeline_result['ranked_references']
+
+    # Filter relevant references
+    relevant_references = [
+        ref for ref in ranked_references 
+        if ref.get('relevance_score', 0) >= RELEVANCE_THRESHOLD
+    ]
+
+    # Feed the rerank outcome back into the retrieval policy
+    rerank_summary = pipeline_result['rerank_summary']
+    if rerank_summary:
+        retrieval_policy.record_outcome(user_query, **rerank_summary)
+
+    # Process S3 URLs
+    if presign:
+        with timer.stage('presign'):
+            references_with_urls = process_s3_urls(relevant_references)
+    else:
+        references_with_urls = relevant_references
+
+    # Validate response
+    with timer.stage('validate'):
+        is_valid, validation_message = validate_response_relevance(
+            user_query, 
+            generated_response, 
+            references_with_urls
+        )
+
+    # Prepare debug information
+    debug_info = {
+        'query': user_query,
+        'pipeline_mode': pipeline_mode,
+        'total_references': len(references),
+        'relevant_references': len(relevant_references),
+        'relevance_scores': [
+            {
+                'score': ref.get('relevance_score', 0),
+                'used': ref.get('used_in_response', False)
+            }
+            for ref in references_with_urls
+        ],
+        'used_references': len([
+            ref for ref in references_with_urls 
+            if ref.get('used_in_response', False)
+        ]),
+        'retrieval_policy': retrieval_plan,
+        'token_budget': pipeline_result['token_budget'],
+        'reranker': pipeline_result['rerank_info']
+    }
+    if pipeline_result['generation_usage'] is not None:
+        debug_info['generation_usage'] = pipeline_result['generation_usage']
+    if pipeline_result['context_cache'] is not None:
+        debug_info['context_cache'] = pipeline_result['context_cache']
+    debug_info['stage_timings_ms'] = timer.as_dict()
+
+    # Prepare response
+    response_body = {
+        'generated_response': generated_response,
+        'detailed_references': references_with_urls,
+        'urlExpirationTime': (datetime.utcnow() + timedelta(hours=1)).isoformat(),
+        'sessionId': pipeline_result['session_id'],
+        'sourceCount': len(references_with_urls),
+        'validation_status': 'valid' if is_valid else 'warning',
+        'validation_message': validation_message if not is_valid else '',
+        'debug_info': debug_info
+    }
+
+    return response_body
+
+def coalesced_response(response_body, coalescing, timer):
+    """Copy of another request's response body for a coalesced request"""
+    debug_info = {
+        **response_body['debug_info'],
+        'coalescing': coalescing,
+        'stage_timings_ms': timer.as_dict()
+    }
+    # The session belongs to the request that ran the pipeline, so it is left out; the client keeps its own
+    response_body = {key: value for key, value in response_body.items() if key != 'sessionId'}
+    return {
+        **response_body,
+        'coalesced': True,
+        'debug_info': debug_info
+    }
+
 def lambda_handler(event, context):
+    timer = StageTimer()
+    try:
+        # Continue the caller's trace, so app and API share one waterfall
+        with tracer.span('lambda_handler', traceparent=request_traceparent(event), root=True) as span:
+            if traffic_capture:
+                response = traffic_capture.handle(event, timer, lambda: handle_event(event, timer))
+            else:
+                response = handle_event(event, timer)
+            if span:
+                span.set('http.status_code', response['statusCode'])
+            return response
+    finally:
+        tracer.flush()
+
+def handle_event(event, timer):
+    """Serve one API request, recording stage timings on timer"""
     try:
         # Get request data
         try:
-            user_query, session_id = get_request_data(event)
+            user_query, session_id, options = get_request_data(event)
         except Exception as e:
             logger.error(f"Error processing request: {str(e)}")
             return create_response(400, {
                 'error': f'Error processing request: {str(e)}'
             })
 
+        if options['action'] in REFERENCE_ACTIONS:
+            return handle_reference_detail(options['ref_id'], options)
+
+        # Reference lookups are cheap; chat requests are counted against the user's rate limit.
+        # Internal jobs (prewarm, evaluation) pace themselves and only take their own turn below
+        user_key = rate_limit_key(event, options)
+        if user_rate_limiter and not user_key.startswith('internal#'):
+            with timer.stage('rate_limit'):
+                user_rate_limiter.check(user_key)
+
+        if options['response_format'] not in RESPONSE_FORMATS:
+            logger.error(f"Unknown response format: {options['response_format']}")
+            return create_response(400, {
+                'error': f"response_format must be one of: {', '.join(RESPONSE_FORMATS)}"
+            })
+        if options['reference_detail'] not in REFERENCE_DETAIL_MODES:
+            logger.error(f"Unknown reference detail mode: {options['reference_detail']}")
+            return create_response(400, {
+                'error': f"reference_detail must be one of: {', '.join(REFERENCE_DETAIL_MODES)}"
+            })
+
+        # Compact references carry ref_ids and are presigned when opened, so only full
+        # responses pay for presigning every reference up front
+        presign = options['response_format'] == 'full'
+
         # Validate user query
         if not user_query:
             logger.error("Missing user query")
@@ -273,115 +940,61 @@ def lambda_handler(event, context):
             user_query = user_query[:1000]
             logger.warning("User query truncated to 1000 characters")
 
-        # Prepare the request for Bedrock
-        retrieve_request = {
-            'input': {
-                'text': user_query
-            },
-            'retrieveAndGenerateConfiguration': {
-                'type': 'KNOWLEDGE_BASE',
-                'knowledgeBaseConfiguration': {
-                    'knowledgeBaseId': knowledgeBaseID,
-                    'modelArn': fundation_model_ARN,
-                    'retrievalConfiguration': {
-                        'vectorSearchConfiguration': {
-                            'numberOfResults': 5,
-                            'overrideSearchType': 'HYBRID'
-                        }
-                    },
-                    'generationConfiguration': {
-                        'promptTemplate': {
-                            'textPromptTemplate': """You are a question answering agent. Answer the user's question using the provided search results.
-                            
-                            IMPORTANT RULES:
-                            1. If you cannot find relevant information, say "I apologize, but I don't have enough relevant information to answer this question accurately."
-                            2. Only use information from the search results.
-                            3. Cite your sources.
-                            
-                            Search results:
-                            $search_results$
-                            
-                            Question: {input}
-                            $output_format_instructions$"""
-                        }
-                    }
-                }
-            }
-        }
+        pipeline_mode = options['pipeline_mode']
+        if pipeline_mode not in PIPELINES:
+            logger.error(f"Unknown pipeline mode: {pipeline_mode}")
+            return create_response(400, {
+                'error': f"pipeline_mode must be one of: {', '.join(PIPELINES)}"
+            })
 
-        if session_id:
-            retrieve_request['sessionId'] = session_id
+        # Answer frequent first-turn questions from the prewarmed store
+        if warm_answer_store and options['use_warm_answers'] and not session_id:
+            with timer.stage('warm_answer'):
+                warm_answer = lookup_warm_answer(user_query, pipeline_mode)
+            if warm_answer:
+                logger.info("Serving prewarmed answer")
+                return create_success_response(
+                    build_warm_response(user_query, pipeline_mode, warm_answer, timer, presign), options
+                )
 
-        # Call Bedrock
-        logger.info(f"Sending request to Bedrock: {json.dumps(retrieve_request)}")
-        client_knowledgebase = client.retrieve_and_generate(**retrieve_request)
-        logger.info("Received response from Bedrock")
-        
-        # Get response text first
-        generated_response = client_knowledgebase['output']['text']
-        logger.info(f"Generated response: {generated_response[:200]}...")
-        
-        # Extract and process references
-        references = extract_references(
-            client_knowledgebase['citations'], 
-            generated_response
-        )
-        
-        # Rerank references
-        ranked_references = rerank_references(
-            references, 
-            user_query, 
-            generated_response
-        )
-        
-        # Filter relevant references
-        relevant_references = [
-            ref for ref in ranked_references 
-            if ref.get('relevance_score', 0) >= RELEVANCE_THRESHOLD
-        ]
-        
-        # Process S3 URLs
-        references_with_urls = process_s3_urls(relevant_references)
-        
-        # Validate response
-        is_valid, validation_message = validate_response_relevance(
-            user_query, 
-            generated_response, 
-            references_with_urls
-        )
-        
-        # Prepare debug information
-        debug_info = {
-            'query': user_query,
-            'total_references': len(references),
-            'relevant_references': len(relevant_references),
-            'relevance_scores': [
-                {
-                    'score': ref.get('relevance_score', 0),
-                    'used': ref.get('used_in_response', False)
-                }
-                for ref in references_with_urls
-            ],
-            'used_references': len([
-                ref for ref in references_with_urls 
-                if ref.get('used_in_response', False)
-            ])
-        }
-        
-        # Prepare response
-        response_body = {
-            'generated_response': generated_response,
-            'detailed_references': references_with_urls,
-            'urlExpirationTime': (datetime.utcnow() + timedelta(hours=1)).isoformat(),
-            'sessionId': client_knowledgebase.get('sessionId'),
-            'sourceCount': len(references_with_urls),
-            'validation_status': 'valid' if is_valid else 'warning',
-            'validation_message': validation_message if not is_valid else '',
-            'debug_info': debug_info
-        }
-        
-        logger.info(f"Returning response with {len(references_with_urls)} references")
-        return create_response(200, response_body)
+        # A user's queued requests take turns with everyone else's for the pipeline
+        with fair_scheduler.slot(user_key):
+            # Concurrent first-turn requests for the same normalized query share one execution
+            if session_id:
+                response_body = execute_pipeline(user_query, session_id, pipeline_mode, timer, presign)
+            else:
+                flight_key = (f"{pipeline_mode}#{'presigned' if presign else 'lazy'}#"
+                              f"{normalize_query(user_query, drop_stopwords=True)}")
+                response_body, coalescing = request_coalescer.do(
+                    flight_key,
+                    lambda: execute_pipeline(user_query, session_id, pipeline_mode, timer, presign)
+                )
+                if coalescing['coalesced']:
+                    response_body = coalesced_response(response_body, coalescing, timer)
+
+        logger.info(f"Returning response with {response_body['sourceCount']} references")
+        return create_success_response(response_body, options)
+
+    except RateLimited as e:
+        logger.warning(str(e))
+        return create_response(429, {
+            'error': 'Rate limit exceeded, please slow down.',
+            'retry_after_seconds': round(e.retry_after, 3),
+            'generated_response': (f"You're sending messages faster than the assistant can answer them. "
+                                   f"Please wait {retry_after_header(e.retry_after)} seconds and try again."),
+            'detailed_references': [],
+            'sessionId': session_id if 'session_id' in locals() else None
+        }, headers={'Retry-After': retry_after_header(e.retry_after)})
+
+    except Overloaded as e:
+        logger.warning(f"Shedding request: {str(e)}")
+        return create_response(429, {
+            'error': 'Too many requests, please retry shortly.',
+            'retry_after_seconds': round(e.retry_after, 3),
+            'generated_response': 'The service is busy right now. Please try again in a moment.',
+            'detailed_references': [],
+            'sessionId': session_id if 'session_id' in locals() else None
+        }, headers={'Retry-After': retry_after_header(e.retry_after)})
 
     except Exception as e:
         logger.error(f"Error in lambda_handler: {str(e)}")
@@ -0,0 +1,482 @@
+"""Load generator for the Streamlit app and its API path.
+
+Starts the app with `streamlit run`, as the Dockerfile and Procfile do, and
+drives N concurrent browser sessions against that one server over
+Streamlit's websocket protocol (/_stcore/stream): login, chat turns,
+reference and feedback clicks, opening past conversations from the sidebar
+and starting new chats. The API is lambda_handler with stubbed AWS clients
+served over local HTTP (local_api_server.py), and DynamoDB is the in-memory
+stand-in from local_dynamodb.py inside the server process (or DynamoDB
+Local with --dynamodb-endpoint).
+
+Each concurrency level gets a fresh server pinned to --cpus cores, the CPU
+budget of one container; the load generator and the stub API run on the
+remaining cores when there are any. After one warm-up session has paid for
+imports and st.cache_resource, the server process's CPU time and RSS are
+sampled from /proc (Linux only) for the rest of the level, so CPU and
+memory are the server's, divided by its sessions. The user count is ramped
+until rerun latency crosses --lag-threshold-ms; that level is the
+container's saturation point.
+
+    python load_test_app.py --users 1 2 4 8 16 --turns 5 --cpus 1 --output load_results.json
+"""
+import os
+import sys
+import time
+import socket
+import random
+import asyncio
+import argparse
+import logging
+import threading
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+import requests
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+from benchmark_utils import latency_summary, load_query_corpus, write_report
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+LOAD_TEST_USERNAME = 'loadtest'
+LOAD_TEST_PASSWORD = 'loadtest'
+
+# Element types the simulated users interact with
+WIDGET_TYPES = ('button', 'text_input', 'checkbox', 'chat_input')
+
+
+def _use_local_dynamodb(endpoint_url: str = None) -> None:
+    """Point boto3.resource('dynamodb') at the in-memory stand-in or a local endpoint"""
+    import boto3
+    real_resource = boto3.resource
+
+    if endpoint_url:
+        def resource_factory(service_name, *args, **kwargs):
+            if service_name == 'dynamodb':
+                kwargs['endpoint_url'] = endpoint_url
+            return real_resource(service_name, *args, **kwargs)
+    else:
+        from local_dynamodb import LocalDynamoDB, create_chat_tables
+        local_dynamodb = create_chat_tables(LocalDynamoDB())
+
+        def resource_factory(service_name, *args, **kwargs):
+            if service_name == 'dynamodb':
+                return local_dynamodb
+            return real_resource(service_name, *args, **kwargs)
+
+    boto3.resource = resource_factory
+
+
+def serve_app(port: int, environment: Dict[str, str], dynamodb_endpoint: Optional[str], cpus: int) -> None:
+    """Server process entry point: `streamlit run app.py` with DynamoDB pointed at the stand-in"""
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, set(range(cpus)))
+    os.environ.update(environment)
+    _use_local_dynamodb(dynamodb_endpoint)
+    from streamlit.web import cli
+    cli.main(args=[
+        'run', APP_PATH,
+        '--server.port', str(port),
+        '--server.address', '127.0.0.1',
+        '--server.headless', 'true',
+        '--server.fileWatcherType', 'none',
+        '--browser.gatherUsageStats', 'false',
+        '--logger.level', 'error'
+    ], prog_name='streamlit')
+
+
+class ProcessSampler:
+    """CPU time and RSS of one process from /proc, with RSS sampled in the background for its peak"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def cpu_seconds(self) -> float:
+        with open(f'/proc/{self.pid}/stat') as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    def rss_bytes(self) -> int:
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_rss_bytes = max(self.peak_rss_bytes, self.rss_bytes())
+
+    def start(self) -> None:
+        self.peak_rss_bytes = self.rss_bytes()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss_bytes = max(self.peak_rss_bytes, self.rss_bytes())
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _widget_key(widget_id: str) -> str:
+    """The user key of a widget, which Streamlit appends to generated IDs ($$ID-<hash>-<key>)"""
+    parts = widget_id.split('-', 2)
+    return parts[2] if len(parts) == 3 else ''
+
+
+class AppSession:
+    """One browser session of the app, driven over Streamlit's websocket protocol.
+
+    Like the browser, it sends the current widget values with every rerun
+    request, and a rerun ends with the script_finished message of the last
+    script run it caused (st.rerun starts another run on the server).
+    """
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url
+        self.timeout = timeout
+        self.websocket = None
+        self.query_string = ''
+        self.page_script_hash = ''
+        # Widgets of the last script run by ID: (element type, label)
+        self.widgets: Dict[str, tuple] = {}
+        # Values of inputs and checkboxes, sent with every rerun like the browser does
+        self.values: Dict[str, WidgetState] = {}
+        self.exceptions = 0
+
+    async def connect(self) -> None:
+        self.websocket = await websockets.connect(self.url, subprotocols=['streamlit'], max_size=None)
+
+    async def close(self) -> None:
+        if self.websocket is not None:
+            await self.websocket.close()
+
+    async def rerun(self, *triggers: WidgetState) -> None:
+        message = BackMsg()
+        client_state = message.rerun_script
+        client_state.query_string = self.query_string
+        client_state.page_script_hash = self.page_script_hash
+        client_state.widget_states.widgets.extend(
+            value for widget_id, value in self.values.items() if widget_id in self.widgets
+        )
+        client_state.widget_states.widgets.extend(triggers)
+        await self.websocket.send(message.SerializeToString())
+        await asyncio.wait_for(self._read_until_finished(), self.timeout)
+
+    async def _read_until_finished(self) -> None:
+        while True:
+            message = ForwardMsg()
+            message.ParseFromString(await self.websocket.recv())
+            kind = message.WhichOneof('type')
+            if kind == 'new_session':
+                # Sent as each script run starts
+                self.widgets = {}
+                self.page_script_hash = message.new_session.page_script_hash
+            elif kind == 'page_info_changed':
+                self.query_string = message.page_info_changed.query_string
+            elif kind == 'delta' and message.delta.WhichOneof('type') == 'new_element':
+                element = message.delta.new_element
+                element_type = element.WhichOneof('type')
+                if element_type == 'exception':
+                    self.exceptions += 1
+                elif element_type in WIDGET_TYPES:
+                    widget = getattr(element, element_type)
+                    self.widgets[widget.id] = (element_type, getattr(widget, 'label', ''))
+            elif kind == 'script_finished' and message.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return
+
+    def find(self, element_type: str, key_prefix: str = None, label: str = None) -> List[str]:
+        return [
+            widget_id for widget_id, (widget_type, widget_label) in self.widgets.items()
+            if widget_type == element_type
+            and (key_prefix is None or _widget_key(widget_id).startswith(key_prefix))
+            and (label is None or widget_label == label)
+        ]
+
+    def set_text(self, key: str, value: str) -> None:
+        for widget_id in self.find('text_input', key):
+            self.values[widget_id] = WidgetState(id=widget_id, string_value=value)
+
+    def check(self, widget_id: str) -> None:
+        self.values[widget_id] = WidgetState(id=widget_id, bool_value=True)
+
+    async def click(self, widget_id: str) -> None:
+        await self.rerun(WidgetState(id=widget_id, trigger_value=True))
+
+    async def chat(self, text: str) -> bool:
+        chat_inputs = self.find('chat_input')
+        if not chat_inputs:
+            return False
+        state = WidgetState(id=chat_inputs[0])
+        state.chat_input_value.data = text
+        await self.rerun(state)
+        return True
+
+
+class SimulatedUser:
+    """One chat user driving a session of the app server"""
+
+    def __init__(self, url: str, queries: List[str], seed: int, think_time_ms: float, timeout: float):
+        self.session = AppSession(url, timeout)
+        self.queries = queries
+        self.random = random.Random(seed)
+        self.think_time_ms = think_time_ms
+        self.samples = []
+        self.errors = 0
+
+    async def _timed(self, interaction: str, action) -> None:
+        exceptions = self.session.exceptions
+        start = time.perf_counter()
+        try:
+            await action()
+            if self.session.exceptions > exceptions:
+                self.errors += 1
+        except Exception:
+            self.errors += 1
+        self.samples.append((interaction, (time.perf_counter() - start) * 1000))
+        if self.think_time_ms:
+            await asyncio.sleep(self.random.uniform(0.5, 1.5) * self.think_time_ms / 1000)
+
+    async def open_app(self) -> None:
+        async def action():
+            await self.session.connect()
+            await self.session.rerun()
+        await self._timed('open_app', action)
+
+    async def login(self) -> None:
+        async def action():
+            self.session.set_text('username_input', LOAD_TEST_USERNAME)
+            self.session.set_text('password_input', LOAD_TEST_PASSWORD)
+            await self.session.click(self.session.find('button', label='Login')[0])
+        await self._timed('login', action)
+
+    async def chat(self) -> None:
+        query = self.random.choice(self.queries)
+
+        async def action():
+            if not await self.session.chat(query):
+                raise RuntimeError("No chat input on the page")
+        await self._timed('chat', action)
+
+    async def _click(self, interaction: str, buttons: List[str]) -> None:
+        if buttons:
+            await self._timed(interaction, lambda: self.session.click(self.random.choice(buttons)))
+
+    async def view_reference(self) -> None:
+        await self._click('view_reference', self.session.find('button', 'ref_btn_'))
+
+    async def give_feedback(self) -> None:
+        if self.random.random() < 0.7:
+            buttons = self.session.find('button', 'thumbsup_')
+            if buttons:
+                await self._timed('feedback_up', lambda: self.session.click(buttons[-1]))
+            return
+        buttons = self.session.find('button', 'thumbsdown_')
+        if not buttons:
+            return
+        await self._timed('feedback_down', lambda: self.session.click(buttons[-1]))
+        checkboxes = self.session.find('checkbox', 'cat')
+        submit = self.session.find('button', 'submit_feedback_')
+        if checkboxes and submit:
+            async def action():
+                self.session.check(self.random.choice(checkboxes))
+                await self.session.click(submit[-1])
+            await self._timed('feedback_submit', action)
+
+    async def open_past_conversation(self) -> None:
+        await self._click('open_conversation', self.session.find('button', 'conv_'))
+
+    async def new_chat(self) -> None:
+        await self._click('new_chat', self.session.find('button', label='➕ New Chat'))
+
+    async def run_scenario(self, turns: int) -> None:
+        """Log in and run a realistic mix of chat, sidebar and feedback interactions"""
+        try:
+            await self.open_app()
+            await self.login()
+            for _ in range(turns):
+                await self.chat()
+                if self.random.random() < 0.3:
+                    await self.view_reference()
+                if self.random.random() < 0.3:
+                    await self.give_feedback()
+                if self.random.random() < 0.2:
+                    await self.open_past_conversation()
+                if self.random.random() < 0.1:
+                    await self.new_chat()
+        finally:
+            await self.session.close()
+
+
+def start_server(args, api_url: str):
+    """Start a fresh app server for one level and wait until it is healthy"""
+    environment = {
+        'CHATBOT_USERNAME': LOAD_TEST_USERNAME,
+        'CHATBOT_PASSWORD': LOAD_TEST_PASSWORD,
+        'API_URL': api_url,
+        'AWS_ACCESS_KEY_ID': os.environ.get('AWS_ACCESS_KEY_ID', 'loadtest'),
+        'AWS_SECRET_ACCESS_KEY': os.environ.get('AWS_SECRET_ACCESS_KEY', 'loadtest'),
+        'AWS_REGION': os.environ.get('AWS_REGION', 'us-east-1'),
+        'AWS_DEFAULT_REGION': os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')
+    }
+    port = _free_port()
+    process = multiprocessing.get_context('spawn').Process(
+        target=serve_app, args=(port, environment, args.dynamodb_endpoint, args.cpus), daemon=True
+    )
+    process.start()
+    deadline = time.monotonic() + args.startup_seconds
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/_stcore/health", timeout=1).ok:
+                return process, f"ws://127.0.0.1:{port}/_stcore/stream"
+        except requests.exceptions.RequestException:
+            pass
+        if not process.is_alive():
+            break
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"The app server did not start within {args.startup_seconds} s")
+
+
+def stop_server(process) -> None:
+    process.terminate()
+    process.join(10)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+
+async def _run_users(url: str, users: int, args, queries: List[str]) -> List[SimulatedUser]:
+    simulated = [
+        SimulatedUser(url, queries, args.seed * 1000 + index, args.think_time_ms, args.timeout)
+        for index in range(users)
+    ]
+    await asyncio.gather(*(user.run_scenario(args.turns) for user in simulated))
+    return simulated
+
+
+def run_level(users: int, args, queries: List[str], api_url: str) -> Dict[str, Any]:
+    """Run one concurrency level against a fresh server and summarize its interactions"""
+    process, url = start_server(args, api_url)
+    try:
+        # One throwaway session pays for imports and cached resources, which a long-lived server only does once
+        asyncio.run(_run_users(url, 1, argparse.Namespace(**{**vars(args), 'turns': 1, 'think_time_ms': 0}), queries))
+
+        sampler = ProcessSampler(process.pid)
+        rss_before = sampler.rss_bytes()
+        cpu_before = sampler.cpu_seconds()
+        sampler.start()
+        started = time.perf_counter()
+        simulated = asyncio.run(_run_users(url, users, args, queries))
+        wall_seconds = time.perf_counter() - started
+        cpu_seconds = sampler.cpu_seconds() - cpu_before
+        rss_after = sampler.rss_bytes()
+        sampler.stop()
+    finally:
+        stop_server(process)
+
+    by_interaction = {}
+    for user in simulated:
+        for interaction, elapsed in user.samples:
+            by_interaction.setdefault(interaction, []).append(elapsed)
+    reruns = [elapsed for user in simulated for _, elapsed in user.samples]
+    cpus = args.cpus or os.cpu_count()
+
+    return {
+        'users': users,
+        'wall_seconds': round(wall_seconds, 3),
+        'interactions': len(reruns),
+        'interactions_per_second': round(len(reruns) / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+        'errors': sum(user.errors for user in simulated),
+        'rerun_ms': latency_summary(reruns),
+        'interaction_ms': {name: latency_summary(samples) for name, samples in by_interaction.items()},
+        'server': {
+            'cpu_seconds': round(cpu_seconds, 3),
+            'cpu_seconds_per_session': round(cpu_seconds / users, 4),
+            # Share of the --cpus cores the server used during the level
+            'cpu_utilization': round(cpu_seconds / wall_seconds / cpus, 3) if wall_seconds > 0 else None,
+            'rss_bytes_before': rss_before,
+            'rss_bytes_peak': sampler.peak_rss_bytes,
+            'rss_growth_bytes_per_session': int(max(0, rss_after - rss_before) / users)
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a streamlit run server of the app against a local stub API")
+    parser.add_argument('--users', nargs='+', type=int, default=[1, 2, 4, 8], help="Concurrent sessions to ramp through")
+    parser.add_argument('--turns', type=int, default=5, help="Chat turns per user")
+    parser.add_argument('--think-time-ms', type=float, default=500, help="Mean pause between interactions")
+    parser.add_argument('--cpus', type=int, default=1, help="Cores the app server is pinned to (0 for no pinning)")
+    parser.add_argument('--lag-threshold-ms', type=float, default=1000,
+                        help="Rerun p95 above which a level counts as saturated")
+    parser.add_argument('--latency-profile', default='zero', help="Stub API latency profile")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="Stub API latency multiplier")
+    parser.add_argument('--dynamodb-endpoint', help="Use DynamoDB Local at this URL instead of the in-memory stand-in")
+    parser.add_argument('--queries', nargs='+', help="JSONL files of queries")
+    parser.add_argument('--startup-seconds', type=float, default=30, help="Time allowed for the app server to start")
+    parser.add_argument('--timeout', type=float, default=60, help="Per-rerun timeout in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.cpus and hasattr(os, 'sched_setaffinity') and os.cpu_count() > args.cpus:
+        # Keep the load generator and stub API off the server's cores
+        os.sched_setaffinity(0, set(range(args.cpus, os.cpu_count())))
+    from local_api_server import load_stubbed_lambda, serve_lambda
+
+    lambda_function, _ = load_stubbed_lambda(args.latency_profile, args.time_scale, args.seed)
+    logging.getLogger().setLevel(logging.ERROR)
+    api_server, api_url = serve_lambda(lambda_function.lambda_handler)
+    queries = load_query_corpus(args.queries)
+
+    levels = []
+    saturation_point = None
+    try:
+        for users in args.users:
+            level = run_level(users, args, queries, api_url)
+            levels.append(level)
+            print(f"{users} sessions: rerun p95 {level['rerun_ms']['p95']:.0f} ms, "
+                  f"{level['interactions_per_second']:.2f} interactions/s, "
+                  f"server CPU {level['server']['cpu_utilization']}", file=sys.stderr)
+            if level['rerun_ms']['p95'] > args.lag_threshold_ms:
+                saturation_point = users
+                break
+    finally:
+        api_server.shutdown()
+
+    write_report({
+        'config': {
+            'turns': args.turns,
+            'think_time_ms': args.think_time_ms,
+            'cpus': args.cpus,
+            'lag_threshold_ms': args.lag_threshold_ms,
+            'latency_profile': args.latency_profile,
+            'time_scale': args.time_scale,
+            'sessions': 'websocket sessions on one streamlit run server pinned to --cpus cores'
+        },
+        'levels': levels,
+        # First session count whose rerun p95 crossed the lag threshold, None if never reached
+        'saturation_point': saturation_point,
+        'max_users_within_threshold': levels[-2]['users'] if saturation_point and len(levels) > 1
+        else (None if saturation_point else levels[-1]['users'])
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Serve lambda_handler over HTTP on localhost.
+
+Mirrors the API Gateway integration the Streamlit app talks to: the POST body
+is passed to the handler as event['body'] and the handler's whole return
+value (statusCode, headers, body) is sent back as JSON, which is what
+ChatHandler._process_api_response unwraps.
+
+    python local_api_server.py --port 8080 --stub --latency-profile realistic
+"""
+import os
+import json
+import argparse
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _make_request_handler(lambda_handler: Callable):
+    class LambdaRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            event = {
+                'body': self.rfile.read(length).decode('utf-8'),
+                'headers': dict(self.headers.items()),
+                'path': self.path,
+                'httpMethod': 'POST',
+                'requestContext': {'identity': {'sourceIp': self.client_address[0]}}
+            }
+            result = lambda_handler(event, None)
+            payload = json.dumps(result).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return LambdaRequestHandler
+
+
+def serve_lambda(lambda_handler: Callable, host: str = '127.0.0.1',
+                 port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Start serving a handler on a background thread and return the server and its URL"""
+    server = ThreadingHTTPServer((host, port), _make_request_handler(lambda_handler))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://{host}:{server.server_address[1]}/"
+    logger.info(f"Serving lambda_handler at {url}")
+    return server, url
+
+
+def load_stubbed_lambda(latency_profile: str = 'zero', time_scale: float = 1.0, seed: int = 0):
+    """Import lambda_function with its AWS clients replaced by bedrock_stubs"""
+    from bedrock_stubs import install_stubs
+    os.environ.setdefault('KNOWLEDGE_BASE_ID', 'local-kb')
+    os.environ.setdefault('FM_ARN', 'arn:aws:bedrock:us-east-1::foundation-model/local-model')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    import lambda_function
+    stubs = install_stubs(lambda_function, latency_profile=latency_profile,
+                          seed=seed, time_scale=time_scale)
+    return lambda_function, stubs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve lambda_handler on localhost")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--stub', action='store_true', help="Replace AWS clients with bedrock_stubs")
+    parser.add_argument('--latency-profile', default='zero', help="Stub latency profile (with --stub)")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="Stub latency multiplier (with --stub)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.stub:
+        lambda_function, _ = load_stubbed_lambda(args.latency_profile, args.time_scale)
+    else:
+        import lambda_function
+
+    server, url = serve_lambda(lambda_function.lambda_handler, args.host, args.port)
+    print(f"Set API_URL={url} to point the Streamlit app at this server")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
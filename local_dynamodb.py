@@ -0,0 +1,438 @@
+"""In-memory stand-in for the boto3 DynamoDB resource.
+
+Implements the subset of the Table API this project uses (put_item,
+get_item, delete_item, update_item, query, scan and batch_writer, plus the
+resource's batch_write_item) so the Streamlit app, the chat history tooling
+and the benchmarks can run without AWS. Items are deep-copied on the way in and out and floats are rejected,
+matching boto3.
+"""
+import re
+import copy
+import time
+import threading
+from decimal import Decimal
+from typing import Dict, Any, List, Optional
+
+from boto3.dynamodb.conditions import ConditionBase
+
+_COMPARATORS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b
+}
+
+_SIMPLE_CONDITION = re.compile(r'^\s*([#\w.]+)\s*(=|<>|<=|>=|<|>)\s*(:\w+)\s*$')
+_FUNCTION_CONDITION = re.compile(r'^\s*(begins_with|contains)\s*\(\s*([#\w.]+)\s*,\s*(:\w+)\s*\)\s*$')
+_EXISTS_CONDITION = re.compile(r'^\s*(attribute_exists|attribute_not_exists)\s*\(\s*([#\w.]+)\s*\)\s*$')
+
+
+class ResourceInUseException(Exception):
+    """Raised by create_table when the table already exists"""
+
+
+class ResourceNotFoundException(Exception):
+    """Raised when a table does not exist"""
+
+
+class ConditionalCheckFailedException(Exception):
+    """Raised when a ConditionExpression does not hold"""
+
+
+class ProvisionedThroughputExceededException(Exception):
+    """Raised when a table configured with a write rate limit is throttled"""
+
+
+class _Exceptions:
+    ResourceInUseException = ResourceInUseException
+    ResourceNotFoundException = ResourceNotFoundException
+    ConditionalCheckFailedException = ConditionalCheckFailedException
+    ProvisionedThroughputExceededException = ProvisionedThroughputExceededException
+
+
+class _Client:
+    exceptions = _Exceptions
+
+
+class _Meta:
+    client = _Client
+
+
+def _check_types(value) -> None:
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, dict):
+        for nested in value.values():
+            _check_types(nested)
+    elif isinstance(value, (list, set, tuple)):
+        for nested in value:
+            _check_types(nested)
+
+
+def _ok(**extra) -> Dict[str, Any]:
+    return {'ResponseMetadata': {'HTTPStatusCode': 200}, **extra}
+
+
+def _evaluate_condition(condition: ConditionBase, item: Dict[str, Any]) -> bool:
+    """Evaluate a boto3 Key/Attr condition object against an item"""
+    expression = condition.get_expression()
+    operator = expression['operator']
+    values = expression['values']
+
+    if operator == 'AND':
+        return all(_evaluate_condition(value, item) for value in values)
+    if operator == 'OR':
+        return any(_evaluate_condition(value, item) for value in values)
+    if operator == 'NOT':
+        return not _evaluate_condition(values[0], item)
+
+    name = values[0].name
+    if operator == 'attribute_exists':
+        return name in item
+    if operator == 'attribute_not_exists':
+        return name not in item
+    if name not in item:
+        return False
+    actual = item[name]
+    if operator == 'BETWEEN':
+        return values[1] <= actual <= values[2]
+    if operator == 'begins_with':
+        return str(actual).startswith(values[1])
+    if operator == 'contains':
+        return values[1] in actual
+    if operator == 'IN':
+        return actual in values[1]
+    return _COMPARATORS[operator](actual, values[1])
+
+
+def _evaluate_string(expression: str, item: Dict[str, Any],
+                     names: Dict[str, str], values: Dict[str, Any]) -> bool:
+    """Evaluate a string expression made of simple clauses joined with AND"""
+    for clause in re.split(r'\s+AND\s+', expression.strip(), flags=re.IGNORECASE):
+        match = _SIMPLE_CONDITION.match(clause)
+        if match:
+            name, operator, placeholder = match.groups()
+            name = names.get(name, name)
+            if name not in item or not _COMPARATORS[operator](item[name], values[placeholder]):
+                return False
+            continue
+        match = _FUNCTION_CONDITION.match(clause)
+        if match:
+            function, name, placeholder = match.groups()
+            name = names.get(name, name)
+            if name not in item:
+                return False
+            if function == 'begins_with' and not str(item[name]).startswith(values[placeholder]):
+                return False
+            if function == 'contains' and values[placeholder] not in item[name]:
+                return False
+            continue
+        match = _EXISTS_CONDITION.match(clause)
+        if match:
+            function, name = match.groups()
+            exists = names.get(name, name) in item
+            if exists != (function == 'attribute_exists'):
+                return False
+            continue
+        raise ValueError(f"Unsupported expression: {clause}")
+    return True
+
+
+def _matches(expression, item, names, values) -> bool:
+    if expression is None:
+        return True
+    if isinstance(expression, ConditionBase):
+        return _evaluate_condition(expression, item)
+    return _evaluate_string(expression, item, names or {}, values or {})
+
+
+class LocalTable:
+    """In-memory DynamoDB table with a hash key and an optional range key"""
+
+    meta = _Meta
+
+    def __init__(self, name: str, hash_key: str, range_key: Optional[str] = None,
+                 page_size: int = 1000, write_rate_limit: Optional[float] = None):
+        self.name = name
+        self.table_name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.page_size = page_size
+        self.write_rate_limit = write_rate_limit
+        self.ttl_attribute = None
+        self._partitions = {}
+        self._lock = threading.RLock()
+        self._write_window = [0.0, 0]
+        self.consumed = {'reads': 0, 'writes': 0}
+
+    def _key(self, item: Dict[str, Any]):
+        return item[self.hash_key], item.get(self.range_key) if self.range_key else None
+
+    def _throttle_writes(self) -> None:
+        """Reject writes beyond write_rate_limit per second, like an under-provisioned table"""
+        if not self.write_rate_limit:
+            return
+        now = time.monotonic()
+        window_start, count = self._write_window
+        if now - window_start >= 1:
+            self._write_window = [now, 1]
+            return
+        if count >= self.write_rate_limit:
+            raise ProvisionedThroughputExceededException(
+                f"Write rate for {self.name} exceeded {self.write_rate_limit}/s"
+            )
+        self._write_window[1] = count + 1
+
+    def put_item(self, Item: Dict[str, Any], ConditionExpression=None,
+                 ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        _check_types(Item)
+        with self._lock:
+            self._throttle_writes()
+            hash_value, range_value = self._key(Item)
+            partition = self._partitions.setdefault(hash_value, {})
+            if ConditionExpression is not None:
+                existing = partition.get(range_value, {})
+                if not _matches(ConditionExpression, existing, ExpressionAttributeNames,
+                                ExpressionAttributeValues):
+                    raise ConditionalCheckFailedException("The conditional request failed")
+            partition[range_value] = copy.deepcopy(Item)
+            self.consumed['writes'] += 1
+        return _ok()
+
+    def get_item(self, Key: Dict[str, Any], **kwargs):
+        with self._lock:
+            hash_value, range_value = self._key(Key)
+            item = self._partitions.get(hash_value, {}).get(range_value)
+            self.consumed['reads'] += 1
+            return _ok(Item=copy.deepcopy(item)) if item is not None else _ok()
+
+    def delete_item(self, Key: Dict[str, Any], **kwargs):
+        with self._lock:
+            self._throttle_writes()
+            hash_value, range_value = self._key(Key)
+            partition = self._partitions.get(hash_value, {})
+            partition.pop(range_value, None)
+            if not partition:
+                self._partitions.pop(hash_value, None)
+            self.consumed['writes'] += 1
+        return _ok()
+
+    def update_item(self, Key: Dict[str, Any], UpdateExpression: str,
+                    ExpressionAttributeValues=None, ExpressionAttributeNames=None, **kwargs):
+        """Support 'SET a = :a, b = :b' and 'ADD counter :n' update expressions"""
+        _check_types(ExpressionAttributeValues or {})
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            self._throttle_writes()
+            hash_value, range_value = self._key(Key)
+            partition = self._partitions.setdefault(hash_value, {})
+            item = partition.setdefault(range_value, copy.deepcopy(Key))
+            for action, body in re.findall(r'(SET|ADD|REMOVE)\s+(.*?)(?=\s+(?:SET|ADD|REMOVE)\s+|$)',
+                                           UpdateExpression.strip(), flags=re.IGNORECASE):
+                for assignment in body.split(','):
+                    assignment = assignment.strip()
+                    if action.upper() == 'SET':
+                        name, placeholder = [part.strip() for part in assignment.split('=')]
+                        item[names.get(name, name)] = copy.deepcopy(values[placeholder])
+                    elif action.upper() == 'ADD':
+                        name, placeholder = assignment.split()
+                        name = names.get(name, name)
+                        item[name] = item.get(name, Decimal(0)) + values[placeholder]
+                    else:
+                        item.pop(names.get(assignment, assignment), None)
+            self.consumed['writes'] += 1
+            return _ok(Attributes=copy.deepcopy(item))
+
+    def _page(self, items: List[Dict[str, Any]], ExclusiveStartKey, Limit):
+        """Slice one page of items and build the LastEvaluatedKey"""
+        start = 0
+        if ExclusiveStartKey:
+            start_key = self._key(ExclusiveStartKey)
+            for index, item in enumerate(items):
+                if self._key(item) == start_key:
+                    start = index + 1
+                    break
+        page_size = min(Limit, self.page_size) if Limit else self.page_size
+        page = items[start:start + page_size]
+        response = _ok(Items=[copy.deepcopy(item) for item in page])
+        if start + page_size < len(items) and page:
+            last = page[-1]
+            response['LastEvaluatedKey'] = {
+                key: last[key] for key in (self.hash_key, self.range_key) if key
+            }
+        return response
+
+    def _hash_value(self, condition, names, values):
+        """Find the partition key value a key condition pins down"""
+        if isinstance(condition, ConditionBase):
+            expression = condition.get_expression()
+            if expression['operator'] == 'AND':
+                for nested in expression['values']:
+                    try:
+                        return self._hash_value(nested, names, values)
+                    except ValueError:
+                        continue
+            elif expression['operator'] == '=' and expression['values'][0].name == self.hash_key:
+                return expression['values'][1]
+        else:
+            for clause in re.split(r'\s+AND\s+', condition.strip(), flags=re.IGNORECASE):
+                match = _SIMPLE_CONDITION.match(clause)
+                if match and match.group(2) == '=':
+                    name = (names or {}).get(match.group(1), match.group(1))
+                    if name == self.hash_key:
+                        return (values or {})[match.group(3)]
+        raise ValueError(f"Query key condition must pin the partition key {self.hash_key}")
+
+    def query(self, KeyConditionExpression, FilterExpression=None, ExpressionAttributeValues=None,
+              ExpressionAttributeNames=None, ExclusiveStartKey=None, Limit=None,
+              ScanIndexForward=True, **kwargs):
+        hash_value = self._hash_value(KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        with self._lock:
+            partition = self._partitions.get(hash_value, {})
+            candidates = [
+                item for item in partition.values()
+                if _matches(KeyConditionExpression, item, ExpressionAttributeNames, ExpressionAttributeValues)
+            ]
+        if self.range_key:
+            candidates.sort(key=lambda item: item[self.range_key], reverse=not ScanIndexForward)
+        response = self._page(candidates, ExclusiveStartKey, Limit)
+        self.consumed['reads'] += len(response['Items'])
+        response['Items'] = [
+            item for item in response['Items']
+            if _matches(FilterExpression, item, ExpressionAttributeNames, ExpressionAttributeValues)
+        ]
+        response['Count'] = len(response['Items'])
+        return response
+
+    def scan(self, FilterExpression=None, ExpressionAttributeValues=None,
+             ExpressionAttributeNames=None, ExclusiveStartKey=None, Limit=None, **kwargs):
+        with self._lock:
+            items = [
+                item
+                for hash_value in sorted(self._partitions, key=str)
+                for _, item in sorted(self._partitions[hash_value].items(), key=lambda entry: str(entry[0]))
+            ]
+        response = self._page(items, ExclusiveStartKey, Limit)
+        self.consumed['reads'] += len(response['Items'])
+        response['Items'] = [
+            item for item in response['Items']
+            if _matches(FilterExpression, item, ExpressionAttributeNames, ExpressionAttributeValues)
+        ]
+        response['Count'] = len(response['Items'])
+        return response
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return _BatchWriter(self)
+
+    def expire_items(self, now: Optional[float] = None) -> int:
+        """Delete items whose TTL attribute is in the past, as DynamoDB's TTL sweeper would"""
+        if not self.ttl_attribute:
+            return 0
+        now = now if now is not None else time.time()
+        expired = 0
+        with self._lock:
+            for partition in self._partitions.values():
+                for range_value in [
+                    range_value for range_value, item in partition.items()
+                    if self.ttl_attribute in item and float(item[self.ttl_attribute]) <= now
+                ]:
+                    del partition[range_value]
+                    expired += 1
+        return expired
+
+    def item_count(self) -> int:
+        with self._lock:
+            return sum(len(partition) for partition in self._partitions.values())
+
+
+class _BatchWriter:
+    """Context manager mirroring boto3's batch_writer"""
+
+    def __init__(self, table: LocalTable):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key=Key)
+
+
+class LocalDynamoDB:
+    """Stand-in for boto3.resource('dynamodb')"""
+
+    meta = _Meta
+
+    def __init__(self, page_size: int = 1000, request_latency_ms: float = 0):
+        self.page_size = page_size
+        # Round trip added to batch requests, so parallel writers have something to overlap
+        self.request_latency_ms = request_latency_ms
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def create_table(self, TableName: str, KeySchema: List[Dict[str, str]], **kwargs) -> LocalTable:
+        hash_key = next(key['AttributeName'] for key in KeySchema if key['KeyType'] == 'HASH')
+        range_key = next((key['AttributeName'] for key in KeySchema if key['KeyType'] == 'RANGE'), None)
+        with self._lock:
+            if TableName in self._tables:
+                raise ResourceInUseException(f"Table already exists: {TableName}")
+            table = LocalTable(TableName, hash_key, range_key, page_size=self.page_size)
+            self._tables[TableName] = table
+        return table
+
+    def Table(self, name: str) -> LocalTable:
+        with self._lock:
+            if name not in self._tables:
+                raise ResourceNotFoundException(f"Requested resource not found: {name}")
+            return self._tables[name]
+
+    def batch_write_item(self, RequestItems: Dict[str, List[Dict[str, Any]]], **kwargs):
+        """Apply up to 25 put and delete requests; throttled ones come back as UnprocessedItems"""
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise ValueError("Too many items requested for the BatchWriteItem call")
+        if self.request_latency_ms:
+            time.sleep(self.request_latency_ms / 1000)
+        unprocessed = {}
+        processed = 0
+        for table_name, requests in RequestItems.items():
+            table = self.Table(table_name)
+            for request in requests:
+                try:
+                    if 'PutRequest' in request:
+                        table.put_item(Item=request['PutRequest']['Item'])
+                    else:
+                        table.delete_item(Key=request['DeleteRequest']['Key'])
+                    processed += 1
+                except ProvisionedThroughputExceededException:
+                    unprocessed.setdefault(table_name, []).append(request)
+        if unprocessed and not processed:
+            # DynamoDB fails the whole call when every item was throttled
+            raise ProvisionedThroughputExceededException("Throughput exceeded for every item in the batch")
+        return _ok(UnprocessedItems=unprocessed)
+
+
+def create_chat_tables(dynamodb: LocalDynamoDB) -> LocalDynamoDB:
+    """Create the ChatHistory and ChatFeedback tables with the production key schemas"""
+    dynamodb.create_table(
+        TableName='ChatHistory',
+        KeySchema=[
+            {'AttributeName': 'user_id', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+        ]
+    )
+    dynamodb.create_table(
+        TableName='ChatFeedback',
+        KeySchema=[
+            {'AttributeName': 'feedback_id', 'KeyType': 'HASH'}
+        ]
+    )
+    return dynamodb
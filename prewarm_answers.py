@@ -0,0 +1,171 @@
+"""Prewarm answers for the most frequent questions in ChatHistory.
+
+Scans recent user messages, counts them by normalized query, runs the top
+ones through lambda_handler (with use_warm_answers off, so they are computed
+fresh) at a bounded rate and writes the answers to the WARM_ANSWERS_TABLE
+store that lambda_handler consults first.
+
+Run it on a schedule, either as its own Lambda (handler:
+prewarm_answers.prewarm_handler, packaged with lambda_function.py, e.g. from
+an EventBridge rule) or from the command line:
+
+    python prewarm_answers.py --top 50 --min-count 3 --rate 1
+    python prewarm_answers.py --invalidate    # after a knowledge base re-sync
+"""
+import os
+import json
+import time
+import logging
+import argparse
+from collections import Counter
+from decimal import Decimal
+from typing import Any, Dict, List, Tuple
+
+from boto3.dynamodb.conditions import Attr
+
+from client_config import create_resource
+from query_features import normalize_query
+from warm_answers import WARM_ANSWERS_TABLE_SCHEMA, strip_presigned_urls
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def mine_top_queries(history_table, lookback_days: float = 7, top: int = 50,
+                     min_count: int = 3) -> List[Tuple[str, int]]:
+    """Most frequent normalized user questions in the lookback window, with a sample phrasing"""
+    cutoff = Decimal(str(time.time() - lookback_days * 86400))
+    counts = Counter()
+    phrasing = {}
+    scan_kwargs = {
+        'FilterExpression': Attr('role').eq('user') & Attr('timestamp').gte(cutoff),
+        'ProjectionExpression': '#content',
+        'ExpressionAttributeNames': {'#content': 'content'}
+    }
+    while True:
+        response = history_table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            normalized = normalize_query(item.get('content', ''))
+            if normalized:
+                counts[normalized] += 1
+                phrasing.setdefault(normalized, item['content'].strip())
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    return [
+        (phrasing[normalized], count)
+        for normalized, count in counts.most_common(top)
+        if count >= min_count
+    ]
+
+
+def ensure_table(dynamodb, table_name: str) -> None:
+    """Create the warm answer table if it does not exist"""
+    try:
+        dynamodb.create_table(TableName=table_name, **WARM_ANSWERS_TABLE_SCHEMA)
+        logger.info(f"Created table {table_name}")
+    except dynamodb.meta.client.exceptions.ResourceInUseException:
+        pass
+
+
+def compute_answer(handler, user_query: str, pipeline_mode: str, max_retries: int = 2) -> Dict[str, Any]:
+    """Run a query through lambda_handler, waiting out 429s, and return the response body"""
+    event = {
+        'body': json.dumps({
+            'user_query': user_query,
+            'pipeline_mode': pipeline_mode,
+            'use_warm_answers': False
+        }),
+        # Paced by --rate, so it is not held to a user's rate limit
+        'internal_job': 'prewarm'
+    }
+    for attempt in range(max_retries + 1):
+        response = handler(event, None)
+        if response['statusCode'] != 429 or attempt == max_retries:
+            break
+        retry_after = float(response['headers'].get('Retry-After', 1))
+        logger.warning(f"Throttled while prewarming, retrying in {retry_after}s")
+        time.sleep(retry_after)
+    body = json.loads(response['body'])
+    if response['statusCode'] != 200:
+        raise RuntimeError(body.get('error', f"status {response['statusCode']}"))
+    return body
+
+
+def prewarm(lambda_function, history_table, top: int = 50, min_count: int = 3, lookback_days: float = 7,
+            rate: float = 1.0, pipeline_mode: str = None) -> Dict[str, Any]:
+    """Compute and store answers for the top queries, at most `rate` queries per second"""
+    store = lambda_function.warm_answer_store
+    if store is None:
+        raise ValueError("WARM_ANSWERS_TABLE is not set")
+    pipeline_mode = pipeline_mode or lambda_function.DEFAULT_PIPELINE_MODE
+
+    queries = mine_top_queries(history_table, lookback_days, top, min_count)
+    logger.info(f"Prewarming {len(queries)} queries")
+    report = {'queries': len(queries), 'stored': 0, 'failed': 0, 'kb_version': store.current_version()}
+    interval = 1 / rate if rate > 0 else 0
+    for user_query, count in queries:
+        started = time.monotonic()
+        try:
+            body = compute_answer(lambda_function.lambda_handler, user_query, pipeline_mode)
+            store.put(user_query, pipeline_mode, {
+                'generated_response': body['generated_response'],
+                'references': strip_presigned_urls(body['detailed_references']),
+                'validation_status': body['validation_status'],
+                'validation_message': body['validation_message']
+            }, query_count=count)
+            report['stored'] += 1
+        except Exception as e:
+            logger.error(f"Error prewarming '{user_query}': {str(e)}")
+            report['failed'] += 1
+        # Pace the job so it never competes with live traffic for the Bedrock quota
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    return report
+
+
+def prewarm_handler(event, context):
+    """Scheduled Lambda entry point; event keys override the PREWARM_* defaults"""
+    import lambda_function
+    event = event or {}
+    if lambda_function.warm_answer_store is None:
+        raise ValueError("WARM_ANSWERS_TABLE is not set")
+    dynamodb = create_resource('dynamodb', 'dynamodb')
+    if event.get('invalidate'):
+        return {'deleted': lambda_function.warm_answer_store.delete_all()}
+    ensure_table(dynamodb, lambda_function.warm_answer_store.table_name)
+    return prewarm(
+        lambda_function,
+        dynamodb.Table(os.environ.get('CHAT_HISTORY_TABLE', 'ChatHistory')),
+        top=int(event.get('top', os.environ.get('PREWARM_TOP', 50))),
+        min_count=int(event.get('min_count', os.environ.get('PREWARM_MIN_COUNT', 3))),
+        lookback_days=float(event.get('lookback_days', os.environ.get('PREWARM_LOOKBACK_DAYS', 7))),
+        rate=float(event.get('rate', os.environ.get('PREWARM_RATE', 1))),
+        pipeline_mode=event.get('pipeline_mode')
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prewarm answers for frequent questions")
+    parser.add_argument('--top', type=int, default=50, help="Number of most frequent queries to prewarm")
+    parser.add_argument('--min-count', type=int, default=3, help="Skip queries asked fewer times than this")
+    parser.add_argument('--lookback-days', type=float, default=7)
+    parser.add_argument('--rate', type=float, default=1.0, help="Queries per second sent through the pipeline")
+    parser.add_argument('--pipeline-mode', help="Pipeline to prewarm (default: PIPELINE_MODE)")
+    parser.add_argument('--invalidate', action='store_true', help="Delete all warm answers and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = prewarm_handler({
+        'invalidate': args.invalidate,
+        'top': args.top,
+        'min_count': args.min_count,
+        'lookback_days': args.lookback_days,
+        'rate': args.rate,
+        'pipeline_mode': args.pipeline_mode
+    }, None)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
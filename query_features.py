@@ -0,0 +1,73 @@
+import re
+from typing import Dict, Any, List, Set
+
+# Common English words that carry no retrieval signal
+STOPWORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'been', 'am', 'do', 'does', 'did',
+    'i', 'me', 'my', 'we', 'our', 'you', 'your', 'he', 'she', 'it', 'its', 'they', 'them',
+    'their', 'this', 'that', 'these', 'those', 'of', 'to', 'in', 'on', 'at', 'for', 'with',
+    'by', 'from', 'about', 'as', 'into', 'can', 'could', 'should', 'would', 'will', 'shall',
+    'may', 'might', 'must', 'have', 'has', 'had', 'what', 'which', 'who', 'whom', 'whose',
+    'when', 'where', 'why', 'how', 'please', 'tell', 'there', 'any', 'some', 'if', 'so',
+    'and', 'or', 'but', 'not', 'no'
+}
+
+QUESTION_WORDS = {'what', 'which', 'who', 'whom', 'whose', 'when', 'where', 'why', 'how'}
+
+# Words that usually mean the user is asking about more than one thing; plain "and"
+# joins parts of one question too often ("terms and conditions") to count
+CONJUNCTION_WORDS = {'or', 'vs', 'versus', 'compare', 'comparison', 'difference', 'between'}
+
+# Stopwords that still change the meaning of a question, kept by normalize_query
+MEANINGFUL_STOPWORDS = QUESTION_WORDS | {'not', 'no', 'and', 'or'}
+
+# Pronouns that point back at an earlier turn instead of naming the subject
+VAGUE_REFERENCES = {'it', 'this', 'that', 'they', 'those', 'these', 'them', 'one'}
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['\-][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase and split text into word tokens"""
+    return _TOKEN_PATTERN.findall((text or '').lower())
+
+
+def content_terms(text: str) -> Set[str]:
+    """Return the set of non-stopword terms in the text"""
+    return {token for token in tokenize(text) if token not in STOPWORDS}
+
+
+def normalize_query(text: str, drop_stopwords: bool = False) -> str:
+    """Canonical form of a query for counting and cache keys: lowercase tokens, no punctuation.
+
+    With drop_stopwords, filler words are removed too, except the ones that
+    change what is being asked (question words, negations, and/or).
+    """
+    tokens = tokenize(text)
+    if drop_stopwords:
+        tokens = [token for token in tokens if token not in STOPWORDS or token in MEANINGFUL_STOPWORDS]
+    return ' '.join(tokens)
+
+
+def jaccard_similarity(first: Set[str], second: Set[str]) -> float:
+    """Jaccard similarity between two term sets"""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def extract_query_features(user_query: str) -> Dict[str, Any]:
+    """Compute the cheap lexical features used to plan retrieval for a query"""
+    tokens = tokenize(user_query)
+    terms = {token for token in tokens if token not in STOPWORDS}
+    stripped = (user_query or '').strip()
+
+    return {
+        'token_count': len(tokens),
+        'term_count': len(terms),
+        'terms': terms,
+        'is_question': stripped.endswith('?') or bool(tokens and tokens[0] in QUESTION_WORDS),
+        'question_marks': stripped.count('?'),
+        'has_conjunction': any(token in CONJUNCTION_WORDS for token in tokens),
+        'has_vague_reference': any(token in VAGUE_REFERENCES for token in tokens)
+    }
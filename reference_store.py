@@ -0,0 +1,88 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from client_config import create_resource
+
+logger = logging.getLogger()
+
+REFERENCE_TABLE_SCHEMA = {
+    'KeySchema': [
+        {'AttributeName': 'ref_id', 'KeyType': 'HASH'}
+    ],
+    'AttributeDefinitions': [
+        {'AttributeName': 'ref_id', 'AttributeType': 'S'}
+    ],
+    'BillingMode': 'PAY_PER_REQUEST'
+}
+
+
+def reference_id(ref: Dict[str, Any]) -> str:
+    """Stable ID of a reference, derived from its source and content"""
+    return hashlib.sha1(f"{ref.get('uri', '')}\n{ref.get('snippet', '')}".encode()).hexdigest()[:20]
+
+
+class ReferenceStore:
+    """Full reference details by ref_id, so responses can ship lightweight references.
+
+    Details are kept in a per-container LRU and, when a table is configured,
+    in DynamoDB so any container can serve them. Saved conversations keep
+    only reference stubs, so table items do not expire unless ttl_seconds is
+    set; ref_ids are content hashes, so the table holds one item per distinct
+    excerpt however often it is cited.
+    """
+
+    def __init__(self, table=None, ttl_seconds: Optional[float] = None, max_local: int = 5000):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_local = max_local
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'ReferenceStore':
+        """Store backed by REFERENCE_TABLE when set, container-local otherwise"""
+        table_name = os.environ.get('REFERENCE_TABLE')
+        table = create_resource('dynamodb', 'dynamodb').Table(table_name) if table_name else None
+        ttl_seconds = float(os.environ.get('REFERENCE_TTL_SECONDS', 0))
+        return cls(table, ttl_seconds=ttl_seconds or None)
+
+    def _remember(self, ref_id: str, detail: Dict[str, Any]) -> None:
+        with self._lock:
+            self._local[ref_id] = detail
+            self._local.move_to_end(ref_id)
+            while len(self._local) > self.max_local:
+                self._local.popitem(last=False)
+
+    def put_many(self, details: List[Dict[str, Any]]) -> None:
+        """Store reference details, each with a ref_id, uri and snippet"""
+        for detail in details:
+            self._remember(detail['ref_id'], detail)
+        if self.table is None or not details:
+            return
+        try:
+            with self.table.batch_writer(overwrite_by_pkeys=['ref_id']) as batch:
+                for detail in details:
+                    item = {'ref_id': detail['ref_id'], 'uri': detail['uri'], 'snippet': detail['snippet']}
+                    if self.ttl_seconds:
+                        item['expires_at'] = int(time.time() + self.ttl_seconds)
+                    batch.put_item(Item=item)
+        except Exception as e:
+            # Expansion degrades to this container only; the answer itself is unaffected
+            logger.error(f"Error storing reference details: {str(e)}")
+
+    def get(self, ref_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            detail = self._local.get(ref_id)
+        if detail is not None or self.table is None:
+            return detail
+        item = self.table.get_item(Key={'ref_id': ref_id}).get('Item')
+        if not item:
+            return None
+        detail = {'ref_id': ref_id, 'uri': item['uri'], 'snippet': item['snippet']}
+        self._remember(ref_id, detail)
+        return detail
@@ -0,0 +1,287 @@
+import math
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, List, Optional
+
+import boto3
+
+from tracing import instrument_client
+
+logger = logging.getLogger()
+
+# Errors that are the caller's fault; sending them to another region will not help
+NON_RETRYABLE_ERRORS = {
+    'ValidationException',
+    'AccessDeniedException',
+    'ResourceNotFoundException',
+    'UnrecognizedClientException'
+}
+
+
+def error_code(error: Exception) -> Optional[str]:
+    """The AWS error code of a botocore ClientError, if any"""
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+def is_retryable(error: Exception) -> bool:
+    return error_code(error) not in NON_RETRYABLE_ERRORS
+
+
+class RegionStats:
+    """Rolling latency and error rate of the last `window` calls to one region.
+
+    Calls older than ttl_seconds are forgotten, so a region that was demoted
+    and stopped receiving traffic is tried again once its bad samples expire.
+    """
+
+    def __init__(self, window: int = 50, ttl_seconds: float = 60):
+        self.ttl_seconds = ttl_seconds
+        self._calls = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def record(self, latency_ms: float, success: bool) -> None:
+        with self._lock:
+            self._calls.append((time.monotonic(), latency_ms, success))
+
+    @property
+    def samples(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._calls)
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            self._expire()
+            if not self._calls:
+                return 0.0
+            return sum(1 for _, _, success in self._calls if not success) / len(self._calls)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        with self._lock:
+            self._expire()
+            ordered = sorted(latency for _, latency, success in self._calls if success)
+            if not ordered:
+                return None
+        index = min(len(ordered) - 1, max(0, math.ceil(percentile / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+
+class RegionalClientPool:
+    """Call the same AWS operation across regions with hedging and failover.
+
+    Regions are tried in configured order, with degraded regions (error rate
+    at or above error_rate_threshold, or p95 latency slow_factor times the
+    fastest region's) moved to the back. If the first region has not answered
+    after its own p95 latency, one hedged duplicate goes to the next region
+    and the first response wins. Hedges are paid for from a budget that
+    grows by max_hedge_ratio per call, capping the extra requests at that
+    fraction of traffic. Retryable errors fail over to the next region.
+    Callers with a latency budget set max_hedge_delay_ms below it, so the
+    hedge still has time to answer within the budget.
+
+    The pool exposes the client's operations as attributes, so
+    pool.converse(...) works wherever a bedrock-runtime client is expected.
+    """
+
+    def __init__(self, clients: Dict[str, Any], hedge_percentile: float = 95,
+                 min_hedge_delay_ms: float = 50, initial_hedge_delay_ms: float = 1000,
+                 max_hedge_ratio: float = 0.1, error_rate_threshold: float = 0.5,
+                 slow_factor: float = 3.0, window: int = 50, min_samples: int = 10,
+                 stats_ttl_seconds: float = 60, max_workers: int = 16,
+                 max_hedge_delay_ms: Optional[float] = None):
+        if max_hedge_delay_ms is not None and initial_hedge_delay_ms > max_hedge_delay_ms:
+            raise ValueError(
+                f"initial_hedge_delay_ms ({initial_hedge_delay_ms}) is above max_hedge_delay_ms ({max_hedge_delay_ms})"
+            )
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay_ms = min_hedge_delay_ms
+        self.initial_hedge_delay_ms = initial_hedge_delay_ms
+        self.max_hedge_delay_ms = max_hedge_delay_ms
+        self.max_hedge_ratio = max_hedge_ratio
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_factor = slow_factor
+        self.window = window
+        self.stats_ttl_seconds = stats_ttl_seconds
+        self.min_samples = min_samples
+        self.counters = {'calls': 0, 'hedges': 0, 'failovers': 0, 'hedges_skipped': 0}
+        self.wins = {}
+        self._hedge_tokens = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='region')
+        self.set_clients(clients)
+
+    @classmethod
+    def from_regions(cls, service_name: str, regions: List[Optional[str]], config=None,
+                     **options) -> 'RegionalClientPool':
+        """Create one boto3 client per region; None means the default region"""
+        clients = {
+            region or 'default': boto3.client(service_name=service_name, region_name=region, config=config)
+            for region in regions
+        }
+        for client in clients.values():
+            instrument_client(client)
+        return cls(clients, **options)
+
+    def set_clients(self, clients: Dict[str, Any]) -> None:
+        """Replace the per-region clients and reset their statistics"""
+        self.clients = dict(clients)
+        self.regions = list(self.clients)
+        self.stats = {region: RegionStats(self.window, self.stats_ttl_seconds) for region in self.regions}
+        self.wins = {region: 0 for region in self.regions}
+
+    def __getattr__(self, operation: str):
+        if operation.startswith('_'):
+            raise AttributeError(operation)
+
+        def call_operation(**request):
+            return self.call(operation, **request)
+        return call_operation
+
+    def _is_degraded(self, region: str, fastest_p95: Optional[float]) -> bool:
+        stats = self.stats[region]
+        if stats.samples < self.min_samples:
+            return False
+        if stats.error_rate >= self.error_rate_threshold:
+            return True
+        p95 = stats.percentile(95)
+        return bool(fastest_p95 and p95 and p95 > self.slow_factor * fastest_p95)
+
+    def ordered_regions(self) -> List[str]:
+        """Healthy regions in configured order, then degraded ones"""
+        p95s = [
+            self.stats[region].percentile(95) for region in self.regions
+            if self.stats[region].samples >= self.min_samples
+        ]
+        fastest_p95 = min([p95 for p95 in p95s if p95 is not None], default=None)
+        healthy, degraded = [], []
+        for region in self.regions:
+            (degraded if self._is_degraded(region, fastest_p95) else healthy).append(region)
+        return healthy + degraded
+
+    def hedge_delay_ms(self, region: str) -> float:
+        stats = self.stats[region]
+        observed = stats.percentile(self.hedge_percentile) if stats.samples >= self.min_samples else None
+        if observed is None:
+            return self.initial_hedge_delay_ms
+        delay = max(self.min_hedge_delay_ms, observed)
+        return delay if self.max_hedge_delay_ms is None else min(self.max_hedge_delay_ms, delay)
+
+    def _take_hedge_token(self) -> bool:
+        with self._lock:
+            if self._hedge_tokens >= 1:
+                self._hedge_tokens -= 1
+                self.counters['hedges'] += 1
+                return True
+            self.counters['hedges_skipped'] += 1
+            return False
+
+    def _invoke(self, region: str, operation: str, request: Dict[str, Any]):
+        start = time.perf_counter()
+        try:
+            result = getattr(self.clients[region], operation)(**request)
+        except Exception as e:
+            # Caller errors say nothing about the region's health
+            self.stats[region].record((time.perf_counter() - start) * 1000, not is_retryable(e))
+            raise
+        self.stats[region].record((time.perf_counter() - start) * 1000, True)
+        return result
+
+    def call(self, operation: str, **request):
+        """Run an operation, hedging and failing over across regions"""
+        order = self.ordered_regions()
+        with self._lock:
+            self.counters['calls'] += 1
+            # Refilled at max_hedge_ratio per call, with a burst of at most a few hedges
+            self._hedge_tokens = min(self._hedge_tokens + self.max_hedge_ratio, max(1.0, 10 * self.max_hedge_ratio))
+
+        pending = {}
+        next_index = 0
+
+        def submit():
+            nonlocal next_index
+            region = order[next_index]
+            next_index += 1
+            # In the caller's context, so the call joins the caller's trace
+            pending[self._executor.submit(
+                contextvars.copy_context().run, self._invoke, region, operation, request
+            )] = region
+
+        submit()
+        hedge_at = time.monotonic() + self.hedge_delay_ms(order[0]) / 1000
+        last_error = None
+        while True:
+            can_hedge = hedge_at is not None and next_index < len(order)
+            timeout = max(0.0, hedge_at - time.monotonic()) if can_hedge else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                hedge_at = None
+                if self._take_hedge_token():
+                    logger.info(f"Hedging {operation} to {order[next_index]} after waiting on {order[0]}")
+                    submit()
+                continue
+
+            for future in done:
+                region = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning(f"{operation} failed in {region}: {str(e)}")
+                    last_error = e
+                    continue
+                with self._lock:
+                    self.wins[region] += 1
+                # Slower duplicates still finish in the background and feed the stats
+                return result
+
+            if pending:
+                continue
+            if next_index < len(order) and is_retryable(last_error):
+                with self._lock:
+                    self.counters['failovers'] += 1
+                logger.info(f"Failing over {operation} to {order[next_index]}")
+                submit()
+                # Failover is not hedged again; it is already the slow path
+                hedge_at = None
+                continue
+            raise last_error
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and per-region health for debugging and reports"""
+        with self._lock:
+            counters = dict(self.counters)
+            wins = dict(self.wins)
+        return {
+            **counters,
+            'regions': {
+                region: {
+                    'samples': self.stats[region].samples,
+                    'error_rate': round(self.stats[region].error_rate, 3),
+                    'p50_ms': _round(self.stats[region].percentile(50)),
+                    'p95_ms': _round(self.stats[region].percentile(95)),
+                    'wins': wins[region]
+                }
+                for region in self.regions
+            },
+            'order': self.ordered_regions()
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+def parse_regions(value: Optional[str], default: List[Optional[str]]) -> List[Optional[str]]:
+    """Split a comma-separated region list from the environment"""
+    regions = [region.strip() for region in (value or '').split(',') if region.strip()]
+    return regions or default
@@ -0,0 +1,175 @@
+"""Re-drive captured traffic against lambda_handler.
+
+Reads the records traffic_capture.py writes (JSONL files, or exported logs
+with TRAFFIC_CAPTURE lines), serves every recorded upstream response through
+bedrock_stubs fixtures and sends the captured request envelopes in their
+original order, at the captured pace sped up by --speed (--speed 0 sends
+them as fast as --concurrency allows). Upstream latency is sampled from the
+latencies recorded per operation, unless --latency-profile names a stub
+profile. Upstream calls without a recorded response (for example after a
+change to prompts or retrieval) fall back to synthetic stub responses and
+are counted as fixture misses.
+
+The report puts replay latency, status codes and stage timings next to the
+captured ones, per pipeline mode:
+
+    TRAFFIC_CAPTURE_PATH=captures.jsonl TRAFFIC_CAPTURE_SAMPLE_RATE=1 python local_api_server.py
+    python replay_traffic.py captures.jsonl --speed 2 --output replay.json
+"""
+import os
+import json
+import time
+import argparse
+import logging
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from benchmark_utils import latency_summary, write_report
+from bedrock_stubs import FixtureStore, install_stubs
+from stage_timing import StageTimer
+from traffic_capture import load_captures
+
+
+def build_fixtures(records: List[Dict[str, Any]]) -> FixtureStore:
+    """Recorded upstream responses of every capture, keyed as the stubs look them up"""
+    fixtures = FixtureStore()
+    for record in records:
+        for call in record.get('upstream', []):
+            fixtures.put(call['operation'], call['key'], call['response'])
+    return fixtures
+
+
+def recorded_latency_profile(records: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Stub latency profile sampling the recorded latency of each upstream operation"""
+    samples = defaultdict(list)
+    for record in records:
+        for call in record.get('upstream', []):
+            samples[call['operation']].append(call['latency_ms'])
+    return {
+        operation: {'distribution': 'empirical', 'samples_ms': latencies}
+        for operation, latencies in samples.items()
+    }
+
+
+def replay(lambda_function, records: List[Dict[str, Any]], speed: float, concurrency: int) -> List[Dict[str, Any]]:
+    """Send every captured request at its scheduled time and collect the outcomes"""
+    results = []
+    lock = threading.Lock()
+    first_captured_at = records[0]['captured_at']
+
+    def run(record, due):
+        event = {'body': json.dumps(record['request']), 'headers': record.get('headers', {})}
+        timer = StageTimer()
+        started = time.perf_counter()
+        response = lambda_function.handle_event(event, timer)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            results.append({
+                'record': record,
+                'status_code': response['statusCode'],
+                'latency_ms': elapsed_ms,
+                # How late the request started against the captured schedule
+                'lag_ms': max(0.0, (started - due) * 1000),
+                'stage_timings_ms': timer.as_dict()
+            })
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for record in records:
+            due = start + ((record['captured_at'] - first_captured_at) / speed if speed > 0 else 0)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(run, record, due)
+    return results
+
+
+def summarize(results: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    by_mode = defaultdict(list)
+    for result in results:
+        by_mode[result['record']['request'].get('pipeline_mode', 'default')].append(result)
+
+    modes = {}
+    for mode, mode_results in by_mode.items():
+        captured_stages, replayed_stages = defaultdict(list), defaultdict(list)
+        for result in mode_results:
+            for stage, elapsed in result['record'].get('stage_timings_ms', {}).items():
+                captured_stages[stage].append(elapsed)
+            for stage, elapsed in result['stage_timings_ms'].items():
+                replayed_stages[stage].append(elapsed)
+        modes[mode] = {
+            'requests': len(mode_results),
+            'captured_status_codes': dict(Counter(result['record'].get('status_code') for result in mode_results)),
+            'replayed_status_codes': dict(Counter(result['status_code'] for result in mode_results)),
+            'captured_latency_ms': latency_summary(captured_stages.pop('total', [])),
+            'replayed_latency_ms': latency_summary(replayed_stages.pop('total', [])),
+            'stage_p50_ms': {
+                stage: {
+                    'captured': latency_summary(captured_stages.get(stage, []))['p50'],
+                    'replayed': latency_summary(replayed_stages.get(stage, []))['p50']
+                }
+                for stage in sorted(set(captured_stages) | set(replayed_stages))
+            }
+        }
+    return {
+        'requests': len(results),
+        'requests_per_second': round(len(results) / wall_seconds, 2) if wall_seconds else 0.0,
+        'latency_ms': latency_summary([result['latency_ms'] for result in results]),
+        'schedule_lag_ms': latency_summary([result['lag_ms'] for result in results]),
+        'modes': modes
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic against lambda_handler")
+    parser.add_argument('captures', nargs='+', help="Capture JSONL files or exported logs")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="Replay rate relative to the captured rate (0: as fast as possible)")
+    parser.add_argument('--concurrency', type=int, default=64, help="Most requests in flight")
+    parser.add_argument('--latency-profile', default='recorded',
+                        help="recorded, or a stub profile: realistic, zero or a JSON profile file")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="Multiplier applied to upstream latencies")
+    parser.add_argument('--limit', type=int, help="Replay only the first N captured requests")
+    parser.add_argument('--output', help="Write the report to this file")
+    parser.add_argument('--log-level', default='ERROR')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    records = load_captures(args.captures)[:args.limit]
+    if not records:
+        raise SystemExit("No capture records found")
+
+    os.environ.setdefault('KNOWLEDGE_BASE_ID', 'replay-kb')
+    os.environ.setdefault('FM_ARN', 'arn:aws:bedrock:us-east-1::foundation-model/replay-model')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    # Replaying must not capture the replay
+    os.environ.pop('TRAFFIC_CAPTURE_PATH', None)
+    import lambda_function
+    logging.getLogger().setLevel(args.log_level)
+
+    profile = recorded_latency_profile(records) if args.latency_profile == 'recorded' else args.latency_profile
+    stubs = install_stubs(lambda_function, latency_profile=profile, fixtures=build_fixtures(records),
+                          time_scale=args.time_scale)
+
+    started = time.perf_counter()
+    results = replay(lambda_function, records, args.speed, args.concurrency)
+    report = {
+        'config': {
+            'captures': args.captures,
+            'speed': args.speed,
+            'concurrency': args.concurrency,
+            'latency_profile': args.latency_profile,
+            'time_scale': args.time_scale,
+            'captured_seconds': round(records[-1]['captured_at'] - records[0]['captured_at'], 3)
+        },
+        **summarize(results, time.perf_counter() - started),
+        'fixture_hits': dict(sum((stub.fixture_hits for stub in stubs.values()), Counter())),
+        'fixture_misses': dict(sum((stub.fixture_misses for stub in stubs.values()), Counter()))
+    }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import io
+import json
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger()
+
+
+class RerankBatcher:
+    """Micro-batch concurrent Cohere rerank invoke_model calls on an event loop.
+
+    Wraps the rerank client used by CohereReranker. Calls made from worker
+    threads are collected for window_ms; calls in a window that rerank for
+    the same model and query are sent as one invoke_model over the union of
+    their documents, and each caller gets back a response for its own
+    documents. Cohere Rerank scores one query per call, so calls for
+    different queries still go out separately, dispatched together when the
+    window closes. Other attributes are passed through to the client.
+    """
+
+    def __init__(self, client, loop: asyncio.AbstractEventLoop, window_ms: float = 5,
+                 max_documents: int = 1000, executor=None):
+        self.client = client
+        self.loop = loop
+        self.window = window_ms / 1000
+        self.max_documents = max_documents
+        self.executor = executor
+        self.counters = {'calls': 0, 'invocations': 0, 'merged_calls': 0, 'largest_batch': 0}
+        self._pending: List[Tuple[Dict[str, Any], Dict[str, Any], asyncio.Future]] = []
+        self._flush_handle = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def invoke_model(self, **request) -> Dict[str, Any]:
+        """Blocking invoke_model for worker threads, answered from a batched call"""
+        if self._on_loop_thread():
+            # Waiting here would block the loop that runs the batch
+            return self.client.invoke_model(**request)
+        return asyncio.run_coroutine_threadsafe(self._submit(request), self.loop).result()
+
+    def _on_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    async def _submit(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        future = self.loop.create_future()
+        self._pending.append((request, json.loads(request['body']), future))
+        self._count('calls')
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        pending, self._pending = self._pending, []
+        self._flush_handle = None
+        groups = OrderedDict()
+        for entry in pending:
+            request, body, _ = entry
+            key = (request['modelId'], body['query'], body.get('api_version'))
+            groups.setdefault(key, []).append(entry)
+        for entries in groups.values():
+            for batch in self._split(entries):
+                self.loop.create_task(self._dispatch(batch))
+
+    def _split(self, entries):
+        """Batches whose combined documents stay within max_documents"""
+        batch, documents = [], set()
+        for entry in entries:
+            entry_documents = set(entry[1]['documents'])
+            if batch and len(documents | entry_documents) > self.max_documents:
+                yield batch
+                batch, documents = [], set()
+            batch.append(entry)
+            documents |= entry_documents
+        if batch:
+            yield batch
+
+    async def _dispatch(self, batch) -> None:
+        request, body, _ = batch[0]
+        documents = list(OrderedDict.fromkeys(
+            document for _, entry_body, _ in batch for document in entry_body['documents']
+        ))
+        merged_body = {**body, 'documents': documents, 'top_n': len(documents)}
+        with self._lock:
+            self.counters['invocations'] += 1
+            self.counters['merged_calls'] += len(batch) - 1
+            self.counters['largest_batch'] = max(self.counters['largest_batch'], len(batch))
+        try:
+            response = await self.loop.run_in_executor(
+                self.executor, lambda: self.client.invoke_model(**{**request, 'body': json.dumps(merged_body)})
+            )
+            results = json.loads(response['body'].read()).get('results', [])
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        scores = {documents[result['index']]: result.get('relevance_score', 0) for result in results}
+        for _, entry_body, future in batch:
+            entry_results = [
+                {'index': index, 'relevance_score': scores.get(document, 0.0)}
+                for index, document in enumerate(entry_body['documents'])
+            ]
+            entry_results.sort(key=lambda result: result['relevance_score'], reverse=True)
+            entry_results = entry_results[:entry_body.get('top_n', len(entry_results))]
+            if not future.done():
+                future.set_result({'body': io.BytesIO(json.dumps({'results': entry_results}).encode())})
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters)
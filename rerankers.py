@@ -0,0 +1,275 @@
+import json
+import math
+import time
+import logging
+import threading
+import contextvars
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, List, Tuple, Dict, Any, Optional
+
+from query_features import tokenize, STOPWORDS
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, BM25 falls back to plain Python
+    np = None
+
+logger = logging.getLogger()
+
+
+class Reranker:
+    """Score documents against a query.
+
+    rerank() returns one relevance score per document, in document order,
+    normalized to 0..1 so RELEVANCE_THRESHOLD applies whatever the backend.
+    """
+
+    name = 'reranker'
+
+    def rerank(self, query: str, documents: List[str]) -> List[float]:
+        raise NotImplementedError
+
+    def rerank_with_info(self, query: str, documents: List[str]) -> Tuple[List[float], Dict[str, Any]]:
+        """Return scores and which reranker produced them"""
+        return self.rerank(query, documents), {'source': self.name}
+
+
+class CohereReranker(Reranker):
+    """Cohere Rerank on Bedrock.
+
+    get_client returns the bedrock-runtime client to call, looked up on every
+    request so the client can be swapped (stubs, region failover) at runtime.
+    """
+
+    name = 'cohere'
+
+    def __init__(self, get_client: Callable, model_id: str = 'cohere.rerank-v3-5:0'):
+        self.get_client = get_client
+        self.model_id = model_id
+
+    def rerank(self, query: str, documents: List[str]) -> List[float]:
+        request_body = {
+            "query": query,
+            "documents": documents,
+            "top_n": len(documents),
+            "api_version": 2
+        }
+        logger.info(f"Rerank request body: {json.dumps(request_body)}")
+
+        response = self.get_client().invoke_model(
+            modelId=self.model_id,
+            contentType="application/json",
+            accept="*/*",
+            body=json.dumps(request_body)
+        )
+        response_body = json.loads(response['body'].read())
+        logger.info(f"Rerank response: {json.dumps(response_body)}")
+
+        scores = [0.0] * len(documents)
+        for result in response_body.get('results', []):
+            scores[result.get('index', 0)] = result.get('relevance_score', 0)
+        return scores
+
+
+class BM25Reranker(Reranker):
+    """In-process BM25 over the candidate snippets.
+
+    Scores are calibrated to RELEVANCE_THRESHOLD the way Cohere's are: they
+    are divided by the score of a document of average length containing
+    every query term once, and capped at 1. That document scores 1.0, and a
+    partial match scores the IDF-weighted share of the query terms it has,
+    so one of two terms (0.5) is kept at the default 0.3 threshold and one
+    of four (0.25) is not. Without the calibration an on-topic document
+    scored about 1 / (k1 + 1) and most references were filtered out
+    whenever the fallback was in use.
+    """
+
+    name = 'bm25'
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def rerank(self, query: str, documents: List[str]) -> List[float]:
+        query_terms = sorted({token for token in tokenize(query) if token not in STOPWORDS})
+        if not documents or not query_terms:
+            return [0.0] * len(documents)
+
+        term_counts = [Counter(tokenize(document)) for document in documents]
+        lengths = [sum(counts.values()) for counts in term_counts]
+        if np is not None:
+            return self._score_numpy(query_terms, term_counts, lengths)
+        return self._score_python(query_terms, term_counts, lengths)
+
+    def _idf(self, document_frequency: float, documents: int) -> float:
+        return math.log(1 + (documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def _score_numpy(self, query_terms, term_counts, lengths) -> List[float]:
+        tf = np.array([[counts.get(term, 0) for term in query_terms] for counts in term_counts], dtype=float)
+        length = np.array(lengths, dtype=float)
+        average_length = max(length.mean(), 1.0)
+
+        document_frequency = (tf > 0).sum(axis=0)
+        idf = np.log(1 + (len(term_counts) - document_frequency + 0.5) / (document_frequency + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * length / average_length)
+        scores = (idf * tf * (self.k1 + 1) / (tf + norm[:, None])).sum(axis=1)
+
+        reference = float(idf.sum())
+        return [min(1.0, float(score) / reference) for score in scores] if reference > 0 else [0.0] * len(lengths)
+
+    def _score_python(self, query_terms, term_counts, lengths) -> List[float]:
+        average_length = max(sum(lengths) / len(lengths), 1.0)
+        idf = {
+            term: self._idf(sum(1 for counts in term_counts if term in counts), len(term_counts))
+            for term in query_terms
+        }
+        # Score of an average-length document containing each query term once
+        reference = sum(idf.values())
+        scores = []
+        for counts, length in zip(term_counts, lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / average_length)
+            score = sum(
+                idf[term] * counts[term] * (self.k1 + 1) / (counts[term] + norm)
+                for term in query_terms if term in counts
+            )
+            scores.append(min(1.0, score / reference) if reference > 0 else 0.0)
+        return scores
+
+
+class CircuitBreaker:
+    """Trip after too many failed or slow calls in a rolling window.
+
+    closed:    calls go to the primary
+    open:      calls skip the primary until cooldown_seconds have passed
+    half_open: one probe call is let through; success closes the breaker,
+               failure opens it again
+    """
+
+    def __init__(self, window: int = 20, min_calls: int = 5,
+                 error_rate_threshold: float = 0.5, cooldown_seconds: float = 30):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._outcomes = deque(maxlen=window)
+        self._state = 'closed'
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == 'open' and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+                self._state = 'half_open'
+            return self._state
+
+    def allow(self) -> bool:
+        """Whether the next call may go to the primary"""
+        state = self.state
+        with self._lock:
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            if self._state == 'half_open':
+                self._probe_in_flight = False
+                if success:
+                    self._state = 'closed'
+                    self._outcomes.clear()
+                else:
+                    self._trip()
+                return
+
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.error_rate_threshold):
+                self._trip()
+
+    def _trip(self) -> None:
+        logger.warning("Reranker circuit breaker opened")
+        self._state = 'open'
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'recent_calls': len(self._outcomes),
+                'recent_failures': self._outcomes.count(False)
+            }
+
+
+class FallbackReranker(Reranker):
+    """Use the primary reranker within a latency budget, the fallback otherwise"""
+
+    name = 'fallback'
+
+    def __init__(self, primary: Reranker, fallback: Reranker, breaker: CircuitBreaker,
+                 latency_budget_ms: float = 800):
+        self.primary = primary
+        self.fallback = fallback
+        self.breaker = breaker
+        self.latency_budget_ms = latency_budget_ms
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='rerank')
+
+    def rerank_with_info(self, query: str, documents: List[str]) -> Tuple[List[float], Dict[str, Any]]:
+        """Return scores and which reranker produced them"""
+        reason = None
+        if self.breaker.allow():
+            start = time.perf_counter()
+            # Run in the request's context so per-request state (traffic capture) follows the call
+            future = self._executor.submit(contextvars.copy_context().run, self.primary.rerank, query, documents)
+            try:
+                scores = future.result(timeout=self.latency_budget_ms / 1000)
+                self.breaker.record(True)
+                return scores, {
+                    'source': self.primary.name,
+                    'latency_ms': round((time.perf_counter() - start) * 1000, 3),
+                    'breaker': self.breaker.snapshot()
+                }
+            except FutureTimeoutError:
+                # The call keeps running in the background; its result is discarded
+                reason = f"{self.primary.name} exceeded {self.latency_budget_ms:.0f} ms budget"
+            except Exception as e:
+                reason = f"{self.primary.name} failed: {str(e)}"
+            self.breaker.record(False)
+            logger.warning(f"Falling back to {self.fallback.name} reranker: {reason}")
+        else:
+            reason = 'circuit open'
+
+        scores = self.fallback.rerank(query, documents)
+        return scores, {
+            'source': self.fallback.name,
+            'reason': reason,
+            'breaker': self.breaker.snapshot()
+        }
+
+    def rerank(self, query: str, documents: List[str]) -> List[float]:
+        return self.rerank_with_info(query, documents)[0]
+
+
+def build_reranker(mode: str, get_client: Callable, model_id: str, latency_budget_ms: float,
+                   breaker: Optional[CircuitBreaker] = None) -> Reranker:
+    """Build the reranker selected by RERANKER: cohere, bm25 or auto"""
+    if mode == 'cohere':
+        return CohereReranker(get_client, model_id)
+    if mode == 'bm25':
+        return BM25Reranker()
+    if mode == 'auto':
+        return FallbackReranker(
+            CohereReranker(get_client, model_id),
+            BM25Reranker(),
+            breaker or CircuitBreaker(),
+            latency_budget_ms
+        )
+    raise ValueError(f"Unknown reranker: {mode}")
@@ -0,0 +1,324 @@
+"""Per-rerun timing of the Streamlit app's phases, with optional sampled profiling.
+
+Every rerun times its phases (component construction, sidebar, transcript,
+chat turn ...) with a StageTimer and adds them to per-phase histograms shared
+by all sessions of the process. The histograms are logged every
+RERUN_METRICS_REPORT_SECONDS and, with RERUN_METRICS_PATH set, written there
+as JSON, sorted by the share of rendering time each phase takes. The
+chat turn mostly waits on the API, so it is reported on its own and
+rendering time is the rerun total without it.
+
+Profiling is off by default. Users listed in RERUN_PROFILER_ADMINS get a
+Performance panel in the sidebar to profile their own reruns, and
+RERUN_PROFILE_SAMPLE_RATE profiles that share of all reruns.
+RERUN_PROFILER picks the profiler: cprofile (deterministic, higher overhead)
+or sampler (samples the script thread's stack every
+RERUN_SAMPLER_INTERVAL_MS). With RERUN_PROFILE_DIR set, every profile is
+saved there (.prof for cProfile, collapsed stacks for flame graphs otherwise).
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import pstats
+import bisect
+import cProfile
+import logging
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import streamlit as st
+
+from auth_handler import stable_user_id
+from stage_timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets in milliseconds; slower phases land in an overflow bucket
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+PROFILE_TOGGLE_KEY = 'rerun_profiling'
+LAST_PROFILE_KEY = '_last_rerun_profile'
+
+
+class PhaseHistogram:
+    """Count and bucketed durations of one phase"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float) -> None:
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.sum_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return float(min(bound, self.max_ms))
+        return self.max_ms
+
+    def as_dict(self) -> Dict[str, Any]:
+        labels = [f"le_{bound}" for bound in BUCKET_BOUNDS_MS] + ['inf']
+        return {
+            'count': self.count,
+            'sum_ms': round(self.sum_ms, 3),
+            'mean_ms': round(self.sum_ms / self.count, 3) if self.count else 0.0,
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'max_ms': round(self.max_ms, 3),
+            'buckets': dict(zip(labels, self.buckets))
+        }
+
+
+# Phases that wait on the API rather than render, kept out of the rendering shares
+WAITING_PHASES = ('chat_turn',)
+
+
+class RerunMetricsRegistry:
+    """Per-phase histograms of every rerun served by this process"""
+
+    def __init__(self):
+        self.phases = {}
+        self.reruns = 0
+        self._reported_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, timings: Dict[str, float]) -> None:
+        with self._lock:
+            self.reruns += 1
+            for phase, elapsed_ms in timings.items():
+                self.phases.setdefault(phase, PhaseHistogram()).observe(elapsed_ms)
+
+    def report(self) -> Dict[str, Any]:
+        """Histograms by phase, the phases taking most of the rendering time first"""
+        with self._lock:
+            phases = {phase: histogram.as_dict() for phase, histogram in self.phases.items()}
+            reruns = self.reruns
+        total = phases.pop('total', None)
+        waiting = {phase: phases.pop(phase) for phase in WAITING_PHASES if phase in phases}
+        rendering_ms = (total['sum_ms'] if total else 0.0) - sum(histogram['sum_ms'] for histogram in waiting.values())
+        for histogram in phases.values():
+            histogram['share_of_rendering'] = round(histogram['sum_ms'] / rendering_ms, 4) if rendering_ms > 0 else 0.0
+        return {
+            'reruns': reruns,
+            'total': total,
+            'rendering_ms': round(rendering_ms, 3),
+            'waiting': waiting,
+            'phases': dict(sorted(phases.items(), key=lambda item: item[1]['sum_ms'], reverse=True))
+        }
+
+    def export(self, interval_seconds: float, path: Optional[str] = None) -> None:
+        """Log the report, and write it to path, at most once per interval_seconds"""
+        with self._lock:
+            if time.monotonic() - self._reported_at < interval_seconds:
+                return
+            self._reported_at = time.monotonic()
+        report = self.report()
+        logger.info(f"Rerun phases: {json.dumps(report)}")
+        if path:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(report, f, indent=2)
+            os.replace(tmp_path, path)
+
+
+@st.cache_resource
+def shared_rerun_registry() -> RerunMetricsRegistry:
+    """One registry per process, shared by all sessions"""
+    return RerunMetricsRegistry()
+
+
+class StackSampler:
+    """Sample one thread's Python stack on a background thread.
+
+    Cheaper than cProfile on deep call trees, at the cost of missing
+    anything shorter than the sampling interval.
+    """
+
+    def __init__(self, interval_seconds: float = 0.005):
+        self.interval_seconds = interval_seconds
+        self.stacks = Counter()
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self) -> None:
+        self._thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name='rerun-stack-sampler', daemon=True)
+        self._thread.start()
+
+    def disable(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def summary(self, limit: int = 20) -> str:
+        """Functions by the share of samples spent in them, then in their callees"""
+        total = sum(self.stacks.values())
+        inclusive, own = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            for frame in set(frames):
+                inclusive[frame] += count
+            own[frames[-1]] += count
+        lines = [f"{total} samples every {self.interval_seconds * 1000:g} ms", f"{'total':>7} {'self':>7}  function"]
+        ranked = sorted(inclusive, key=lambda frame: (own[frame], inclusive[frame]), reverse=True)
+        for frame in ranked[:limit]:
+            lines.append(f"{inclusive[frame] / total:>7.1%} {own[frame] / total:>7.1%}  {frame}")
+        return '\n'.join(lines)
+
+    def dump(self, path: str) -> None:
+        """Collapsed stacks, the input format of flamegraph.pl and speedscope"""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{stack} {count}\n")
+
+
+class CProfileProfiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def enable(self) -> None:
+        self.profile.enable()
+
+    def disable(self) -> None:
+        self.profile.disable()
+
+    def summary(self, limit: int = 20) -> str:
+        output = io.StringIO()
+        pstats.Stats(self.profile, stream=output).sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
+
+    def dump(self, path: str) -> None:
+        self.profile.dump_stats(path)
+
+
+# File extension of saved profiles, by RERUN_PROFILER
+PROFILE_EXTENSIONS = {'cprofile': 'prof', 'sampler': 'folded'}
+
+
+def is_profiler_admin() -> bool:
+    """Whether the logged-in user is listed in RERUN_PROFILER_ADMINS"""
+    user_id = st.session_state.get('user_id')
+    admins = [name.strip() for name in os.getenv('RERUN_PROFILER_ADMINS', '').split(',') if name.strip()]
+    return bool(user_id) and any(stable_user_id(name) == user_id for name in admins)
+
+
+class RerunProfiler:
+    """Time the phases of one rerun and profile it when sampled or requested"""
+
+    def __init__(self, registry: Optional[RerunMetricsRegistry] = None):
+        self.registry = registry or shared_rerun_registry()
+        self.timer = StageTimer()
+        self.report_seconds = float(os.getenv('RERUN_METRICS_REPORT_SECONDS', 300))
+        self.metrics_path = os.getenv('RERUN_METRICS_PATH')
+        self.profile_dir = os.getenv('RERUN_PROFILE_DIR')
+        self.profiler = None
+        self._profiler_name = os.getenv('RERUN_PROFILER', 'cprofile')
+        # The toggle is read at the start of the run, so a change applies from the next rerun
+        self._requested = bool(st.session_state.get(PROFILE_TOGGLE_KEY))
+        if self._requested or random.random() < float(os.getenv('RERUN_PROFILE_SAMPLE_RATE', 0)):
+            self._start_profiler()
+
+    def phase(self, name: str):
+        """Time the enclosed block as the named phase"""
+        return self.timer.stage(name)
+
+    def _start_profiler(self) -> None:
+        if self._profiler_name not in PROFILE_EXTENSIONS:
+            logger.error(f"Unknown RERUN_PROFILER {self._profiler_name}, profiling is off")
+            return
+        if self._profiler_name == 'sampler':
+            profiler = StackSampler(float(os.getenv('RERUN_SAMPLER_INTERVAL_MS', 5)) / 1000)
+        else:
+            profiler = CProfileProfiler()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # cProfile refuses to start while another profiler is active in this thread
+            logger.warning(f"Could not start the rerun profiler: {str(e)}")
+            return
+        self.profiler = profiler
+
+    def finish(self) -> Dict[str, float]:
+        """Stop profiling, record the rerun's phase timings and return them"""
+        timings = self.timer.as_dict()
+        try:
+            if self.profiler is not None:
+                self.profiler.disable()
+                self._save_profile(timings)
+            self.registry.record(timings)
+            self.registry.export(self.report_seconds, self.metrics_path)
+        except Exception as e:
+            # Instrumentation must never break the page
+            logger.error(f"Error recording rerun metrics: {str(e)}")
+        return timings
+
+    def _save_profile(self, timings: Dict[str, float]) -> None:
+        summary = self.profiler.summary()
+        if self._requested:
+            st.session_state[LAST_PROFILE_KEY] = {'timings_ms': timings, 'summary': summary}
+        if self.profile_dir:
+            path = os.path.join(self.profile_dir, f"rerun-{int(time.time() * 1000)}-{os.getpid()}."
+                                f"{PROFILE_EXTENSIONS[self._profiler_name]}")
+            self.profiler.dump(path)
+            logger.info(f"Saved rerun profile to {path}")
+
+    def display_admin_panel(self) -> None:
+        """Sidebar panel for profiler admins: profiling toggle, last profile and phase histograms"""
+        if not is_profiler_admin():
+            return
+        with st.sidebar:
+            with st.expander("⏱ Performance"):
+                st.checkbox("Profile my reruns", key=PROFILE_TOGGLE_KEY,
+                            help=f"Profiles each rerun with {self._profiler_name}, from the next rerun on")
+                last_profile = st.session_state.get(LAST_PROFILE_KEY)
+                if last_profile:
+                    st.caption("Last profiled rerun (ms)")
+                    st.json(last_profile['timings_ms'], expanded=False)
+                    st.code(last_profile['summary'], language=None)
+                report = self.registry.report()
+                st.caption(f"Phases over {report['reruns']} reruns in this process")
+                st.dataframe(self._phase_rows(report), hide_index=True, use_container_width=True)
+
+    @staticmethod
+    def _phase_rows(report: Dict[str, Any]) -> List[Dict[str, Any]]:
+        rows = [
+            {'phase': phase, 'share': histogram['share_of_rendering'], 'count': histogram['count'],
+             'p50_ms': histogram['p50_ms'], 'p95_ms': histogram['p95_ms'], 'max_ms': histogram['max_ms']}
+            for phase, histogram in report['phases'].items()
+        ]
+        # Shares are of rendering time, which leaves these out
+        rows.extend(
+            {'phase': phase, 'share': None, 'count': histogram['count'], 'p50_ms': histogram['p50_ms'],
+             'p95_ms': histogram['p95_ms'], 'max_ms': histogram['max_ms']}
+            for phase, histogram in report['waiting'].items()
+        )
+        if report['total']:
+            total = report['total']
+            rows.append({'phase': 'total', 'share': None, 'count': total['count'], 'p50_ms': total['p50_ms'],
+                         'p95_ms': total['p95_ms'], 'max_ms': total['max_ms']})
+        return rows
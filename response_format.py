@@ -0,0 +1,71 @@
+import gzip
+import json
+import base64
+from typing import Any, Dict, List, Tuple
+
+from reference_store import reference_id
+
+# Reference fields the chat UI renders; everything else stays server-side in compact mode
+COMPACT_REFERENCE_FIELDS = ('uri', 'presigned_url')
+
+# How much of each reference a compact response carries
+REFERENCE_DETAIL_MODES = ('preview', 'on_demand')
+
+
+def snippet_preview(snippet: str, max_chars: int) -> Tuple[str, bool]:
+    """Cut a snippet at a word boundary; returns the preview and whether it was truncated"""
+    if len(snippet) <= max_chars:
+        return snippet, False
+    cut = snippet.rfind(' ', 0, max_chars)
+    return snippet[:cut if cut > max_chars // 2 else max_chars].rstrip() + ' ...', True
+
+
+def compact_response_body(body: Dict[str, Any], preview_chars: int,
+                          reference_detail: str = 'on_demand') -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Keep only what the UI renders; returns the compact body and the reference details to store.
+
+    With reference_detail='on_demand' references are stubs (ref_id and uri);
+    with 'preview' they also carry a snippet preview. Details are kept for
+    all of them, since compact references are presigned when opened.
+    """
+    references = []
+    details = []
+    for ref in body.get('detailed_references', []):
+        ref_id = reference_id(ref)
+        detail = {'ref_id': ref_id, 'uri': ref.get('uri', ''), 'snippet': ref.get('snippet', '')}
+        details.append(detail)
+        if reference_detail == 'on_demand':
+            references.append({'ref_id': ref_id, 'uri': detail['uri']})
+            continue
+        preview, truncated = snippet_preview(detail['snippet'], preview_chars)
+        compact_ref = {field: ref[field] for field in COMPACT_REFERENCE_FIELDS if field in ref}
+        compact_ref.update(ref_id=ref_id, snippet=preview)
+        if truncated:
+            compact_ref['snippet_truncated'] = True
+        references.append(compact_ref)
+
+    compact = {
+        'generated_response': body['generated_response'],
+        'detailed_references': references,
+        'sessionId': body.get('sessionId')
+    }
+    if body.get('validation_status') == 'warning':
+        compact['validation_status'] = 'warning'
+        compact['validation_message'] = body.get('validation_message', '')
+    if body.get('coalesced'):
+        compact['coalesced'] = True
+    return compact, details
+
+
+def encode_compact_body(body: Dict[str, Any], accept_gzip: bool, gzip_min_bytes: int) -> Dict[str, Any]:
+    """Response fields for a compact body: a JSON object, or base64 gzip when large and accepted"""
+    if accept_gzip:
+        encoded = json.dumps(body, separators=(',', ':')).encode('utf-8')
+        if len(encoded) >= gzip_min_bytes:
+            return {
+                'headers': {'Content-Encoding': 'gzip'},
+                'isBase64Encoded': True,
+                'body': base64.b64encode(gzip.compress(encoded)).decode('ascii')
+            }
+    # Left as an object, the body is encoded once with the rest of the response
+    return {'headers': {}, 'isBase64Encoded': False, 'body': body}
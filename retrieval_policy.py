@@ -0,0 +1,168 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, List
+
+from query_features import extract_query_features, jaccard_similarity
+
+logger = logging.getLogger()
+
+VALID_SEARCH_TYPES = ('SEMANTIC', 'HYBRID')
+
+
+class RetrievalPolicy:
+    """Choose retrieval depth and search type for each query.
+
+    Queries are classified from cheap lexical features:
+      - keyword:   short lookups ("leave policy") get the minimum depth and a
+                   plain semantic search
+      - specific:  well-formed single questions get the default depth
+      - ambiguous: comparisons, vague follow-ups and long multi-part questions
+                   get the maximum depth with hybrid search
+
+    The class-based plan is then corrected with the rerank outcomes of recent
+    similar queries kept in a per-container history.
+    """
+
+    def __init__(self, mode: str = 'adaptive', relevance_threshold: float = 0.3,
+                 default_results: int = 5, min_results: int = 3, max_results: int = 10,
+                 keyword_search_type: str = 'SEMANTIC', default_search_type: str = 'SEMANTIC',
+                 ambiguous_search_type: str = 'HYBRID', fixed_search_type: str = 'HYBRID',
+                 keyword_max_tokens: int = 3, ambiguous_min_terms: int = 12,
+                 history_size: int = 200, history_ttl: int = 3600,
+                 similarity_threshold: float = 0.5, min_history_samples: int = 3):
+        self.mode = mode
+        self.relevance_threshold = relevance_threshold
+        self.default_results = default_results
+        self.min_results = min_results
+        self.max_results = max_results
+        self.keyword_search_type = keyword_search_type
+        self.default_search_type = default_search_type
+        self.ambiguous_search_type = ambiguous_search_type
+        self.fixed_search_type = fixed_search_type
+        self.keyword_max_tokens = keyword_max_tokens
+        self.ambiguous_min_terms = ambiguous_min_terms
+        self.history_ttl = history_ttl
+        self.similarity_threshold = similarity_threshold
+        self.min_history_samples = min_history_samples
+        self._history = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+
+        for search_type in (keyword_search_type, default_search_type,
+                            ambiguous_search_type, fixed_search_type):
+            if search_type not in VALID_SEARCH_TYPES:
+                raise ValueError(f"Invalid search type: {search_type}")
+
+    @classmethod
+    def from_env(cls, relevance_threshold: float) -> 'RetrievalPolicy':
+        """Build a policy from RETRIEVAL_* environment variables"""
+        return cls(
+            mode=os.environ.get('RETRIEVAL_POLICY', 'adaptive'),
+            relevance_threshold=relevance_threshold,
+            default_results=int(os.environ.get('RETRIEVAL_DEFAULT_RESULTS', 5)),
+            min_results=int(os.environ.get('RETRIEVAL_MIN_RESULTS', 3)),
+            max_results=int(os.environ.get('RETRIEVAL_MAX_RESULTS', 10)),
+            keyword_search_type=os.environ.get('RETRIEVAL_KEYWORD_SEARCH_TYPE', 'SEMANTIC'),
+            default_search_type=os.environ.get('RETRIEVAL_DEFAULT_SEARCH_TYPE', 'SEMANTIC'),
+            ambiguous_search_type=os.environ.get('RETRIEVAL_AMBIGUOUS_SEARCH_TYPE', 'HYBRID'),
+            fixed_search_type=os.environ.get('RETRIEVAL_FIXED_SEARCH_TYPE', 'HYBRID'),
+            keyword_max_tokens=int(os.environ.get('RETRIEVAL_KEYWORD_MAX_TOKENS', 3)),
+            ambiguous_min_terms=int(os.environ.get('RETRIEVAL_AMBIGUOUS_MIN_TERMS', 12)),
+            history_size=int(os.environ.get('RETRIEVAL_HISTORY_SIZE', 200)),
+            history_ttl=int(os.environ.get('RETRIEVAL_HISTORY_TTL', 3600))
+        )
+
+    def classify(self, features: Dict[str, Any]) -> str:
+        """Classify a query as keyword, specific or ambiguous"""
+        vague_follow_up = features['has_vague_reference'] and features['term_count'] <= 2
+        if (features['has_conjunction'] or vague_follow_up
+                or features['question_marks'] > 1
+                or features['term_count'] >= self.ambiguous_min_terms):
+            return 'ambiguous'
+        if not features['is_question'] and features['token_count'] <= self.keyword_max_tokens:
+            return 'keyword'
+        return 'specific'
+
+    def choose(self, user_query: str) -> Dict[str, Any]:
+        """Return the retrieval plan for a query"""
+        if self.mode != 'adaptive':
+            return {
+                'mode': self.mode,
+                'number_of_results': self.default_results,
+                'search_type': self.fixed_search_type,
+                'query_class': None,
+                'reason': 'fixed policy'
+            }
+
+        features = extract_query_features(user_query)
+        query_class = self.classify(features)
+
+        if query_class == 'keyword':
+            number_of_results, search_type = self.min_results, self.keyword_search_type
+        elif query_class == 'ambiguous':
+            number_of_results, search_type = self.max_results, self.ambiguous_search_type
+        else:
+            number_of_results, search_type = self.default_results, self.default_search_type
+        reason = f"{query_class} query"
+
+        similar = self._similar_history(features['terms'])
+        plan = {
+            'mode': self.mode,
+            'query_class': query_class,
+            'history_samples': len(similar)
+        }
+
+        if len(similar) >= self.min_history_samples:
+            avg_kept = sum(entry['kept'] for entry in similar) / len(similar)
+            avg_top_score = sum(entry['top_score'] for entry in similar) / len(similar)
+            all_kept = all(entry['kept'] >= entry['fetched'] for entry in similar)
+            plan['avg_kept'] = round(avg_kept, 2)
+            plan['avg_top_score'] = round(avg_top_score, 3)
+
+            if avg_top_score < self.relevance_threshold and search_type != 'HYBRID':
+                # Semantic search has not been finding anything useful for
+                # queries like this one, let the keyword leg help
+                search_type = 'HYBRID'
+                reason += ', escalated to hybrid after low rerank scores'
+            if all_kept:
+                number_of_results += 2
+                reason += ', widened because similar queries kept every result'
+            else:
+                # Fetch a little more than what similar queries actually kept
+                narrowed = max(self.min_results, math.ceil(avg_kept) + 1)
+                if narrowed < number_of_results:
+                    number_of_results = narrowed
+                    reason += ', narrowed to what similar queries kept'
+
+        plan['number_of_results'] = max(self.min_results, min(self.max_results, number_of_results))
+        plan['search_type'] = search_type
+        plan['reason'] = reason
+        return plan
+
+    def record_outcome(self, user_query: str, fetched: int, kept: int, top_score: float) -> None:
+        """Remember how many fetched references survived reranking"""
+        if self.mode != 'adaptive' or fetched <= 0:
+            return
+        entry = {
+            'terms': extract_query_features(user_query)['terms'],
+            'fetched': fetched,
+            'kept': kept,
+            'top_score': top_score,
+            'recorded_at': time.time()
+        }
+        with self._lock:
+            self._history.append(entry)
+
+    def _similar_history(self, terms) -> List[Dict[str, Any]]:
+        """Return recent history entries whose terms overlap the query terms"""
+        cutoff = time.time() - self.history_ttl
+        with self._lock:
+            entries = list(self._history)
+        return [
+            entry for entry in entries
+            if entry['recorded_at'] >= cutoff
+            and jaccard_similarity(terms, entry['terms']) >= self.similarity_threshold
+        ]
@@ -0,0 +1,101 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from query_features import content_terms, extract_query_features, jaccard_similarity
+
+logger = logging.getLogger()
+
+
+class SessionContextCache:
+    """Last turn's retrieved passages per session, for follow-up questions.
+
+    lookup() compares a new query with the session's previous one:
+      - reuse: term overlap >= reuse_threshold, answer from the cached passages
+      - merge: overlap >= merge_threshold, or the query leans on the previous
+               turn ("what about for contractors?", "does it apply to them?");
+               retrieve fresh and merge with the cached passages
+      - miss:  unrelated question, expired entry or unknown session
+
+    Entries expire ttl_seconds after the retrieval that produced them, so a
+    chain of reused turns never serves passages older than that.
+    """
+
+    def __init__(self, ttl_seconds: float = 300, max_sessions: int = 1000,
+                 reuse_threshold: float = 0.6, merge_threshold: float = 0.25):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.reuse_threshold = reuse_threshold
+        self.merge_threshold = merge_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'SessionContextCache':
+        return cls(
+            ttl_seconds=float(os.environ.get('SESSION_CONTEXT_TTL_SECONDS', 300)),
+            max_sessions=int(os.environ.get('SESSION_CONTEXT_MAX_SESSIONS', 1000)),
+            reuse_threshold=float(os.environ.get('SESSION_CONTEXT_REUSE_THRESHOLD', 0.6)),
+            merge_threshold=float(os.environ.get('SESSION_CONTEXT_MERGE_THRESHOLD', 0.25))
+        )
+
+    def _get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if entry['expires_at'] <= time.monotonic():
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return entry
+
+    def lookup(self, session_id: Optional[str], user_query: str) -> Dict[str, Any]:
+        """Decide whether a query can reuse the session's cached passages"""
+        entry = self._get(session_id) if session_id else None
+        if entry is None:
+            return {'action': 'miss', 'passages': []}
+
+        similarity = jaccard_similarity(content_terms(user_query), entry['terms'])
+        follow_up = extract_query_features(user_query)['has_vague_reference']
+        if similarity >= self.reuse_threshold:
+            action = 'reuse'
+        elif similarity >= self.merge_threshold or follow_up:
+            action = 'merge'
+        else:
+            action = 'miss'
+
+        return {
+            'action': action,
+            'similarity': round(similarity, 3),
+            'follow_up': follow_up,
+            'age_seconds': round(time.monotonic() - entry['stored_at'], 1),
+            'passages': entry['passages'] if action != 'miss' else []
+        }
+
+    def store(self, session_id: str, user_query: str, passages: List[Dict[str, Any]]) -> None:
+        """Remember the passages retrieved for a session's latest query"""
+        now = time.monotonic()
+        with self._lock:
+            self._entries[session_id] = {
+                'terms': content_terms(user_query),
+                'passages': list(passages),
+                'stored_at': now,
+                'expires_at': now + self.ttl_seconds
+            }
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+
+def merge_passages(fresh: List[Dict[str, Any]], cached: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Union of fresh and cached passages, fresh first on ties, highest retrieval score first"""
+    merged = {}
+    for passage in fresh + cached:
+        key = (passage['uri'], passage['snippet'])
+        if key not in merged or passage['retrieval_score'] > merged[key]['retrieval_score']:
+            merged[key] = passage
+    return sorted(merged.values(), key=lambda passage: passage['retrieval_score'], reverse=True)
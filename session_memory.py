@@ -0,0 +1,220 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+logger = logging.getLogger(__name__)
+
+# Keys UIComponents.show_references creates per message index. Widget keys
+# (ref_btn_*, thumbsup_*, cat1_* ...) are dropped by Streamlit itself once the
+# widget is no longer rendered, these are not.
+MESSAGE_KEY_PATTERN = re.compile(r'^(selected_ref|ref_button_clicked)_(\d+)$')
+FEEDBACK_STATE_KEYS = ('feedback_states', 'show_feedback_categories', 'selected_category')
+# Size of each message by id(), measured once when the message first shows up in the session
+MESSAGE_SIZES_KEY = '_message_sizes'
+# Message fields a stub keeps besides its preview: what ties it to its ChatHistory item and trace
+STUB_FIELDS = ('role', 'timestamp', 'session_id', 'conversation_id', 'trace_id')
+
+
+def deep_sizeof(value, seen=None) -> int:
+    """Approximate the memory retained by a value and everything it references"""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in value)
+    elif hasattr(value, '__dict__'):
+        size += deep_sizeof(vars(value), seen)
+    return size
+
+
+def process_rss_bytes() -> Optional[int]:
+    """Resident set size of this process, None where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class SessionMemoryRegistry:
+    """Latest footprint of every session served by this process"""
+
+    def __init__(self, idle_seconds: float = 3600):
+        self.idle_seconds = idle_seconds
+        self.sessions = {}
+        self._reported_at = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, session_key: str, footprint: Dict[str, Any]) -> None:
+        with self._lock:
+            self.sessions[session_key] = {**footprint, 'updated_at': time.time()}
+
+    def report(self) -> Dict[str, Any]:
+        """Total and per-session footprint, largest first; sessions idle for idle_seconds are dropped"""
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            for session_key in [key for key, entry in self.sessions.items() if entry['updated_at'] < cutoff]:
+                del self.sessions[session_key]
+            sessions = [{'session': key, **entry} for key, entry in self.sessions.items()]
+        sessions.sort(key=lambda entry: entry['bytes'], reverse=True)
+        return {
+            'sessions': len(sessions),
+            'total_bytes': sum(entry['bytes'] for entry in sessions),
+            'process_rss_bytes': process_rss_bytes(),
+            'by_session': sessions
+        }
+
+    def log_report(self, interval_seconds: float) -> None:
+        """Log the report at most once per interval_seconds"""
+        with self._lock:
+            if time.monotonic() - self._reported_at < interval_seconds:
+                return
+            self._reported_at = time.monotonic()
+        logger.info(f"Session memory: {json.dumps(self.report(), default=str)}")
+
+
+@st.cache_resource
+def shared_memory_registry() -> SessionMemoryRegistry:
+    """One registry per process, shared by all sessions"""
+    return SessionMemoryRegistry(idle_seconds=float(os.getenv('SESSION_MEMORY_IDLE_SECONDS', 3600)))
+
+
+class SessionMemoryManager:
+    """Keep one session's st.session_state within a memory budget.
+
+    Once a session is over budget_bytes, messages older than the last
+    keep_recent are replaced, oldest first, by stubs holding a short preview;
+    the full message is reloaded from ChatHistoryManager on demand, matched
+    by the timestamp it was saved with. Messages are measured once, when
+    they are added, so a rerun only walks the rest of the state. Per-message
+    keys for messages that are gone or compacted are garbage-collected on
+    every run.
+    """
+
+    def __init__(self, chat_manager, budget_bytes: Optional[int] = None, keep_recent: Optional[int] = None,
+                 preview_chars: Optional[int] = None):
+        self.chat_manager = chat_manager
+        self.budget_bytes = budget_bytes or int(os.getenv('SESSION_MEMORY_BUDGET_BYTES', 2 * 1024 * 1024))
+        self.keep_recent = keep_recent if keep_recent is not None else int(os.getenv('SESSION_KEEP_RECENT_MESSAGES', 20))
+        self.preview_chars = preview_chars or int(os.getenv('SESSION_STUB_PREVIEW_CHARS', 200))
+        self.report_seconds = float(os.getenv('SESSION_MEMORY_REPORT_SECONDS', 300))
+        self.registry = shared_memory_registry()
+
+    def enforce(self) -> Dict[str, Any]:
+        """Collect stale keys, compact old messages if over budget and record the footprint"""
+        messages = st.session_state.get('messages', [])
+        self.collect_stale_keys(messages)
+        footprint = self.measure()
+        if footprint['bytes'] > self.budget_bytes:
+            self.compact(messages, footprint['bytes'] - self.budget_bytes)
+            self.collect_stale_keys(messages)
+            footprint = self.measure()
+            if footprint['bytes'] > self.budget_bytes:
+                logger.warning(f"Session is {footprint['bytes']} bytes after compaction, "
+                               f"over its budget of {self.budget_bytes}")
+
+        ctx = get_script_run_ctx()
+        self.registry.record(ctx.session_id if ctx else 'unknown', footprint)
+        self.registry.log_report(self.report_seconds)
+        return footprint
+
+    @staticmethod
+    def _message_sizes(messages: List[Dict[str, Any]]) -> Dict[int, int]:
+        """Cached message sizes, measuring new messages and forgetting ones no longer in the session"""
+        cached = st.session_state.get(MESSAGE_SIZES_KEY, {})
+        sizes = {id(message): cached.get(id(message)) or deep_sizeof(message) for message in messages}
+        st.session_state[MESSAGE_SIZES_KEY] = sizes
+        return sizes
+
+    def measure(self) -> Dict[str, Any]:
+        """Footprint of this session's state, in total and for its largest keys"""
+        state = st.session_state.to_dict()
+        messages = state.get('messages', [])
+        sizes = {
+            key: deep_sizeof(value) for key, value in state.items()
+            if key not in ('messages', MESSAGE_SIZES_KEY)
+        }
+        sizes['messages'] = sys.getsizeof(messages) + sum(self._message_sizes(messages).values())
+        return {
+            'user_id': state.get('user_id'),
+            'bytes': sum(sizes.values()),
+            'messages': len(messages),
+            'compacted': sum(1 for message in messages if message.get('compacted')),
+            'keys': len(sizes),
+            'largest_keys': dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:5])
+        }
+
+    def compact(self, messages: List[Dict[str, Any]], excess_bytes: int) -> int:
+        """Replace old messages with stubs until excess_bytes are freed, returning the bytes freed"""
+        freed = 0
+        sizes = self._message_sizes(messages)
+        for idx, message in enumerate(messages[:max(len(messages) - self.keep_recent, 0)]):
+            if freed >= excess_bytes:
+                break
+            if message.get('compacted') or message.get('pinned'):
+                continue
+            stub = self._stub(message)
+            freed += sizes[id(message)] - deep_sizeof(stub)
+            messages[idx] = stub
+        return freed
+
+    def _stub(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        content = message.get('content', '')
+        preview = content if len(content) <= self.preview_chars else content[:self.preview_chars] + '…'
+        stub = {field: message[field] for field in STUB_FIELDS if field in message}
+        stub.update(content=preview, compacted=True)
+        return stub
+
+    @staticmethod
+    def collect_stale_keys(messages: List[Dict[str, Any]]) -> None:
+        """Drop per-message state for indices that no longer hold a full message"""
+        for key in list(st.session_state.keys()):
+            match = MESSAGE_KEY_PATTERN.match(key)
+            if match:
+                idx = int(match.group(2))
+                if idx >= len(messages) or messages[idx].get('compacted'):
+                    del st.session_state[key]
+        for state_key in FEEDBACK_STATE_KEYS:
+            states = st.session_state.get(state_key)
+            if states:
+                for idx in [idx for idx in states if isinstance(idx, int) and idx >= len(messages)]:
+                    del states[idx]
+
+    def restore_message(self, idx: int) -> bool:
+        """Reload a compacted message of the current conversation from ChatHistory"""
+        messages = st.session_state.messages
+        stub = messages[idx]
+        stored = self.chat_manager.get_conversation_messages(
+            st.session_state.user_id, stub.get('conversation_id') or st.session_state.current_conversation_id
+        )
+        item = next((item for item in stored if item['timestamp'] == stub.get('timestamp')), None)
+        if item is None or item['role'] != stub.get('role'):
+            logger.warning(f"Message {idx} of conversation {st.session_state.current_conversation_id} "
+                           f"could not be found in the chat history")
+            return False
+        restored = {
+            'role': item['role'],
+            'content': item['content'],
+            'references': item.get('references', []),
+            'timestamp': item['timestamp'],
+            'session_id': item.get('session_id'),
+            'conversation_id': item.get('conversation_id'),
+            # Opened by the user, so it is not compacted again
+            'pinned': True
+        }
+        if item.get('trace_id'):
+            restored['trace_id'] = item['trace_id']
+        messages[idx] = restored
+        return True
@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import time
+import zlib
+import logging
+import secrets
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+from client_config import create_resource
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE_TABLE_SCHEMA = {
+    'KeySchema': [
+        {'AttributeName': 'token', 'KeyType': 'HASH'}
+    ],
+    'AttributeDefinitions': [
+        {'AttributeName': 'token', 'AttributeType': 'S'}
+    ],
+    'BillingMode': 'PAY_PER_REQUEST'
+}
+
+# DynamoDB items are capped at 400 KB; larger states stay with the current worker
+MAX_STATE_BYTES = 350 * 1024
+
+
+# What new_session_token() produces: 32 random bytes as unpadded URL-safe base64
+SESSION_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_-]{43}')
+
+
+def new_session_token() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def is_session_token(token: Optional[str]) -> bool:
+    """Whether a token could have come from new_session_token(); anything else is never looked up"""
+    return isinstance(token, str) and SESSION_TOKEN_PATTERN.fullmatch(token) is not None
+
+
+def encode_state(state: Dict[str, Any]) -> bytes:
+    """Compressed JSON, keeping integer dict keys (e.g. feedback state per message index) intact"""
+    return zlib.compress(json.dumps(_encode(state), separators=(',', ':')).encode('utf-8'))
+
+
+def decode_state(data: bytes) -> Dict[str, Any]:
+    return _decode(json.loads(zlib.decompress(data)))
+
+
+def _encode(value):
+    if isinstance(value, dict):
+        if value and all(isinstance(key, int) for key in value):
+            return {'__int_keys__': [[key, _encode(item)] for key, item in value.items()]}
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if set(value) == {'__int_keys__'}:
+            return {key: _decode(item) for key, item in value['__int_keys__']}
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+class SessionStore:
+    """Session state by token, shared by every worker that can reach the store.
+
+    load() returns None for unknown or expired tokens; states expire
+    ttl_seconds after they were last saved.
+    """
+
+    def __init__(self, ttl_seconds: float = 1800):
+        self.ttl_seconds = ttl_seconds
+
+    def load(self, token: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save(self, token: str, state: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def delete(self, token: str) -> None:
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """Process-local stand-in, for a single worker or tests"""
+
+    def __init__(self, ttl_seconds: float = 1800):
+        super().__init__(ttl_seconds)
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def load(self, token: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._states.get(token)
+        if entry is None or entry[0] < time.time():
+            return None
+        return decode_state(entry[1])
+
+    def save(self, token: str, state: Dict[str, Any]) -> None:
+        data = encode_state(state)
+        with self._lock:
+            self._states[token] = (time.time() + self.ttl_seconds, data)
+
+    def delete(self, token: str) -> None:
+        with self._lock:
+            self._states.pop(token, None)
+
+
+class FileSessionStore(SessionStore):
+    """One file per token in a directory, e.g. a volume shared by workers on one host"""
+
+    def __init__(self, directory: str, ttl_seconds: float = 1800):
+        super().__init__(ttl_seconds)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, token: str) -> str:
+        # Tokens come from the URL, so only well-formed ones become file names
+        if not is_session_token(token):
+            raise ValueError("Invalid session token")
+        return os.path.join(self.directory, f"{token}.session")
+
+    def load(self, token: str) -> Optional[Dict[str, Any]]:
+        path = self._path(token)
+        try:
+            if os.path.getmtime(path) + self.ttl_seconds < time.time():
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                return decode_state(f.read())
+        except FileNotFoundError:
+            return None
+
+    def save(self, token: str, state: Dict[str, Any]) -> None:
+        # Write and rename so a concurrent load never sees a partial file
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(encode_state(state))
+        os.replace(temporary_path, self._path(token))
+
+    def delete(self, token: str) -> None:
+        try:
+            os.remove(self._path(token))
+        except FileNotFoundError:
+            pass
+
+
+class DynamoDBSessionStore(SessionStore):
+    """States in a DynamoDB table keyed by token, expired through its expires_at TTL attribute"""
+
+    def __init__(self, table, ttl_seconds: float = 1800):
+        super().__init__(ttl_seconds)
+        self.table = table
+
+    def load(self, token: str) -> Optional[Dict[str, Any]]:
+        item = self.table.get_item(Key={'token': token}).get('Item')
+        # DynamoDB deletes expired items lazily, so check the expiry as well
+        if not item or int(item['expires_at']) < time.time():
+            return None
+        return decode_state(bytes(item['state']))
+
+    def save(self, token: str, state: Dict[str, Any]) -> None:
+        data = encode_state(state)
+        if len(data) > MAX_STATE_BYTES:
+            logger.warning(f"Session state of {len(data)} bytes is too large to store, keeping it local")
+            return
+        self.table.put_item(Item={
+            'token': token,
+            'state': data,
+            'expires_at': int(time.time() + self.ttl_seconds)
+        })
+
+    def delete(self, token: str) -> None:
+        self.table.delete_item(Key={'token': token})
+
+
+def session_store_from_env() -> Optional[SessionStore]:
+    """Store selected by SESSION_STORE (dynamodb, file or memory); None keeps state per worker only"""
+    kind = os.getenv('SESSION_STORE', '').lower()
+    # Idle time after which a saved conversation is no longer restored; every change saves it again
+    ttl_seconds = float(os.getenv('SESSION_TTL_SECONDS', 1800))
+    if kind == 'dynamodb':
+        table = create_resource('dynamodb', 'dynamodb').Table(os.getenv('SESSION_STORE_TABLE', 'ChatSessions'))
+        return DynamoDBSessionStore(table, ttl_seconds)
+    if kind == 'file':
+        return FileSessionStore(os.getenv('SESSION_STORE_PATH', '.sessions'), ttl_seconds)
+    if kind == 'memory':
+        return InMemorySessionStore(ttl_seconds)
+    if kind:
+        logger.error(f"Unknown SESSION_STORE {kind}, keeping session state per worker")
+    return None
@@ -24,10 +24,17 @@ class SidebarManager:
                 st.divider()
                 
                 conversations = self.chat_manager.get_conversations(st.session_state.user_id)
-                if not conversations:
+                archived_conversations = self.chat_manager.get_archived_conversations(st.session_state.user_id)
+                if not conversations and not archived_conversations:
                     st.info("No chat history available")
                     return
 
+                search_query = st.text_input("🔍 Search chats", key="history_search",
+                                             placeholder="Search your conversations")
+                if search_query.strip():
+                    self._display_search_results(search_query, conversations)
+                    return
+
                 shown_conversations = set()
                 
                 sections = {
@@ -38,6 +45,38 @@ class SidebarManager:
                 }
 
                 self._display_conversation_sections(sections, conversations, shown_conversations)
+                self._display_archived_section(archived_conversations, shown_conversations)
+
+    def _display_search_results(self, search_query: str, conversations: Dict[str, Dict]) -> None:
+        """Display conversations matching a search in place of the date sections."""
+        results = self.chat_manager.search_conversations(st.session_state.user_id, search_query)
+        if not results:
+            st.info("No matching conversations")
+            return
+
+        messages_by_conversation = {
+            conv_id: messages
+            for convs in conversations.values()
+            for conv_id, messages in convs.items()
+        }
+        for result in results:
+            conv_id = result['conversation_id']
+            title = result['title'][:30] + "..." if len(result['title']) > 30 else result['title']
+            if st.button(title,
+                         key=f"search_{conv_id}",
+                         help=result['snippet'],
+                         use_container_width=True):
+                messages = messages_by_conversation.get(conv_id)
+                if messages:
+                    messages = self.chat_manager.hydrate_conversation(st.session_state.user_id, conv_id, messages)
+                else:
+                    # Matches older than the loaded conversations are read when opened
+                    messages = self.chat_manager.get_conversation_messages(st.session_state.user_id, conv_id)
+                if messages:
+                    self.load_conversation(messages)
+                else:
+                    st.warning("This conversation could not be loaded.")
+            st.caption(f"{result['date']} · {result['snippet']}")
 
     def _display_section(self, section: str, section_conversations: Dict[str, Dict], 
                         shown_conversations: set) -> None:
@@ -55,7 +94,8 @@ class SidebarManager:
                             if st.button(title, 
                                        key=f"conv_{conv_id}", 
                                        use_container_width=True):
-                                self.load_conversation(messages)
+                                self.load_conversation(self.chat_manager.hydrate_conversation(
+                                    st.session_state.user_id, conv_id, messages))
                         
                         with col2:
                             if st.button("🗑️", 
@@ -66,6 +106,40 @@ class SidebarManager:
                         
                         shown_conversations.add(conv_id)
 
+    def _display_archived_section(self, archived_conversations: List[Dict[str, Any]],
+                                  shown_conversations: set) -> None:
+        """Display conversations moved to the archive; their messages are only read when one is opened."""
+        archived_conversations = [
+            conv for conv in archived_conversations
+            if conv["conversation_id"] not in shown_conversations
+        ]
+        if not archived_conversations:
+            return
+        with st.expander("Older conversations", expanded=False):
+            for conv in archived_conversations:
+                conv_id = conv["conversation_id"]
+                first_message = conv["first_message"]
+                title = first_message[:30] + "..." if len(first_message) > 30 else first_message
+
+                col1, col2 = st.columns([0.8, 0.2])
+                with col1:
+                    if st.button(title,
+                                 key=f"conv_{conv_id}",
+                                 help=conv["date"],
+                                 use_container_width=True):
+                        self.load_conversation(
+                            self.chat_manager.get_conversation_messages(st.session_state.user_id, conv_id)
+                        )
+
+                with col2:
+                    if st.button("🗑️",
+                                 key=f"del_{conv_id}",
+                                 help="Delete conversation",
+                                 use_container_width=True):
+                        self.delete_conversation(conv_id)
+
+                shown_conversations.add(conv_id)
+
     def _display_conversation_sections(self, sections: Dict[str, int], 
                                     conversations: Dict[str, Dict], 
                                     shown_conversations: set) -> None:
@@ -107,11 +181,17 @@ class SidebarManager:
         try:
             st.session_state.messages = []
             for msg in messages:
-                st.session_state.messages.append({
+                message = {
                     "role": msg["role"],
                     "content": msg["content"],
-                    "references": msg.get("references", [])
-                })
+                    "references": msg.get("references", []),
+                    "timestamp": msg.get("timestamp"),
+                    "session_id": msg.get("session_id"),
+                    "conversation_id": msg.get("conversation_id")
+                }
+                if msg.get("trace_id"):
+                    message["trace_id"] = msg["trace_id"]
+                st.session_state.messages.append(message)
             st.session_state.current_conversation_id = messages[0]["conversation_id"]
             st.rerun()
         except Exception as e:
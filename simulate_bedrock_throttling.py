@@ -0,0 +1,135 @@
+"""Simulate a burst against a Bedrock quota with and without AdaptiveLimiter.
+
+The stub upstream serves at most --quota concurrent calls and throttles the
+rest. Without the limiter every throttle becomes a failed request, and the
+callers hammer the upstream again right away. With it, callers back off,
+queue for a permit and are shed with Overloaded (a 429) after the queue
+timeout, so goodput stays near the quota.
+
+    python simulate_bedrock_throttling.py --quota 8 --clients 64 --seconds 10
+"""
+import time
+import logging
+import argparse
+import threading
+from typing import Any, Dict
+
+from botocore.exceptions import ClientError
+
+from benchmark_utils import latency_summary, write_report
+from bedrock_stubs import LatencyModel
+from concurrency_limiter import AdaptiveLimiter, Overloaded
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaUpstream:
+    """Serves up to `quota` concurrent calls and throttles the rest.
+
+    Rejecting a call is not free: it holds a slot for throttle_ms, so a
+    retry storm crowds out the work the quota could otherwise serve.
+    """
+
+    def __init__(self, quota: int, latency: LatencyModel, throttle_ms: float, time_scale: float):
+        self.quota = quota
+        self.latency = latency
+        self.throttle_ms = throttle_ms
+        self.time_scale = time_scale
+        self.in_flight = 0
+        self.attempts = 0
+        self._lock = threading.Lock()
+
+    def retrieve_and_generate(self, **request) -> Dict[str, Any]:
+        with self._lock:
+            self.attempts += 1
+            admitted = self.in_flight < self.quota
+            self.in_flight += 1
+        if not admitted:
+            time.sleep(self.throttle_ms * self.time_scale / 1000)
+            with self._lock:
+                self.in_flight -= 1
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                              'RetrieveAndGenerate')
+        try:
+            self.latency.wait()
+            return {'output': {'text': 'ok'}}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def run(strategy: str, args) -> Dict[str, Any]:
+    latency = LatencyModel({'distribution': 'lognormal', 'median_ms': 2500, 'sigma': 0.35},
+                           seed=args.seed, time_scale=args.time_scale)
+    upstream = QuotaUpstream(args.quota, latency, throttle_ms=50, time_scale=args.time_scale)
+    limiter = AdaptiveLimiter('retrieve_and_generate', initial_limit=args.clients,
+                              queue_timeout_ms=args.queue_timeout_ms * args.time_scale,
+                              base_backoff_ms=100 * args.time_scale,
+                              max_backoff_ms=5000 * args.time_scale)
+    outcomes = {'ok': [], 'throttled': 0, 'shed': 0}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + args.seconds
+
+    def client_loop():
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            try:
+                if strategy == 'limited':
+                    limiter.call(upstream.retrieve_and_generate, input={'text': 'burst'})
+                else:
+                    upstream.retrieve_and_generate(input={'text': 'burst'})
+                with lock:
+                    outcomes['ok'].append((time.perf_counter() - start) * 1000 / args.time_scale)
+            except Overloaded:
+                with lock:
+                    outcomes['shed'] += 1
+            except ClientError:
+                with lock:
+                    outcomes['throttled'] += 1
+
+    threads = [threading.Thread(target=client_loop) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Requests the upstream could have completed in the run at median latency
+    capacity = args.quota * args.seconds / (2.5 * args.time_scale)
+    result = {
+        'succeeded': len(outcomes['ok']),
+        'failed_500': outcomes['throttled'],
+        'shed_429': outcomes['shed'],
+        'upstream_attempts': upstream.attempts,
+        'goodput_vs_quota': round(len(outcomes['ok']) / capacity, 3),
+        'latency_ms': latency_summary(outcomes['ok'])
+    }
+    if strategy == 'limited':
+        result['limiter'] = limiter.snapshot()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a throttling burst against a Bedrock quota")
+    parser.add_argument('--quota', type=int, default=8, help="Concurrent calls the upstream serves")
+    parser.add_argument('--clients', type=int, default=64, help="Concurrent callers in the burst")
+    parser.add_argument('--seconds', type=float, default=10, help="Burst duration in wall-clock seconds")
+    parser.add_argument('--queue-timeout-ms', type=float, default=5000,
+                        help="Limiter queue timeout in simulated milliseconds")
+    parser.add_argument('--time-scale', type=float, default=0.1, help="Multiplier applied to simulated latencies")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--log-level', default='ERROR')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    logging.getLogger().setLevel(args.log_level)
+    report = {
+        'config': vars(args),
+        'unlimited': run('unlimited', args),
+        'limited': run('limited', args)
+    }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
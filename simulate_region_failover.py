@@ -0,0 +1,180 @@
+"""Simulate RegionalClientPool against slow and failing regions.
+
+Each scenario gives every region a stub bedrock-runtime client with the
+realistic rerank latency plus injected faults, then sends the same rerank
+workload through three strategies:
+
+  single:   the home region only, as lambda_function did before the pools
+  failover: the pool with hedging disabled (HEDGE_MAX_RATIO=0)
+  hedged:   the pool with the default hedge budget
+
+and reports latency percentiles, errors and upstream calls per request,
+which is the extra cost hedging adds.
+
+    python simulate_region_failover.py --requests 500 --time-scale 0.1
+"""
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from botocore.exceptions import ClientError
+
+from bedrock_stubs import REALISTIC_LATENCY_PROFILE, StubBedrockRuntime, stable_seed
+from benchmark_utils import latency_summary, load_query_corpus, write_report
+from region_pool import RegionalClientPool
+
+logger = logging.getLogger(__name__)
+
+REGIONS = ['us-west-2', 'us-east-1', 'eu-central-1']
+
+# Faults injected per region on top of the realistic latency
+SCENARIOS = {
+    'healthy': {},
+    'slow_tail': {
+        'us-west-2': {'slow_rate': 0.03, 'slow_ms': 3000}
+    },
+    'throttling': {
+        'us-west-2': {'error_rate': 0.3, 'error_ms': 40}
+    },
+    'regional_outage': {
+        'us-west-2': {'error_rate': 1.0, 'error_ms': 1500},
+        'us-east-1': {'slow_rate': 0.03, 'slow_ms': 2000}
+    }
+}
+
+
+class FaultyRegion:
+    """Wrap a stub client to add stalls and throttling errors"""
+
+    def __init__(self, client, region: str, slow_rate: float = 0.0, slow_ms: float = 0.0,
+                 error_rate: float = 0.0, error_ms: float = 0.0, seed: int = 0, time_scale: float = 1.0):
+        self.client = client
+        self.region = region
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.error_rate = error_rate
+        self.error_ms = error_ms
+        self.time_scale = time_scale
+        self.calls = 0
+        self._random = random.Random(stable_seed(seed, region))
+        self._lock = threading.Lock()
+
+    def invoke_model(self, **request):
+        with self._lock:
+            self.calls += 1
+            fails = self._random.random() < self.error_rate
+            stalls = self._random.random() < self.slow_rate
+        if fails:
+            time.sleep(self.error_ms * self.time_scale / 1000)
+            raise ClientError(
+                {'Error': {'Code': 'ThrottlingException', 'Message': f"Injected throttle in {self.region}"}},
+                'InvokeModel'
+            )
+        if stalls:
+            time.sleep(self.slow_ms * self.time_scale / 1000)
+        return self.client.invoke_model(**request)
+
+
+def build_regions(faults: Dict[str, Dict[str, Any]], seed: int, time_scale: float) -> Dict[str, FaultyRegion]:
+    profile = {'invoke_model': REALISTIC_LATENCY_PROFILE['invoke_model']}
+    return {
+        region: FaultyRegion(
+            StubBedrockRuntime(latency_profile=profile, seed=stable_seed(seed, region), time_scale=time_scale),
+            region, seed=seed, time_scale=time_scale, **faults.get(region, {})
+        )
+        for region in REGIONS
+    }
+
+
+def rerank_request(query: str) -> Dict[str, Any]:
+    documents = [f"{query} policy section {index}" for index in range(5)]
+    return {
+        'modelId': 'cohere.rerank-v3-5:0',
+        'contentType': 'application/json',
+        'accept': '*/*',
+        'body': json.dumps({'query': query, 'documents': documents, 'top_n': len(documents), 'api_version': 2})
+    }
+
+
+def run_strategy(strategy: str, faults: Dict[str, Dict[str, Any]], queries: List[str], args) -> Dict[str, Any]:
+    regions = build_regions(faults, args.seed, args.time_scale)
+    if strategy == 'single':
+        target = regions[REGIONS[0]]
+        pool = None
+    else:
+        pool = RegionalClientPool(
+            regions,
+            max_hedge_ratio=0.0 if strategy == 'failover' else args.max_hedge_ratio,
+            # Scale the pool's fixed delays along with the simulated latencies
+            min_hedge_delay_ms=50 * args.time_scale,
+            initial_hedge_delay_ms=1000 * args.time_scale,
+            stats_ttl_seconds=60 * args.time_scale
+        )
+        target = pool
+
+    def call(query):
+        start = time.perf_counter()
+        try:
+            target.invoke_model(**rerank_request(query))
+            ok = True
+        except ClientError:
+            ok = False
+        return ok, (time.perf_counter() - start) * 1000 / args.time_scale
+
+    workload = [queries[index % len(queries)] for index in range(args.requests)]
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(call, workload))
+    if pool:
+        # Let losing hedges finish so their calls are counted
+        pool._executor.shutdown(wait=True)
+
+    latencies = [elapsed for ok, elapsed in results if ok]
+    upstream_calls = sum(region.calls for region in regions.values())
+    result = {
+        'errors': len(results) - len(latencies),
+        'latency_ms': latency_summary(latencies),
+        'upstream_calls_per_request': round(upstream_calls / len(results), 3)
+    }
+    if pool:
+        snapshot = pool.snapshot()
+        result['hedges'] = snapshot['hedges']
+        result['failovers'] = snapshot['failovers']
+        result['wins'] = {region: stats['wins'] for region, stats in snapshot['regions'].items()}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate hedged and regional-failover Bedrock calls")
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--max-hedge-ratio', type=float, default=0.1)
+    parser.add_argument('--time-scale', type=float, default=0.1, help="Multiplier applied to simulated latencies")
+    parser.add_argument('--queries', nargs='+', help="JSONL files of queries (default: requests.jsonl or sample_queries.jsonl)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--log-level', default='ERROR')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    logging.getLogger().setLevel(args.log_level)
+    queries = load_query_corpus(args.queries)
+
+    report = {'config': {'regions': REGIONS, 'requests': args.requests, 'concurrency': args.concurrency,
+                         'max_hedge_ratio': args.max_hedge_ratio, 'time_scale': args.time_scale},
+              'scenarios': {}}
+    for scenario in args.scenarios:
+        report['scenarios'][scenario] = {
+            strategy: run_strategy(strategy, SCENARIOS[scenario], queries, args)
+            for strategy in ('single', 'failover', 'hedged')
+        }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from decimal import Decimal
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from boto3.dynamodb.conditions import Attr
+
+from client_config import create_resource
+
+logger = logging.getLogger()
+
+COALESCING_TABLE_SCHEMA = {
+    'KeySchema': [
+        {'AttributeName': 'flight_key', 'KeyType': 'HASH'}
+    ],
+    'AttributeDefinitions': [
+        {'AttributeName': 'flight_key', 'AttributeType': 'S'}
+    ],
+    'BillingMode': 'PAY_PER_REQUEST'
+}
+
+
+class FlightStore:
+    """Lock and result store shared by containers.
+
+    try_acquire() takes a lease on a key for one owner, put_result() publishes
+    the owner's result for result_ttl seconds and get_result() returns it.
+    is_held() tells whether anyone still holds an unexpired lease on the key.
+    """
+
+    def try_acquire(self, key: str, owner: str, lease_seconds: float) -> bool:
+        raise NotImplementedError
+
+    def is_held(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def get_result(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def put_result(self, key: str, owner: str, result: Dict[str, Any], result_ttl: float) -> None:
+        raise NotImplementedError
+
+    def release(self, key: str, owner: str) -> None:
+        raise NotImplementedError
+
+
+class InMemoryFlightStore(FlightStore):
+    """FlightStore for one process, e.g. to simulate several containers locally"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key: str, owner: str, lease_seconds: float) -> bool:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['lease_expires'] > now:
+                return False
+            self._entries[key] = {'owner': owner, 'lease_expires': now + lease_seconds, 'result': None}
+            return True
+
+    def is_held(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return bool(entry) and entry['lease_expires'] > time.time()
+
+    def get_result(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['result'] is not None and entry['lease_expires'] > time.time():
+                return entry['result']
+            return None
+
+    def put_result(self, key: str, owner: str, result: Dict[str, Any], result_ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = {'owner': owner, 'lease_expires': time.time() + result_ttl, 'result': result}
+
+    def release(self, key: str, owner: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['owner'] == owner and entry['result'] is None:
+                del self._entries[key]
+
+
+class DynamoDBFlightStore(FlightStore):
+    """FlightStore on a DynamoDB table keyed by flight_key, using conditional writes for the lease"""
+
+    def __init__(self, table):
+        self.table = table
+
+    def try_acquire(self, key: str, owner: str, lease_seconds: float) -> bool:
+        now = time.time()
+        try:
+            self.table.put_item(
+                Item={
+                    'flight_key': key,
+                    'owner': owner,
+                    'lease_expires': Decimal(str(now + lease_seconds)),
+                    'expires_at': int(now + lease_seconds) + 60
+                },
+                ConditionExpression=Attr('flight_key').not_exists() | Attr('lease_expires').lt(Decimal(str(now)))
+            )
+            return True
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def is_held(self, key: str) -> bool:
+        item = self.table.get_item(Key={'flight_key': key}, ConsistentRead=True).get('Item')
+        return bool(item) and float(item['lease_expires']) > time.time()
+
+    def get_result(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self.table.get_item(Key={'flight_key': key}, ConsistentRead=True).get('Item')
+        if item and 'result' in item and float(item['lease_expires']) > time.time():
+            return json.loads(item['result'])
+        return None
+
+    def put_result(self, key: str, owner: str, result: Dict[str, Any], result_ttl: float) -> None:
+        now = time.time()
+        self.table.put_item(Item={
+            'flight_key': key,
+            'owner': owner,
+            'result': json.dumps(result),
+            # The published result holds the lease so nobody recomputes it while it is fresh
+            'lease_expires': Decimal(str(now + result_ttl)),
+            'expires_at': int(now + result_ttl) + 60
+        })
+
+    def release(self, key: str, owner: str) -> None:
+        try:
+            self.table.delete_item(
+                Key={'flight_key': key},
+                ConditionExpression=Attr('owner').eq(owner) & Attr('result').not_exists()
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Run a function once per key for all concurrent callers.
+
+    Within the container, callers that arrive while a key is in flight wait
+    for the leader's result. With a FlightStore, the leader also takes a
+    lease on the key across containers; if another container holds it, the
+    leader polls for that container's result instead of running the
+    function. If the other container gives up its lease without a result
+    (it failed, or it crashed and the lease expired), the poller takes the
+    lease over and runs the function itself; if nothing is published within
+    wait_timeout_seconds it runs the function anyway. The default wait
+    leaves time for that inside API Gateway's 29 s limit. Published results
+    are shared for result_ttl seconds, which covers requests that arrive
+    just after the leader ends.
+    """
+
+    def __init__(self, store: Optional[FlightStore] = None, wait_timeout_seconds: float = 10,
+                 lease_seconds: float = 60, result_ttl: float = 5, poll_interval: float = 0.1):
+        self.store = store
+        self.wait_timeout_seconds = wait_timeout_seconds
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.owner = str(uuid.uuid4())
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'SingleFlight':
+        """In-container coalescing, shared across containers when COALESCING_TABLE is set"""
+        table_name = os.environ.get('COALESCING_TABLE')
+        store = DynamoDBFlightStore(create_resource('dynamodb', 'dynamodb').Table(table_name)) if table_name else None
+        return cls(
+            store,
+            wait_timeout_seconds=float(os.environ.get('COALESCING_WAIT_TIMEOUT_SECONDS', 10)),
+            result_ttl=float(os.environ.get('COALESCING_RESULT_TTL_SECONDS', 5))
+        )
+
+    def do(self, key: str, function: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Return the function's result for key and how it was obtained"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            if not flight.done.wait(self.wait_timeout_seconds):
+                logger.warning("Timed out waiting for a coalesced request, running it separately")
+                return function(), {'coalesced': False, 'scope': None}
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, {'coalesced': True, 'scope': 'container'}
+
+        try:
+            flight.result, info = self._run_shared(key, function)
+            return flight.result, {**info, 'waiters': flight.waiters}
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _run_shared(self, key: str, function: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        if self.store is None:
+            return function(), {'coalesced': False, 'scope': None}
+
+        try:
+            result = self.store.get_result(key)
+            acquired = result is None and self.store.try_acquire(key, self.owner, self.lease_seconds)
+        except Exception as e:
+            # The shared store is an optimization; never fail a request because of it
+            logger.error(f"Error coalescing through the shared store: {str(e)}")
+            return function(), {'coalesced': False, 'scope': None}
+
+        if result is not None:
+            return result, {'coalesced': True, 'scope': 'shared'}
+        if acquired:
+            return self._lead(key, function)
+
+        deadline = time.monotonic() + self.wait_timeout_seconds
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            result = self._quietly(self.store.get_result, key)
+            if result is not None:
+                return result, {'coalesced': True, 'scope': 'shared'}
+            # The other container released its lease (it failed) or let it expire (it crashed): take over
+            if (self._quietly(self.store.is_held, key) is False
+                    and self._quietly(self.store.try_acquire, key, self.owner, self.lease_seconds)):
+                logger.info("Shared flight was abandoned, running the request here")
+                return self._lead(key, function)
+
+        logger.warning("No shared result published in time, running the request here")
+        return function(), {'coalesced': False, 'scope': None}
+
+    def _lead(self, key: str, function: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Run the function while holding the key's lease and publish its result"""
+        try:
+            result = function()
+        except Exception:
+            self._quietly(self.store.release, key, self.owner)
+            raise
+        self._quietly(self.store.put_result, key, self.owner, result, self.result_ttl)
+        return result, {'coalesced': False, 'scope': None}
+
+    def _quietly(self, operation: Callable, *args) -> Any:
+        try:
+            return operation(*args)
+        except Exception as e:
+            logger.error(f"Error in shared flight store: {str(e)}")
+            return None
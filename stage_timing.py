@@ -0,0 +1,33 @@
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from tracing import get_tracer
+
+
+class StageTimer:
+    """Accumulate wall-clock time per pipeline stage for one request.
+
+    Each stage is also a span of the current trace, when there is one.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block and add it to the named stage"""
+        start = time.perf_counter()
+        try:
+            with get_tracer().span(name):
+                yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed_ms
+
+    def as_dict(self) -> Dict[str, float]:
+        """Return stage timings in milliseconds, including the total so far"""
+        timings = {name: round(elapsed, 3) for name, elapsed in self.timings.items()}
+        timings['total'] = round((time.perf_counter() - self.started_at) * 1000, 3)
+        return timings
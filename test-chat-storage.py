@@ -2,7 +2,7 @@ from chat_history import ChatHistoryManager
 import time
 import os
 from dotenv import load_dotenv
-import boto3
+from client_config import create_resource
 from botocore.exceptions import ClientError
 import logging
 
@@ -25,7 +25,8 @@ def ensure_table_exists():
             raise ValueError("AWS credentials not found in environment variables")
         
         # Initialize DynamoDB
-        dynamodb = boto3.resource(
+        dynamodb = create_resource(
+            'dynamodb',
             'dynamodb',
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
@@ -0,0 +1,148 @@
+import re
+import math
+from typing import Dict, Any, List, Optional, Tuple
+
+# Rough characters-per-token ratio for English text on current Bedrock models
+CHARS_PER_TOKEN = 4
+
+# Word n-gram size used to detect overlapping chunks
+SHINGLE_SIZE = 5
+
+# Chunks sharing at least this fraction of their shingles with a kept chunk are dropped
+DUPLICATE_OVERLAP = 0.8
+
+# Shortest run of words treated as a chunk-boundary overlap
+MIN_BOUNDARY_OVERLAP = 5
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a piece of text"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def compact_whitespace(text: str) -> str:
+    """Strip indentation and trailing spaces, and collapse runs of blank lines"""
+    lines = [line.strip() for line in (text or '').splitlines()]
+    compacted = []
+    for line in lines:
+        if not line and compacted and not compacted[-1]:
+            continue
+        compacted.append(line)
+    return '\n'.join(compacted).strip()
+
+
+def _shingles(words: List[str]) -> set:
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _strip_boundary_overlap(previous: List[str], current: List[str]) -> List[str]:
+    """Drop the leading words of a chunk that repeat the tail of the previous chunk"""
+    longest = min(len(previous), len(current), 200)
+    for size in range(longest, MIN_BOUNDARY_OVERLAP - 1, -1):
+        if previous[-size:] == current[:size]:
+            return current[size:]
+    return current
+
+
+def _dedupe_aligned(snippets: List[str]) -> List[Optional[str]]:
+    """Deduplicate chunks of one document, returning None in place of each dropped chunk"""
+    results = []
+    kept_words = []
+    kept_shingles = []
+    for snippet in snippets:
+        words = snippet.split()
+        shingles = _shingles([word.lower() for word in words])
+        duplicate = not words or any(
+            len(shingles & seen) >= DUPLICATE_OVERLAP * len(shingles)
+            for seen in kept_shingles
+        )
+        if not duplicate:
+            for previous in kept_words:
+                words = _strip_boundary_overlap(previous, words)
+            duplicate = not words
+        if duplicate:
+            results.append(None)
+            continue
+        results.append(' '.join(words))
+        kept_words.append(words)
+        kept_shingles.append(shingles)
+    return results
+
+
+def dedupe_snippets(snippets: List[str]) -> List[str]:
+    """Remove repeated and overlapping chunks taken from the same document"""
+    return [snippet for snippet in _dedupe_aligned(snippets) if snippet is not None]
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Trim text to roughly max_tokens, preferring to cut at a sentence boundary"""
+    if max_tokens <= 0:
+        return ''
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+
+    trimmed = ''
+    for sentence in _SENTENCE_END.split(text):
+        candidate = f"{trimmed} {sentence}" if trimmed else sentence
+        if len(candidate) > max_chars:
+            break
+        trimmed = candidate
+    if not trimmed:
+        # First sentence alone is over budget, cut at a word boundary
+        trimmed = text[:max_chars].rsplit(' ', 1)[0]
+    return trimmed + ' ...'
+
+
+def budget_passages(passages: List[Dict[str, Any]], prompt_overhead: str,
+                    prompt_budget: int, passage_budget: int) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Deduplicate, trim and cap passages so the prompt fits the token budget.
+
+    Passages must be ordered best first; lower ranked passages are the ones
+    dropped when the budget runs out.
+    """
+    indexes_by_uri = {}
+    for index, passage in enumerate(passages):
+        indexes_by_uri.setdefault(passage['uri'], []).append(index)
+    unique_snippets = [None] * len(passages)
+    for indexes in indexes_by_uri.values():
+        deduped = _dedupe_aligned([passages[index]['snippet'] for index in indexes])
+        for index, snippet in zip(indexes, deduped):
+            unique_snippets[index] = snippet
+
+    overhead_tokens = estimate_tokens(prompt_overhead)
+    remaining = prompt_budget - overhead_tokens
+    budgeted = []
+    duplicates = 0
+    trimmed = 0
+    dropped = 0
+
+    for passage, snippet in zip(passages, unique_snippets):
+        if snippet is None:
+            duplicates += 1
+            continue
+        if remaining <= 0:
+            dropped += 1
+            continue
+        compacted = trim_to_tokens(snippet, min(passage_budget, remaining))
+        if compacted != passage['snippet']:
+            trimmed += 1
+        remaining -= estimate_tokens(compacted)
+        budgeted.append({**passage, 'snippet': compacted})
+
+    report = {
+        'prompt_budget': prompt_budget,
+        'passage_budget': passage_budget,
+        'passages_in': len(passages),
+        'duplicates_removed': duplicates,
+        'passages_trimmed': trimmed,
+        'passages_dropped': dropped,
+        'passages_out': len(budgeted)
+    }
+    return budgeted, report
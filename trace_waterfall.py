@@ -0,0 +1,89 @@
+"""Print trace waterfalls from exported spans.
+
+Reads the span files written with TRACE_EXPORT=file:<path> (app and API
+spans may be in separate files) or logs exported with TRACE_EXPORT=log, and
+prints one waterfall per trace: every span indented under its parent, with
+its offset from the start of the trace, its duration and a bar.
+
+    python trace_waterfall.py app_spans.jsonl api_spans.jsonl --slowest 3
+    python trace_waterfall.py spans.jsonl --trace-id 4bf92f3577b34da6a3ce929d0e0e4736
+"""
+import json
+import argparse
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from tracing import LOG_SPAN_PREFIX
+
+
+def load_spans(paths: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Spans grouped by trace ID"""
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if LOG_SPAN_PREFIX in line:
+                    line = line.split(LOG_SPAN_PREFIX, 1)[1]
+                line = line.strip()
+                if line.startswith('{'):
+                    span = json.loads(line)
+                    traces[span['trace_id']].append(span)
+    return traces
+
+
+def trace_bounds(spans: List[Dict[str, Any]]):
+    start = min(span['start_time'] for span in spans)
+    end = max(span['start_time'] + span['duration_ms'] / 1000 for span in spans)
+    return start, (end - start) * 1000
+
+
+def render_waterfall(trace_id: str, spans: List[Dict[str, Any]], width: int = 40) -> str:
+    start, total_ms = trace_bounds(spans)
+    span_ids = {span['span_id'] for span in spans}
+    children = defaultdict(list)
+    for span in spans:
+        # Spans whose parent was not exported (e.g. an unsampled caller) are shown as roots
+        parent = span['parent_span_id'] if span['parent_span_id'] in span_ids else None
+        children[parent].append(span)
+    for siblings in children.values():
+        siblings.sort(key=lambda span: span['start_time'])
+
+    lines = [f"trace {trace_id}  {total_ms:.1f} ms  {len(spans)} spans"]
+    scale = width / total_ms if total_ms else 0
+
+    def add(span, depth):
+        offset_ms = (span['start_time'] - start) * 1000
+        bar_start = int(offset_ms * scale)
+        bar = ' ' * bar_start + '█' * max(1, int(span['duration_ms'] * scale))
+        label = f"{'  ' * depth}{span['name']} [{span['service']}]"
+        status = ' ERROR' if span['status'] == 'error' else ''
+        lines.append(f"  {label:<50} {offset_ms:>9.1f} {span['duration_ms']:>9.1f} ms |{bar:<{width}}|{status}")
+        for child in children.get(span['span_id'], []):
+            add(child, depth + 1)
+
+    for root in children[None]:
+        add(root, 0)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print trace waterfalls from exported spans")
+    parser.add_argument('spans', nargs='+', help="Span JSONL files or exported logs")
+    parser.add_argument('--trace-id', help="Show only this trace")
+    parser.add_argument('--slowest', type=int, default=5, help="Show the N slowest traces")
+    parser.add_argument('--width', type=int, default=40, help="Width of the duration bars")
+    args = parser.parse_args()
+
+    traces = load_spans(args.spans)
+    if args.trace_id:
+        selected = [args.trace_id] if args.trace_id in traces else []
+    else:
+        selected = sorted(traces, key=lambda trace_id: trace_bounds(traces[trace_id])[1], reverse=True)
+        selected = selected[:args.slowest]
+    if not selected:
+        raise SystemExit("No matching traces found")
+    print('\n\n'.join(render_waterfall(trace_id, traces[trace_id], args.width) for trace_id in selected))
+
+
+if __name__ == "__main__":
+    main()
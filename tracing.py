@@ -0,0 +1,326 @@
+"""Minimal W3C trace-context tracing shared by the Streamlit app and the Lambda.
+
+Spans are kept in a context variable, so nested `with tracer.span(...)`
+blocks (and worker threads started with contextvars.copy_context()) form one
+trace. The app starts a trace per chat turn and sends it to the API as a
+`traceparent` header (https://www.w3.org/TR/trace-context/) and body field,
+since a non-proxy integration passes only the body; the Lambda continues it, so both sides' spans end up in one waterfall
+(trace_waterfall.py).
+
+Configured by TRACE_EXPORT:
+  - file:<path>   append spans as JSON lines
+  - log           log spans as JSON lines prefixed with TRACE_SPAN
+  - otlp:<url>    POST spans as OTLP/HTTP JSON to a collector, e.g. otlp:http://localhost:4318
+Unset, tracing is off and spans cost a context variable lookup.
+TRACE_SAMPLE_RATE is the share of new traces recorded (default 1).
+"""
+import os
+import re
+import json
+import time
+import random
+import logging
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LOG_SPAN_PREFIX = 'TRACE_SPAN '
+TRACEPARENT_PATTERN = re.compile(r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current_span = contextvars.ContextVar('trace_span', default=None)
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Trace ID, parent span ID and sampled flag of a traceparent header, None if invalid"""
+    match = TRACEPARENT_PATTERN.match((value or '').strip().lower())
+    if not match:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == 'ff' or trace_id == '0' * 32 or span_id == '0' * 16:
+        return None
+    return {'trace_id': trace_id, 'span_id': span_id, 'sampled': bool(int(flags, 16) & 1)}
+
+
+def format_traceparent(trace_id: str, span_id: str, sampled: bool = True) -> str:
+    return f"00-{trace_id}-{span_id}-{'01' if sampled else '00'}"
+
+
+class Span:
+    """One timed operation of a trace"""
+
+    def __init__(self, name: str, service: str, trace_id: str, parent_span_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self.name = name
+        self.service = service
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.attributes = attributes
+        self.status = 'ok'
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        if error is not None:
+            self.status = 'error'
+            self.attributes['error'] = f"{type(error).__name__}: {error}"
+
+    @property
+    def traceparent(self) -> str:
+        return format_traceparent(self.trace_id, self.span_id)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_span_id,
+            'name': self.name,
+            'service': self.service,
+            'start_time': round(self.start_time, 6),
+            'duration_ms': round(self.duration_ms, 3),
+            'status': self.status,
+            'attributes': self.attributes
+        }
+
+
+class FileSpanExporter:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]) -> None:
+        lines = ''.join(json.dumps(span.as_dict(), default=str) + '\n' for span in spans)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(lines)
+
+    def flush(self) -> None:
+        pass
+
+
+class LogSpanExporter:
+    """Spans as log lines, the simplest durable option inside Lambda"""
+
+    def export(self, spans: List[Span]) -> None:
+        for span in spans:
+            logger.info(LOG_SPAN_PREFIX + json.dumps(span.as_dict(), default=str))
+
+    def flush(self) -> None:
+        pass
+
+
+class OtlpHttpExporter:
+    """Buffer spans and POST them to an OTLP/HTTP collector's /v1/traces on flush"""
+
+    def __init__(self, endpoint: str, max_buffer: int = 512, timeout: float = 2.0):
+        self.url = endpoint.rstrip('/') + '/v1/traces'
+        self.max_buffer = max_buffer
+        self.timeout = timeout
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]) -> None:
+        with self._lock:
+            self._buffer.extend(spans)
+            full = len(self._buffer) >= self.max_buffer
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            spans, self._buffer = self._buffer, []
+        if not spans:
+            return
+        by_service = {}
+        for span in spans:
+            by_service.setdefault(span.service, []).append(otlp_span(span))
+        payload = {'resourceSpans': [
+            {
+                'resource': {'attributes': [otlp_attribute('service.name', service)]},
+                'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': service_spans}]
+            }
+            for service, service_spans in by_service.items()
+        ]}
+        request = urllib.request.Request(
+            self.url, data=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'}
+        )
+        try:
+            urllib.request.urlopen(request, timeout=self.timeout).read()
+        except Exception as e:
+            logger.warning(f"Dropped {len(spans)} spans, collector unavailable: {str(e)}")
+
+
+def otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def otlp_span(span: Span) -> Dict[str, Any]:
+    start_ns = int(span.start_time * 1e9)
+    return {
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'parentSpanId': span.parent_span_id or '',
+        'name': span.name,
+        'kind': 1,
+        'startTimeUnixNano': str(start_ns),
+        'endTimeUnixNano': str(start_ns + int(span.duration_ms * 1e6)),
+        'attributes': [otlp_attribute(key, value) for key, value in span.attributes.items()],
+        'status': {'code': 2 if span.status == 'error' else 1}
+    }
+
+
+def exporter_from_env():
+    target = os.environ.get('TRACE_EXPORT', '')
+    if target.startswith('file:'):
+        return FileSpanExporter(target[len('file:'):])
+    if target == 'log':
+        return LogSpanExporter()
+    if target.startswith('otlp:'):
+        return OtlpHttpExporter(target[len('otlp:'):])
+    if target:
+        logger.error(f"Unknown TRACE_EXPORT {target}, tracing is off")
+    return None
+
+
+class Tracer:
+    """Create spans for one service and hand finished ones to the exporter"""
+
+    def __init__(self, service: str, exporter=None, sample_rate: float = 1.0):
+        self.service = service
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @contextmanager
+    def span(self, name: str, traceparent: Optional[str] = None, root: bool = False, **attributes):
+        """Time the enclosed block as a span and make it the current one.
+
+        The span continues the trace in traceparent when given, else the
+        current span's trace; with root=True it starts a sampled new trace
+        when there is none. Otherwise nothing is recorded and None is yielded.
+        """
+        span = self.start_span(name, traceparent, root, **attributes)
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.end(e)
+            raise
+        else:
+            span.end()
+        finally:
+            _current_span.reset(token)
+            self.export(span)
+
+    def start_span(self, name: str, traceparent: Optional[str] = None, root: bool = False,
+                   **attributes) -> Optional[Span]:
+        """Span for a block that cannot use span(); the caller ends and exports it"""
+        if not self.enabled:
+            return None
+        remote = parse_traceparent(traceparent)
+        if remote:
+            if not remote['sampled']:
+                return None
+            return Span(name, self.service, remote['trace_id'], remote['span_id'], attributes)
+        parent = _current_span.get()
+        if parent is not None:
+            return Span(name, self.service, parent.trace_id, parent.span_id, attributes)
+        if root and random.random() < self.sample_rate:
+            return Span(name, self.service, os.urandom(16).hex(), None, attributes)
+        return None
+
+    def export(self, span: Span) -> None:
+        if span.duration_ms is None:
+            span.end()
+        try:
+            self.exporter.export([span])
+        except Exception as e:
+            logger.warning(f"Error exporting span: {str(e)}")
+
+    def flush(self) -> None:
+        if self.enabled:
+            self.exporter.flush()
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent header for the current span, None outside a recorded trace"""
+    span = _current_span.get()
+    return span.traceparent if span else None
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+_tracer = Tracer('unconfigured')
+_tracer_lock = threading.Lock()
+
+
+def configure_tracer(service: str) -> Tracer:
+    """Set up the process's tracer from the environment, once"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer.service == 'unconfigured':
+            _tracer = Tracer(service, exporter_from_env(), float(os.environ.get('TRACE_SAMPLE_RATE', 1.0)))
+        return _tracer
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def instrument_client(client) -> None:
+    """Record a span for every AWS API call the boto3 client makes within a trace"""
+    events = getattr(getattr(client, 'meta', None), 'events', None)
+    # Stand-ins such as LocalDynamoDB have no botocore event system
+    if not os.environ.get('TRACE_EXPORT') or events is None:
+        return
+    events.register('before-call', _before_aws_call)
+    events.register('after-call', _after_aws_call)
+    events.register('after-call-error', _after_aws_call_error)
+
+
+def _before_aws_call(model, context, **kwargs):
+    span = get_tracer().start_span(
+        f"{model.service_model.service_name}.{model.name}",
+        **{'aws.service': model.service_model.service_name, 'aws.operation': model.name}
+    )
+    if span is not None:
+        context['trace_span'] = span
+
+
+def _after_aws_call(http_response, context, **kwargs):
+    span = context.pop('trace_span', None)
+    if span is not None:
+        span.set('http.status_code', getattr(http_response, 'status_code', None))
+        span.end()
+        get_tracer().export(span)
+
+
+def _after_aws_call_error(exception, context, **kwargs):
+    span = context.pop('trace_span', None)
+    if span is not None:
+        span.end(exception)
+        get_tracer().export(span)
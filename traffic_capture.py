@@ -0,0 +1,268 @@
+import io
+import os
+import re
+import json
+import time
+import gzip
+import base64
+import random
+import hashlib
+import logging
+import threading
+import contextvars
+from typing import Any, Callable, Dict, List, Optional
+
+from bedrock_stubs import fixture_key
+
+logger = logging.getLogger()
+
+# Capture record of the request being served; worker threads that copy the context share it
+_current_record = contextvars.ContextVar('traffic_capture_record', default=None)
+
+# Prefix of capture records written to the log, so they can be pulled out of CloudWatch
+LOG_RECORD_PREFIX = 'TRAFFIC_CAPTURE '
+
+# Upstream operations whose requests and responses are captured, by module attribute
+CAPTURED_OPERATIONS = {
+    'client': ['retrieve_and_generate', 'retrieve'],
+    'bedrock_runtime': ['converse'],
+    'rerank_runtime': ['invoke_model']
+}
+
+# Request body fields kept in the envelope; everything else is dropped
+ENVELOPE_FIELDS = (
+    'user_query', 'sessionId', 'pipeline_mode', 'response_format', 'reference_detail',
+    'accept_encoding', 'use_warm_answers', 'action', 'ref_id', 'presign'
+)
+ENVELOPE_HEADERS = ('accept-encoding', 'content-type')
+
+DEFAULT_REDACTIONS = [
+    (r'[\w.+-]+@[\w-]+\.[\w.-]+', '[EMAIL]'),
+    (r'\b\d{3}-\d{2}-\d{4}\b', '[SSN]'),
+    (r'\b(?:\d[ -]?){13,16}\b', '[CARD]'),
+    (r'(?<!\w)(?:\+\d{1,3}[ .-]?)?\(?\d{3}\)?[ .-]?\d{3}[ .-]\d{4}\b', '[PHONE]'),
+    (r'\b\d{1,3}(?:\.\d{1,3}){3}\b', '[IP]')
+]
+
+# Kept verbatim: S3 locations are needed to rebuild references
+UNREDACTED_KEYS = ('uri',)
+
+
+class Redactor:
+    """Replace PII in strings and pseudonymize session IDs.
+
+    Redaction is deterministic, so a query redacted in the envelope and the
+    same query inside an upstream request redact to the same text, and
+    recorded upstream responses still match on replay.
+    """
+
+    def __init__(self, patterns: Optional[List[List[str]]] = None, salt: str = ''):
+        self.patterns = [(re.compile(pattern), replacement) for pattern, replacement in (patterns or DEFAULT_REDACTIONS)]
+        self.salt = salt
+
+    def text(self, value: str) -> str:
+        for pattern, replacement in self.patterns:
+            value = pattern.sub(replacement, value)
+        return value
+
+    def session_id(self, value: Optional[str]) -> Optional[str]:
+        if not value:
+            return value
+        return 'session-' + hashlib.sha256(f"{self.salt}{value}".encode()).hexdigest()[:24]
+
+    def value(self, value: Any, key: str = None) -> Any:
+        """Redact every string in a JSON-like value"""
+        if isinstance(value, dict):
+            return {item_key: self.value(item, item_key) for item_key, item in value.items()}
+        if isinstance(value, list):
+            return [self.value(item, key) for item in value]
+        if isinstance(value, str):
+            if key == 'sessionId':
+                return self.session_id(value)
+            if key in UNREDACTED_KEYS:
+                return value
+            return self.text(value)
+        return value
+
+
+class CapturingClient:
+    """Wrap a client and record its calls into the capture of the calling request"""
+
+    def __init__(self, client, capture: 'TrafficCapture', operations: List[str]):
+        self.client = client
+        self._capture = capture
+        self._operations = set(operations)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name not in self._operations:
+            return attribute
+
+        def capture(**request):
+            record = self._capture.current()
+            if record is None:
+                return attribute(**request)
+            start = time.perf_counter()
+            response = attribute(**request)
+            latency_ms = (time.perf_counter() - start) * 1000
+            if name == 'invoke_model':
+                payload = json.loads(response['body'].read())
+                response = {**response, 'body': io.BytesIO(json.dumps(payload).encode())}
+            else:
+                payload = {key: value for key, value in response.items() if key != 'ResponseMetadata'}
+            self._capture.add_upstream(record, name, request, payload, latency_ms)
+            return response
+
+        return capture
+
+
+class TrafficCapture:
+    """Opt-in capture of sampled requests to JSONL for replay_traffic.py.
+
+    Each sampled request is written as one record: the sanitized request
+    envelope, its stage timings, the shape of the response and every
+    upstream call it made (redacted request key, redacted response and
+    latency). destination is a file path, or 'log' to write records to the
+    log with LOG_RECORD_PREFIX (the only durable option inside Lambda).
+    """
+
+    def __init__(self, destination: str, sample_rate: float = 0.05, redactor: Optional[Redactor] = None,
+                 capture_upstream: bool = True):
+        self.destination = destination
+        self.sample_rate = sample_rate
+        self.redactor = redactor or Redactor()
+        self.capture_upstream = capture_upstream
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional['TrafficCapture']:
+        """Capture configured by TRAFFIC_CAPTURE_PATH, or None when it is unset"""
+        destination = os.environ.get('TRAFFIC_CAPTURE_PATH')
+        if not destination:
+            return None
+        patterns = os.environ.get('TRAFFIC_CAPTURE_REDACTIONS')
+        redactor = Redactor(
+            DEFAULT_REDACTIONS + json.loads(patterns) if patterns else None,
+            salt=os.environ.get('TRAFFIC_CAPTURE_SALT', '')
+        )
+        return cls(
+            destination,
+            sample_rate=float(os.environ.get('TRAFFIC_CAPTURE_SAMPLE_RATE', 0.05)),
+            redactor=redactor,
+            capture_upstream=os.environ.get('TRAFFIC_CAPTURE_UPSTREAM', 'true').lower() == 'true'
+        )
+
+    def install(self, module) -> None:
+        """Wrap the upstream clients of lambda_function so sampled requests record their calls"""
+        if not self.capture_upstream:
+            return
+        for name, operations in CAPTURED_OPERATIONS.items():
+            current = getattr(module, name)
+            if not isinstance(current, CapturingClient):
+                setattr(module, name, CapturingClient(current, self, operations))
+
+    def current(self) -> Optional[Dict[str, Any]]:
+        return _current_record.get()
+
+    def handle(self, event: Dict[str, Any], timer, handler: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Run handler, capturing the request if it is sampled"""
+        if random.random() >= self.sample_rate:
+            return handler()
+        record = {'captured_at': time.time(), 'upstream': []}
+        token = _current_record.set(record)
+        try:
+            response = handler()
+        finally:
+            _current_record.reset(token)
+        try:
+            record.update(self.envelope(event))
+            record['status_code'] = response.get('statusCode')
+            record['stage_timings_ms'] = timer.as_dict()
+            record['response'] = response_shape(response)
+            self.write(record)
+        except Exception as e:
+            # Capture must never fail the request it observes
+            logger.error(f"Error capturing request: {str(e)}")
+        return response
+
+    def envelope(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Request body and headers with only the fields the handler reads, PII redacted"""
+        body = event.get('body', event) if isinstance(event, dict) else {}
+        if isinstance(body, str):
+            body = json.loads(body)
+        headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+        request = {field: body[field] for field in ENVELOPE_FIELDS if field in body}
+        if isinstance(request.get('user_query'), str):
+            request['user_query'] = self.redactor.text(request['user_query'])
+        if 'sessionId' in request:
+            request['sessionId'] = self.redactor.session_id(request['sessionId'])
+        return {
+            'request': request,
+            'headers': {key: headers[key] for key in ENVELOPE_HEADERS if key in headers}
+        }
+
+    def add_upstream(self, record: Dict[str, Any], operation: str, request: Dict[str, Any],
+                     payload: Dict[str, Any], latency_ms: float) -> None:
+        redacted_request = self.redactor.value(request)
+        with self._lock:
+            record['upstream'].append({
+                'operation': operation,
+                # Key of the redacted request, which is what a replay of the redacted envelope sends
+                'key': fixture_key(operation, redacted_request),
+                'latency_ms': round(latency_ms, 3),
+                'response': self.redactor.value(payload)
+            })
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, default=str)
+        if self.destination == 'log':
+            logger.info(LOG_RECORD_PREFIX + line)
+            return
+        with self._lock:
+            with open(self.destination, 'a') as f:
+                f.write(line + '\n')
+
+
+def response_shape(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Size and structure of a handler response, without its content"""
+    body = response.get('body') or ''
+    shape = {
+        # Compact bodies that are not gzipped stay dicts, serialized by API Gateway
+        'body_bytes': len(json.dumps(body).encode('utf-8')) if isinstance(body, dict) else len(body),
+        'content_encoding': response.get('headers', {}).get('Content-Encoding')
+    }
+    if isinstance(body, dict):
+        payload = body
+    else:
+        try:
+            if response.get('isBase64Encoded'):
+                decoded = base64.b64decode(body)
+                if shape['content_encoding'] == 'gzip':
+                    decoded = gzip.decompress(decoded)
+                body = decoded.decode('utf-8')
+            payload = json.loads(body)
+        except (TypeError, ValueError, OSError):
+            return shape
+    if isinstance(payload, dict):
+        references = payload.get('detailed_references') or payload.get('references') or []
+        shape.update({
+            'keys': sorted(payload),
+            'answer_chars': len(payload.get('generated_response') or ''),
+            'references': len(references) if isinstance(references, list) else None
+        })
+    return shape
+
+
+def load_captures(paths: List[str]) -> List[Dict[str, Any]]:
+    """Capture records from JSONL files or exported logs, oldest first"""
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if LOG_RECORD_PREFIX in line:
+                    line = line.split(LOG_RECORD_PREFIX, 1)[1]
+                line = line.strip()
+                if line.startswith('{'):
+                    records.append(json.loads(line))
+    records.sort(key=lambda record: record['captured_at'])
+    return records
@@ -1,10 +1,15 @@
 import streamlit as st
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, List, Optional
 
 class UIComponents:
     
-    def __init__(self, feedback_handler=None):
+    def __init__(self, feedback_handler=None, reference_fetcher: Optional[Callable] = None,
+                 message_restorer: Optional[Callable] = None):
         self.feedback_handler = feedback_handler
+        # Fetches reference details left out of compact responses (APIClient.get_reference)
+        self.reference_fetcher = reference_fetcher
+        # Reloads messages compacted to stubs (SessionMemoryManager.restore_message)
+        self.message_restorer = message_restorer
         
     @staticmethod
     def load_custom_css() -> None:
@@ -25,10 +30,11 @@ class UIComponents:
         if role == "assistant":
             self._display_feedback_buttons(idx, message)
             if references:
-                self.show_references(references, idx)
+                self.show_references(references, idx, self.reference_fetcher)
 
     @staticmethod
-    def show_references(references: List[Dict[str, Any]], message_idx: int) -> None:
+    def show_references(references: List[Dict[str, Any]], message_idx: int,
+                        fetch_reference: Optional[Callable] = None) -> None:
         """Display references in a compact horizontal list format."""
         if not references:
             return
@@ -57,11 +63,27 @@ class UIComponents:
             
             if 0 <= st.session_state[ref_key] < len(references):
                 selected_ref = references[st.session_state[ref_key]]
-                UIComponents.display_reference_details(selected_ref)
+                UIComponents.display_reference_details(
+                    selected_ref,
+                    fetch_reference,
+                    key=f"{message_idx}_{st.session_state[ref_key]}",
+                    # Stub references are only fetched once the user picks one
+                    load_details=st.session_state[button_key]
+                )
 
     @staticmethod
-    def display_reference_details(ref: Dict[str, Any]) -> None:
-        """Display details for a single reference."""
+    def display_reference_details(ref: Dict[str, Any], fetch_reference: Optional[Callable] = None,
+                                  key: str = "", load_details: bool = True) -> None:
+        """Display details for a single reference, fetching what the response left out."""
+        can_fetch = fetch_reference is not None and bool(ref.get('ref_id'))
+        if 'snippet' not in ref and can_fetch and load_details:
+            detail = fetch_reference(ref['ref_id'])
+            if detail:
+                # Update the message in place so the fetch happens once per reference
+                ref['snippet'] = detail['snippet']
+            else:
+                st.warning("The reference details are no longer available.")
+
         st.markdown('<div class="reference-container">', unsafe_allow_html=True)
         
         if uri := ref.get('uri'):
@@ -85,6 +107,15 @@ class UIComponents:
                 ''', 
                 unsafe_allow_html=True
             )
+            if ref.get('snippet_truncated') and can_fetch:
+                if st.button("Show full excerpt", key=f"expand_ref_{key}"):
+                    detail = fetch_reference(ref['ref_id'])
+                    if detail:
+                        ref['snippet'] = detail['snippet']
+                        ref.pop('snippet_truncated', None)
+                        st.rerun()
+                    else:
+                        st.warning("The full excerpt is no longer available.")
         
         if presigned_url := ref.get('presigned_url'):
             st.markdown(
@@ -96,10 +127,19 @@ class UIComponents:
                 ''', 
                 unsafe_allow_html=True
             )
+        elif can_fetch:
+            # Presign only when the user actually opens the document
+            if st.button("View Source Document", key=f"presign_ref_{key}"):
+                detail = fetch_reference(ref['ref_id'], presign=True)
+                if detail and detail.get('presigned_url'):
+                    ref['presigned_url'] = detail['presigned_url']
+                    ref.setdefault('snippet', detail['snippet'])
+                    st.rerun()
+                else:
+                    st.warning("The source document link could not be created.")
         
         st.markdown('</div>', unsafe_allow_html=True)
 
-
     def display_chat_messages(self, messages: List[Dict[str, Any]]) -> None:
         """Display chat messages in the main window."""
         if not messages:  # Check if messages is empty
@@ -118,13 +158,25 @@ class UIComponents:
                 
             message_class = "user-message" if role == "user" else "assistant-message"
             st.markdown(f'<div class="{message_class}">{content}</div>', unsafe_allow_html=True)
+
+            if message.get("compacted"):
+                self._display_restore_button(idx)
+                continue
             
             # Only show feedback buttons for assistant messages
             if role == "assistant":
                 self._display_feedback_buttons(idx, message)
                 if references:
-                    self.show_references(references, idx)
+                    self.show_references(references, idx, self.reference_fetcher)
+
 
+    def _display_restore_button(self, idx: int) -> None:
+        """Offer to reload a message that was compacted to a preview."""
+        if self.message_restorer and st.button("Show full message", key=f"restore_msg_{idx}"):
+            if self.message_restorer(idx):
+                st.rerun()
+            else:
+                st.warning("The full message could not be loaded from the chat history.")
 
     def _display_feedback_buttons(self, idx, message):
         col1, col2, col3 = st.columns([0.1, 0.1, 0.8])
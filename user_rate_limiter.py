@@ -0,0 +1,251 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+from boto3.dynamodb.conditions import Attr
+
+from client_config import create_resource
+from concurrency_limiter import Overloaded
+
+logger = logging.getLogger()
+
+RATE_LIMIT_TABLE_SCHEMA = {
+    'KeySchema': [
+        {'AttributeName': 'bucket_key', 'KeyType': 'HASH'}
+    ],
+    'AttributeDefinitions': [
+        {'AttributeName': 'bucket_key', 'AttributeType': 'S'}
+    ],
+    'BillingMode': 'PAY_PER_REQUEST'
+}
+
+
+class RateLimited(Overloaded):
+    """One user exceeded their request rate; retry after retry_after seconds"""
+
+
+def refill(tokens: float, updated_at: float, now: float, capacity: float, refill_per_second: float) -> float:
+    """Tokens in a bucket at now, refilled since updated_at and capped at capacity"""
+    return min(capacity, tokens + max(0.0, now - updated_at) * refill_per_second)
+
+
+class RateLimitStore:
+    """Token bucket state shared by containers.
+
+    consume() refills the key's bucket, takes cost tokens if there are enough
+    and returns (allowed, retry_after seconds, tokens remaining).
+    """
+
+    def consume(self, key: str, capacity: float, refill_per_second: float,
+                cost: float = 1.0) -> Tuple[bool, float, float]:
+        raise NotImplementedError
+
+
+class InMemoryRateLimitStore(RateLimitStore):
+    """RateLimitStore for one process: per container in Lambda, per worker in the app"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, capacity: float, refill_per_second: float,
+                cost: float = 1.0) -> Tuple[bool, float, float]:
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = refill(tokens, updated_at, now, capacity, refill_per_second)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+        return allowed, 0.0 if allowed else (cost - tokens) / refill_per_second, tokens
+
+
+class DynamoDBRateLimitStore(RateLimitStore):
+    """RateLimitStore on a DynamoDB table keyed by bucket_key.
+
+    Buckets are updated optimistically: the write is conditional on the
+    bucket not having changed since it was read, and retried on conflict.
+    """
+
+    def __init__(self, table, max_attempts: int = 3):
+        self.table = table
+        self.max_attempts = max_attempts
+
+    def consume(self, key: str, capacity: float, refill_per_second: float,
+                cost: float = 1.0) -> Tuple[bool, float, float]:
+        for _ in range(self.max_attempts):
+            now = time.time()
+            item = self.table.get_item(Key={'bucket_key': key}, ConsistentRead=True).get('Item')
+            if item:
+                tokens = refill(float(item['tokens']), float(item['updated_at']), now, capacity, refill_per_second)
+                condition = Attr('updated_at').eq(item['updated_at'])
+            else:
+                tokens = capacity
+                condition = Attr('bucket_key').not_exists()
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            try:
+                self.table.put_item(
+                    Item={
+                        'bucket_key': key,
+                        'tokens': Decimal(str(round(tokens, 6))),
+                        'updated_at': Decimal(str(round(now, 6))),
+                        # A bucket left alone for this long is full again, so the item can expire
+                        'expires_at': int(now + capacity / refill_per_second) + 60
+                    },
+                    ConditionExpression=condition
+                )
+            except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+                continue
+            return allowed, 0.0 if allowed else (cost - tokens) / refill_per_second, tokens
+        # Another container keeps winning the race; let the request through rather than fail it
+        logger.warning(f"Rate limit bucket {key} is contended, allowing the request")
+        return True, 0.0, 0.0
+
+
+class UserRateLimiter:
+    """Token-bucket rate limit per user.
+
+    Each user may burst up to capacity requests, refilled at
+    refill_per_second. Requests over the limit raise RateLimited with the
+    time until the next token, which the handler turns into a 429 with a
+    Retry-After header.
+    """
+
+    def __init__(self, store: Optional[RateLimitStore] = None, capacity: float = 5,
+                 refill_per_second: float = 0.25):
+        self.store = store or InMemoryRateLimitStore()
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.counters = {'allowed': 0, 'limited': 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, shared: bool = True) -> Optional['UserRateLimiter']:
+        """Limiter configured by USER_RATE_LIMIT_PER_MINUTE, or None when it is unset.
+
+        USER_RATE_LIMIT_BURST is the bucket size. With shared, buckets are
+        kept in USER_RATE_LIMIT_TABLE when it is set, so the limit holds
+        across containers.
+        """
+        per_minute = os.environ.get('USER_RATE_LIMIT_PER_MINUTE')
+        if not per_minute:
+            return None
+        store = None
+        table_name = os.environ.get('USER_RATE_LIMIT_TABLE')
+        if shared and table_name:
+            store = DynamoDBRateLimitStore(create_resource('dynamodb', 'dynamodb').Table(table_name))
+        return cls(
+            store,
+            capacity=float(os.environ.get('USER_RATE_LIMIT_BURST', 5)),
+            refill_per_second=float(per_minute) / 60
+        )
+
+    def check(self, user_key: str, cost: float = 1.0) -> float:
+        """Take cost tokens from the user's bucket, returning the tokens left; RateLimited if there are too few"""
+        try:
+            allowed, retry_after, remaining = self.store.consume(
+                user_key, self.capacity, self.refill_per_second, cost
+            )
+        except Exception as e:
+            # The limit protects the service; an unavailable store must not take it down
+            logger.error(f"Rate limit store error, allowing the request: {str(e)}")
+            return self.capacity
+        with self._lock:
+            self.counters['allowed' if allowed else 'limited'] += 1
+        if not allowed:
+            raise RateLimited(f"Rate limit exceeded for {user_key}, retry after {retry_after:.1f}s", retry_after)
+        return remaining
+
+
+class FairScheduler:
+    """Admit at most max_concurrent requests at once, handing free slots to users in turn.
+
+    Waiting requests queue per user and a released slot goes to the next
+    user in round-robin order, so a user with many queued requests gets one
+    slot per turn instead of all of them. Requests that wait longer than
+    queue_timeout_seconds are rejected with Overloaded. max_concurrent=0
+    admits everything. Only a process serving many requests at once
+    (async_server.py) can queue; a Lambda container serves one at a time.
+    """
+
+    def __init__(self, max_concurrent: int = 0, queue_timeout_seconds: float = 5.0):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.in_flight = 0
+        self.counters = {'admitted': 0, 'queued': 0, 'rejected': 0}
+        self._queues = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'FairScheduler':
+        """Scheduler configured by FAIR_QUEUE_MAX_CONCURRENT (off when unset) and FAIR_QUEUE_TIMEOUT_MS"""
+        return cls(
+            max_concurrent=int(os.environ.get('FAIR_QUEUE_MAX_CONCURRENT', 0)),
+            queue_timeout_seconds=float(os.environ.get('FAIR_QUEUE_TIMEOUT_MS', 5000)) / 1000
+        )
+
+    @contextmanager
+    def slot(self, user_key: str):
+        """Hold one slot for the enclosed block"""
+        if not self.max_concurrent:
+            yield
+            return
+        self._acquire(user_key)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _acquire(self, user_key: str) -> None:
+        with self._lock:
+            if self.in_flight < self.max_concurrent and not self._queues:
+                self.in_flight += 1
+                self.counters['admitted'] += 1
+                return
+            self.counters['queued'] += 1
+            waiter = threading.Event()
+            self._queues.setdefault(user_key, deque()).append(waiter)
+        granted = waiter.wait(self.queue_timeout_seconds)
+        with self._lock:
+            # Also covers a slot granted between the timeout and taking the lock
+            if granted or waiter.is_set():
+                self.counters['admitted'] += 1
+                return
+            queue = self._queues[user_key]
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[user_key]
+            self.counters['rejected'] += 1
+        raise Overloaded(f"Request queue is full, retry after {self.queue_timeout_seconds:.1f}s",
+                         self.queue_timeout_seconds)
+
+    def _release(self) -> None:
+        with self._lock:
+            if not self._queues:
+                self.in_flight -= 1
+                return
+            # The slot passes straight to the oldest request of the next user in turn
+            user_key, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_key)
+            else:
+                del self._queues[user_key]
+            waiter.set()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'in_flight': self.in_flight,
+                'waiting_users': len(self._queues),
+                'waiting': sum(len(queue) for queue in self._queues.values()),
+                **self.counters
+            }
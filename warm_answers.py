@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import logging
+import threading
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional
+
+from client_config import create_client, create_resource
+from query_features import normalize_query
+
+logger = logging.getLogger()
+
+WARM_ANSWERS_TABLE_SCHEMA = {
+    'KeySchema': [
+        {'AttributeName': 'query_key', 'KeyType': 'HASH'}
+    ],
+    'AttributeDefinitions': [
+        {'AttributeName': 'query_key', 'AttributeType': 'S'}
+    ],
+    'BillingMode': 'PAY_PER_REQUEST'
+}
+
+
+def knowledge_base_version(agent_client, knowledge_base_id: str) -> str:
+    """Identify the knowledge base content by the latest completed ingestion job of each data source"""
+    versions = []
+    data_sources = agent_client.list_data_sources(knowledgeBaseId=knowledge_base_id, maxResults=100)
+    for data_source in data_sources.get('dataSourceSummaries', []):
+        jobs = agent_client.list_ingestion_jobs(
+            knowledgeBaseId=knowledge_base_id,
+            dataSourceId=data_source['dataSourceId'],
+            filters=[{'attribute': 'STATUS', 'operator': 'EQ', 'values': ['COMPLETE']}],
+            sortBy={'attribute': 'STARTED_AT', 'order': 'DESCENDING'},
+            maxResults=1
+        ).get('ingestionJobSummaries', [])
+        latest = jobs[0]['ingestionJobId'] if jobs else 'none'
+        versions.append(f"{data_source['dataSourceId']}:{latest}")
+    return ','.join(sorted(versions)) or 'empty'
+
+
+def answer_key(user_query: str, pipeline_mode: str) -> str:
+    return f"{pipeline_mode}#{normalize_query(user_query)}"
+
+
+class WarmAnswerStore:
+    """Precomputed answers for frequent queries, keyed by pipeline mode and normalized query.
+
+    Every answer records the knowledge base version it was computed against.
+    The current version is looked up at most every version_ttl_seconds per
+    container, and answers from an older version are ignored, so a re-sync
+    invalidates the store without deleting anything; DynamoDB TTL on
+    expires_at cleans up afterwards.
+    """
+
+    def __init__(self, table_name: str, version_source: Callable[[], str],
+                 version_ttl_seconds: float = 60, max_age_seconds: float = 86400, dynamodb=None):
+        self.table_name = table_name
+        self.version_source = version_source
+        self.version_ttl_seconds = version_ttl_seconds
+        self.max_age_seconds = max_age_seconds
+        self._dynamodb = dynamodb
+        self._table = None
+        self._version = None
+        self._version_checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, knowledge_base_id: str) -> Optional['WarmAnswerStore']:
+        """Store configured from WARM_ANSWERS_*; None when WARM_ANSWERS_TABLE is not set"""
+        table_name = os.environ.get('WARM_ANSWERS_TABLE')
+        if not table_name:
+            return None
+        agent_client = create_client('bedrock-agent', 'control')
+        return cls(
+            table_name,
+            lambda: knowledge_base_version(agent_client, knowledge_base_id),
+            version_ttl_seconds=float(os.environ.get('WARM_ANSWERS_VERSION_TTL_SECONDS', 60)),
+            max_age_seconds=float(os.environ.get('WARM_ANSWERS_MAX_AGE_SECONDS', 86400))
+        )
+
+    @property
+    def table(self):
+        if self._table is None:
+            dynamodb = self._dynamodb or create_resource('dynamodb', 'dynamodb')
+            self._table = dynamodb.Table(self.table_name)
+        return self._table
+
+    def current_version(self) -> str:
+        with self._lock:
+            if self._version is None or time.monotonic() - self._version_checked_at >= self.version_ttl_seconds:
+                self._version = self.version_source()
+                self._version_checked_at = time.monotonic()
+            return self._version
+
+    def invalidate(self) -> None:
+        """Forget the cached knowledge base version so the next lookup re-checks it"""
+        with self._lock:
+            self._version = None
+
+    def get(self, user_query: str, pipeline_mode: str) -> Optional[Dict[str, Any]]:
+        """The warm answer for a query, or None if missing, stale or from an older knowledge base"""
+        item = self.table.get_item(Key={'query_key': answer_key(user_query, pipeline_mode)}).get('Item')
+        if not item:
+            return None
+        if time.time() - float(item['created_at']) > self.max_age_seconds:
+            return None
+        if item['kb_version'] != self.current_version():
+            logger.info("Warm answer is from an older knowledge base version, ignoring it")
+            return None
+        return {
+            **json.loads(item['answer']),
+            'age_seconds': round(time.time() - float(item['created_at']), 1),
+            'query_count': int(item.get('query_count', 0))
+        }
+
+    def put(self, user_query: str, pipeline_mode: str, answer: Dict[str, Any], query_count: int = 0) -> None:
+        now = time.time()
+        self.table.put_item(Item={
+            'query_key': answer_key(user_query, pipeline_mode),
+            'query': normalize_query(user_query),
+            'pipeline_mode': pipeline_mode,
+            'answer': json.dumps(answer),
+            'kb_version': self.current_version(),
+            'query_count': query_count,
+            'created_at': Decimal(str(now)),
+            'expires_at': int(now + self.max_age_seconds)
+        })
+
+    def delete_all(self) -> int:
+        """Delete every warm answer, e.g. after a knowledge base re-sync"""
+        deleted = 0
+        scan_kwargs = {'ProjectionExpression': 'query_key'}
+        with self.table.batch_writer() as batch:
+            while True:
+                response = self.table.scan(**scan_kwargs)
+                for item in response.get('Items', []):
+                    batch.delete_item(Key={'query_key': item['query_key']})
+                    deleted += 1
+                if 'LastEvaluatedKey' not in response:
+                    break
+                scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        self.invalidate()
+        return deleted
+
+
+def strip_presigned_urls(references: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """References without their presigned URLs, which expire long before a warm answer does"""
+    return [
+        {key: value for key, value in ref.items() if key != 'presigned_url'}
+        for ref in references
+    ]